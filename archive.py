@@ -0,0 +1,160 @@
+import os
+import zlib
+import tarfile
+import zipfile
+from http_io import FileRegion
+
+# Size of the pieces read from disk and handed to the sender
+BLOCK_SIZE = 64 * 1024
+
+ARCHIVE_FORMATS = ('tar', 'zip')
+
+
+def walk_tree(fs_path, root, skip=None):
+    """
+    Yield (abs_path, arcname, stat_result, is_dir) for a directory tree in
+    sorted order. Symlinks are skipped so the archive never reaches outside
+    the served directory, as is any path for which skip(path) is true.
+    Entries deleted while the tree is being walked are left out.
+    """
+    yield fs_path, root, os.stat(fs_path), True
+    for dirpath, dirnames, filenames in os.walk(fs_path):
+        dirnames[:] = sorted(d for d in dirnames
+                             if not os.path.islink(os.path.join(dirpath, d))
+                             and not (skip and skip(os.path.join(dirpath, d))))
+        rel_dir = os.path.relpath(dirpath, fs_path)
+        prefix = root if rel_dir == '.' else os.path.join(root, rel_dir)
+        for name in dirnames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            yield path, os.path.join(prefix, name), st, True
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                continue
+            try:
+                st = os.stat(path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            yield path, os.path.join(prefix, name), st, False
+
+
+def read_blocks(path, size):
+    """
+    Yield exactly `size` bytes of a file in BLOCK_SIZE pieces, padding with
+    NUL if the file shrank (or was deleted) after it was stat()ed.
+    """
+    remaining = size
+    try:
+        with open(path, 'rb') as f:
+            while remaining > 0:
+                data = f.read(min(BLOCK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+    except (FileNotFoundError, NotADirectoryError):
+        pass
+    if remaining > 0:
+        yield b'\0' * remaining
+
+
+def tar_stream(fs_path, root, skip=None):
+    """
+    Yield an uncompressed tar archive. Headers are built with tarfile, file
+    data is passed on as FileRegion so blocking senders can sendfile() it.
+    """
+    for path, arcname, st, is_dir in walk_tree(fs_path, root, skip):
+        info = tarfile.TarInfo(arcname + '/' if is_dir else arcname)
+        info.type = tarfile.DIRTYPE if is_dir else tarfile.REGTYPE
+        info.mode = st.st_mode & 0o7777
+        info.mtime = int(st.st_mtime)
+        info.size = 0 if is_dir else st.st_size
+        yield info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+        if is_dir or not info.size:
+            continue
+        for offset in range(0, info.size, BLOCK_SIZE * 16):
+            yield FileRegion(path, offset, min(BLOCK_SIZE * 16, info.size - offset))
+        padding = -info.size % tarfile.BLOCKSIZE
+        if padding:
+            yield b'\0' * padding
+    # End-of-archive marker: two empty blocks
+    yield b'\0' * (2 * tarfile.BLOCKSIZE)
+
+
+def gzip_stream(pieces):
+    """
+    Gzip-compress a stream of bytes / FileRegion pieces on the fly.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for piece in pieces:
+        data = piece.read() if isinstance(piece, FileRegion) else piece
+        out = compressor.compress(data)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+class _Sink:
+    """
+    Write-only, non-seekable file object that zipfile writes into; the
+    generator drains it after every block so memory stays constant.
+    """
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def zip_stream(fs_path, root, compress, skip=None):
+    """
+    Yield a zip archive. zipfile falls back to data descriptors on a
+    non-seekable sink, so entries are written in a single pass.
+    """
+    sink = _Sink()
+    method = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    with zipfile.ZipFile(sink, 'w', compression=method, allowZip64=True) as zf:
+        for path, arcname, st, is_dir in walk_tree(fs_path, root, skip):
+            if is_dir:
+                zf.writestr(arcname + '/', b'')
+                yield sink.drain()
+                continue
+            try:
+                info = zipfile.ZipInfo.from_file(path, arcname)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            info.compress_type = method
+            with zf.open(info, 'w', force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as entry:
+                for data in read_blocks(path, info.file_size):
+                    entry.write(data)
+                    out = sink.drain()
+                    if out:
+                        yield out
+            yield sink.drain()
+    yield sink.drain()
+
+
+def archive_stream(fmt, fs_path, root, compress=False, skip=None):
+    """
+    Return (chunks, content_type, file_extension) for streaming `fs_path`
+    as `fmt` ('tar' or 'zip'). For tar, compress means .tar.gz; for zip it
+    means deflate entries.
+    """
+    if fmt == 'zip':
+        return zip_stream(fs_path, root, compress, skip), 'application/zip', '.zip'
+    if compress:
+        return gzip_stream(tar_stream(fs_path, root, skip)), 'application/gzip', '.tar.gz'
+    return tar_stream(fs_path, root, skip), 'application/x-tar', '.tar'
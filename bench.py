@@ -0,0 +1,260 @@
+import os
+import sys
+import time
+import socket
+import signal
+import argparse
+import subprocess
+import threading
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+def summarize(latencies, errors, elapsed):
+    """
+    Latency distribution (ms) and throughput for a finished run.
+    """
+    lat = sorted(latencies)
+    return {
+        'requests': len(lat),
+        'errors': errors,
+        'rps': len(lat) / elapsed if elapsed else 0.0,
+        'p50': percentile(lat, 50) * 1000,
+        'p90': percentile(lat, 90) * 1000,
+        'p99': percentile(lat, 99) * 1000,
+        'max': (lat[-1] if lat else 0.0) * 1000,
+    }
+
+
+def fetch(address, request, timeout=30):
+    """
+    Send one raw request on a new connection and read until close.
+    Returns (status_code, response_bytes).
+    """
+    with socket.create_connection(address, timeout=timeout) as sock:
+        sock.sendall(request)
+        parts = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            parts.append(chunk)
+    response = b''.join(parts)
+    try:
+        status = int(response.split(b' ', 2)[1])
+    except (IndexError, ValueError):
+        status = 0
+    return status, response
+
+
+def run_load(address, path, total, concurrency, upload=None):
+    """
+    Issue `total` GET requests over `concurrency` client threads, or with
+    `upload` (bytes) POST that body to /upload<path> instead.
+    """
+    request = f"GET {path} HTTP/1.0\r\nHost: {address[0]}\r\n\r\n".encode()
+    if upload is not None:
+        request = (f"POST /upload{path} HTTP/1.0\r\nHost: {address[0]}\r\n"
+                   f"Content-Length: {len(upload)}\r\n\r\n").encode() + upload
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def client():
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    return
+            start = time.perf_counter()
+            try:
+                status, _ = fetch(address, request)
+                ok = 200 <= status < 400
+            except OSError:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+def background_load(address, path, concurrency):
+    """
+    Keep `concurrency` clients fetching `path` (e.g. a large file) in a
+    loop until the returned event is set; used to measure how small
+    requests fare next to large transfers.
+    """
+    request = f"GET {path} HTTP/1.0\r\nHost: {address[0]}\r\n\r\n".encode()
+    stop = threading.Event()
+
+    def client():
+        while not stop.is_set():
+            try:
+                fetch(address, request, timeout=120)
+            except OSError:
+                time.sleep(0.1)
+
+    for _ in range(concurrency):
+        threading.Thread(target=client, daemon=True).start()
+    return stop
+
+
+def tree_rss_kb(pid):
+    """
+    Resident memory of a process and all its descendants, from /proc.
+    """
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, []))
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+
+def wait_for_port(address, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(address, timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+@contextmanager
+def serving(mode, port, serve_args=(), python=None):
+    """
+    Run `python -m progjar serve --mode <mode>` on `port` for the duration
+    of the with-block, then drain it with SIGTERM. Yields the Popen.
+    `python` picks another interpreter (e.g. a free-threaded build).
+    """
+    cmd = [python or sys.executable, '-m', 'progjar', 'serve', '--mode', mode, '--port', str(port)]
+    cmd += list(serve_args)
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_port(('localhost', port)):
+            raise RuntimeError(f"{mode} server did not start on port {port}")
+        yield proc
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def bench_mode(mode, port, args):
+    """
+    Start the server for `mode`, run the load against it and record RSS
+    right after the run.
+    """
+    with serving(mode, port, args.serve_args, args.python) as proc:
+        run_load(('localhost', port), args.path, min(args.requests, 100), args.concurrency,
+                 upload_body(args))  # warm-up
+        result = run_with_background(('localhost', port), args)
+        result['rss_mb'] = tree_rss_kb(proc.pid) / 1024.0
+        return result
+
+
+def run_with_background(address, args):
+    stop = None
+    if args.background:
+        stop = background_load(address, args.background, args.background_clients)
+        time.sleep(0.5)
+    try:
+        return run_load(address, args.path, args.requests, args.concurrency, upload_body(args))
+    finally:
+        if stop is not None:
+            stop.set()
+
+
+def upload_body(args):
+    return os.urandom(args.upload) if args.upload else None
+
+
+def print_table(rows):
+    print(f"{'target':<14}{'reqs':>8}{'errs':>6}{'req/s':>10}{'p50 ms':>9}{'p90 ms':>9}"
+          f"{'p99 ms':>9}{'max ms':>9}{'RSS MB':>9}")
+    for name, r in rows:
+        rss = f"{r['rss_mb']:>9.1f}" if 'rss_mb' in r else f"{'-':>9}"
+        print(f"{name:<14}{r['requests']:>8}{r['errors']:>6}{r['rps']:>10.0f}{r['p50']:>9.2f}"
+              f"{r['p90']:>9.2f}{r['p99']:>9.2f}{r['max']:>9.2f}{rss}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Closed-loop load generator. Either hit a running server '
+                    '(--target) or start each mode in turn and compare (--modes).')
+    parser.add_argument('--target', help='host:port of a running server')
+    parser.add_argument('--modes', help='comma-separated progjar modes, e.g. threadpool,asyncio,reactor')
+    parser.add_argument('--port', type=int, default=18500, help='first port used with --modes')
+    parser.add_argument('--path', default='/testing.txt')
+    parser.add_argument('-n', '--requests', type=int, default=2000)
+    parser.add_argument('-c', '--concurrency', type=int, default=50)
+    parser.add_argument('--background', metavar='PATH',
+                        help='keep fetching PATH (e.g. a large file) while measuring --path')
+    parser.add_argument('-b', '--background-clients', type=int, default=8,
+                        help='concurrent clients for --background')
+    parser.add_argument('--upload', type=int, metavar='BYTES',
+                        help='POST a BYTES-long body to /upload<path> instead of GET <path>')
+    parser.add_argument('--python', help='interpreter that runs the servers started for --modes')
+    parser.add_argument('serve_args', nargs=argparse.REMAINDER,
+                        help='extra `progjar serve` options after --, e.g. -- --workers 8')
+    args = parser.parse_args(argv)
+    if args.serve_args[:1] == ['--']:
+        args.serve_args = args.serve_args[1:]
+
+    rows = []
+    if args.target:
+        host, port = args.target.rsplit(':', 1)
+        rows.append((args.target, run_with_background((host, int(port)), args)))
+    if args.modes:
+        for i, mode in enumerate(args.modes.split(',')):
+            rows.append((mode, bench_mode(mode.strip(), args.port + i, args)))
+    if not rows:
+        parser.error('give --target or --modes')
+    print_table(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
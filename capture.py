@@ -0,0 +1,82 @@
+import os
+import struct
+from collections import namedtuple
+
+# Capture log: MAGIC, then one record per request:
+#   RECORD (little endian) followed by `path_len` bytes of UTF-8 path
+#   time      f64  wall clock when the request reached the handler
+#   method    u8   index into METHODS
+#   status    u16
+#   req_size  u64  request body bytes
+#   resp_size u64  response body bytes, UNKNOWN_SIZE when streamed
+#   duration  f32  seconds spent in the handler
+#   path_len  u16
+# Bodies are never recorded, only their sizes.
+MAGIC = b'PJCAP1\n'
+RECORD = struct.Struct('<dBHQQfH')
+METHODS = ('GET', 'POST', 'DELETE', 'OTHER')
+UNKNOWN_SIZE = 2 ** 64 - 1
+
+Record = namedtuple('Record', 'time method status req_size resp_size duration path')
+
+
+class CaptureLog:
+    """
+    Append-only capture of request metadata. The file is unbuffered and
+    opened in append mode, so every record goes out in a single write():
+    records from the threads and forked workers sharing it never
+    interleave, and nothing is lost when a worker exits without flushing.
+    """
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.file = open(self.path, 'ab', buffering=0)
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def record(self, started, method, path, req_size, status, resp_size, duration):
+        code = METHODS.index(method) if method in METHODS else len(METHODS) - 1
+        raw_path = path.encode('utf-8', 'replace')[:0xffff]
+        try:
+            self.file.write(RECORD.pack(started, code, status, req_size, resp_size,
+                                        duration, len(raw_path)) + raw_path)
+        except ValueError:
+            # Closed by a config reload while this request was running
+            pass
+
+    def close(self):
+        self.file.close()
+
+
+def response_info(response):
+    """
+    (status, body size) of an HttpServer response; streamed bodies have
+    no size until they are sent.
+    """
+    if isinstance(response, (bytes, bytearray)):
+        head_end = response.find(b'\r\n\r\n')
+        try:
+            status = int(response[9:12])
+        except ValueError:
+            status = 0
+        return status, len(response) - head_end - 4 if head_end >= 0 else 0
+    return response.status, UNKNOWN_SIZE
+
+
+def read_capture(path):
+    """
+    Yield the Records of a capture log in file order.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a capture log")
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            started, code, status, req_size, resp_size, duration, path_len = RECORD.unpack(head)
+            raw_path = f.read(path_len)
+            if len(raw_path) < path_len:
+                return
+            yield Record(started, METHODS[code], status, req_size,
+                         None if resp_size == UNKNOWN_SIZE else resp_size,
+                         duration, raw_path.decode('utf-8', 'replace'))
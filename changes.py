@@ -0,0 +1,238 @@
+import os
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+import weakref
+import threading
+from itertools import islice
+from collections import deque, namedtuple
+
+# Events kept in memory; older cursors get a reset and must relist
+EVENT_BUFFER = 4096
+# The same change seen twice within this many seconds (our own write, then
+# its inotify echo) is reported once
+DEDUP_WINDOW = 2.0
+
+Event = namedtuple('Event', 'seq kind path time')
+
+
+class ChangeFeed:
+    """
+    In-memory feed of create/delete events for paths under the docroot,
+    numbered by a sequence in a ring buffer of EVENT_BUFFER events.
+    Cursors are "<epoch>:<seq>"; the epoch changes whenever a feed is
+    created (server start, reload, each forked worker), so a cursor from
+    another feed is detected and answered with a reset.
+
+    Blocking readers wait on a Condition; event-loop servers register a
+    listener callback, called from the publishing thread, to wake up.
+    """
+    def __init__(self, size=EVENT_BUFFER):
+        self.epoch = f"{os.getpid():x}{time.time_ns() // 1000:x}"
+        self.events = deque(maxlen=size)
+        self.seq = 0
+        self.cond = threading.Condition()
+        self.listeners = []
+        self.recent = {}
+
+    def cursor(self, seq):
+        return f"{self.epoch}:{seq}"
+
+    def publish(self, kind, path):
+        now = time.monotonic()
+        with self.cond:
+            last = self.recent.get(path)
+            if last is not None and last[0] == kind and now - last[1] < DEDUP_WINDOW:
+                return
+            self.recent[path] = (kind, now)
+            if len(self.recent) > self.events.maxlen:
+                self.recent = {p: v for p, v in self.recent.items() if now - v[1] < DEDUP_WINDOW}
+            self.seq += 1
+            self.events.append(Event(self.seq, kind, path, time.time()))
+            self.cond.notify_all()
+            listeners = list(self.listeners)
+        for callback in listeners:
+            callback()
+
+    def resolve(self, cursor):
+        """
+        Turn a client cursor into (seq, reset). No cursor starts at the
+        current position; an unknown or future cursor asks for a reset.
+        """
+        with self.cond:
+            if not cursor:
+                return self.seq, False
+            epoch, _, seq = cursor.partition(':')
+            try:
+                seq = int(seq)
+            except ValueError:
+                return self.seq, True
+            if epoch != self.epoch or seq > self.seq:
+                return self.seq, True
+            return seq, False
+
+    def read(self, seq):
+        """
+        Events after seq as (events, latest_seq, lost); lost is true if
+        some of them already fell out of the buffer.
+        """
+        with self.cond:
+            if not self.events or seq >= self.seq:
+                return [], self.seq, False
+            first = self.events[0].seq
+            if seq < first - 1:
+                return [], self.seq, True
+            # Sequence numbers are contiguous: the new events are the last
+            # self.seq - seq ones, so only those are copied
+            events = list(islice(reversed(self.events), self.seq - seq))
+            events.reverse()
+            return events, self.seq, False
+
+    def wait(self, seq, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > seq, max(0.0, timeout))
+
+    def listen(self, callback):
+        with self.cond:
+            self.listeners.append(callback)
+
+    def unlisten(self, callback):
+        with self.cond:
+            if callback in self.listeners:
+                self.listeners.remove(callback)
+
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class InotifyWatcher(threading.Thread):
+    """
+    Publish changes made to the tree by anyone (other workers, other
+    programs) into a ChangeFeed, through inotify called with ctypes.
+    Every directory gets a watch; new directories are watched as they
+    appear. The thread holds the feed weakly and exits once the feed is
+    gone (e.g. replaced by a config reload).
+    """
+    def __init__(self, feed, basedir, skip=None):
+        super().__init__(name='inotify', daemon=True)
+        self.feed = weakref.ref(feed)
+        self.basedir = basedir
+        self.skip = skip
+        self.watches = {}
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.add_tree(basedir)
+
+    @classmethod
+    def start_for(cls, feed, basedir, skip=None):
+        """
+        Start a watcher, or log and return None where inotify is not
+        available (feed then only carries the server's own changes).
+        """
+        try:
+            watcher = cls(feed, basedir, skip)
+        except (OSError, AttributeError) as e:
+            logging.warning(f"Change feed: inotify unavailable ({e}), only own changes are reported")
+            return None
+        watcher.start()
+        return watcher
+
+    def url_path(self, fs_path, is_dir=False):
+        rel = os.path.relpath(fs_path, self.basedir).replace(os.sep, '/')
+        return '/' + rel + ('/' if is_dir else '')
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            logging.warning(f"Change feed: cannot watch {path}: {os.strerror(ctypes.get_errno())}")
+            return False
+        self.watches[wd] = path
+        return True
+
+    def add_tree(self, top, announce=False):
+        """
+        Watch top and every directory below it. With announce, files and
+        directories already there are published as created: they may have
+        appeared before the watch was in place.
+        """
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames[:] = [d for d in dirnames
+                           if not os.path.islink(os.path.join(dirpath, d))
+                           and not (self.skip and self.skip(os.path.join(dirpath, d)))]
+            if not self.add_watch(dirpath):
+                dirnames[:] = []
+                continue
+            if announce:
+                feed = self.feed()
+                if feed is None:
+                    return
+                for name in dirnames:
+                    feed.publish('create', self.url_path(os.path.join(dirpath, name), True))
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    if not (self.skip and self.skip(path)):
+                        feed.publish('create', self.url_path(path))
+
+    def run(self):
+        # poll(), not select(): select() fails on descriptors >= FD_SETSIZE
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        try:
+            while True:
+                readable = poller.poll(1000)
+                if self.feed() is None:
+                    return
+                if readable:
+                    self.handle(os.read(self.fd, 64 * 1024))
+        except Exception as e:
+            logging.error(f"Change feed: inotify watcher stopped: {e}")
+        finally:
+            os.close(self.fd)
+
+    def handle(self, data):
+        feed = self.feed()
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data) and feed is not None:
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("Change feed: inotify queue overflowed, events were lost")
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            parent = self.watches.get(wd)
+            if parent is None or not name:
+                continue
+            path = os.path.join(parent, os.fsdecode(name))
+            if self.skip and self.skip(path):
+                continue
+
+            is_dir = bool(mask & IN_ISDIR)
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                feed.publish('delete', self.url_path(path, is_dir))
+            elif is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                feed.publish('create', self.url_path(path, True))
+                self.add_tree(path, announce=True)
+            elif not is_dir and mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                feed.publish('create', self.url_path(path))
@@ -1,6 +1,9 @@
-import socket
-import sys
+import io
 import os
+import sys
+import json
+import socket
+import tarfile
 
 def send_request(request_bytes):
     """
@@ -26,6 +29,79 @@ def send_request(request_bytes):
         return f"Error: {e}".encode()
 
 
+def stream_request(request_bytes):
+    """
+    Like send_request(), but print the response body as it arrives.
+    Used by the bulk commands, whose per-item results are streamed.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(server_address)
+    sock.sendall(request_bytes)
+
+    head = b""
+    while b"\r\n\r\n" not in head:
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        head += chunk
+    header, _, body = head.partition(b"\r\n\r\n")
+    print("<- Server Response")
+    print(header.decode())
+    print()
+    while True:
+        if body:
+            sys.stdout.write(body.decode(errors="replace"))
+            sys.stdout.flush()
+        body = sock.recv(4096)
+        if not body:
+            break
+    sock.close()
+
+
+def bulk_upload(server_address, remote_dir, local_paths):
+    """
+    Upload many local files in one request: pack them into a tar stream
+    and POST it to /_batch/upload. Files land under remote_dir/.
+    """
+    print(f"\n-> Bulk uploading {len(local_paths)} file(s) to '{remote_dir}' on {server_address}")
+    missing = [p for p in local_paths if not os.path.isfile(p)]
+    if missing:
+        print(f"Error: local file(s) not found: {', '.join(missing)}")
+        return
+
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for path in local_paths:
+            arcname = os.path.join(remote_dir, os.path.basename(path)).lstrip('/')
+            tar.add(path, arcname=arcname)
+    content = buf.getvalue()
+
+    header = (
+        "POST /_batch/upload HTTP/1.0\r\n"
+        f"Host: {server_address[0]}\r\n"
+        "Content-Type: application/x-tar\r\n"
+        f"Content-Length: {len(content)}\r\n"
+        "\r\n"
+    )
+    stream_request(header.encode() + content)
+
+
+def bulk_request(server_address, op, remote_names):
+    """
+    Delete or stat many remote files in one request (/_batch/delete, /_batch/stat).
+    """
+    print(f"\n-> Bulk {op} of {len(remote_names)} file(s) on {server_address}")
+    content = json.dumps(remote_names).encode()
+    header = (
+        f"POST /_batch/{op} HTTP/1.0\r\n"
+        f"Host: {server_address[0]}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(content)}\r\n"
+        "\r\n"
+    )
+    stream_request(header.encode() + content)
+
+
 def list_files(server_address, directory):
     """
     Send a GET request to list the contents of a directory.
@@ -94,12 +170,18 @@ if __name__ == "__main__":
       python client_advanced.py host:port list [directory]
       python client_advanced.py host:port upload local_file remote_file
       python client_advanced.py host:port delete remote_file
+      python client_advanced.py host:port bulk-upload remote_dir local_file [local_file ...]
+      python client_advanced.py host:port bulk-delete remote_file [remote_file ...]
+      python client_advanced.py host:port bulk-stat remote_file [remote_file ...]
     """
     if len(sys.argv) < 3:
         print("Usage:")
         print("  python client_advanced.py host:port list [directory]")
         print("  python client_advanced.py host:port upload [local_file] [remote_file]")
         print("  python client_advanced.py host:port delete [remote_file]")
+        print("  python client_advanced.py host:port bulk-upload [remote_dir] [local_file ...]")
+        print("  python client_advanced.py host:port bulk-delete [remote_file ...]")
+        print("  python client_advanced.py host:port bulk-stat [remote_file ...]")
         sys.exit(1)
 
     host, port_str = sys.argv[1].split(':')
@@ -119,6 +201,16 @@ if __name__ == "__main__":
             print("Usage: python client_advanced.py host:port delete remote_file")
             sys.exit(1)
         delete_file(server_address, sys.argv[3])
+    elif operation == "bulk-upload":
+        if len(sys.argv) < 5:
+            print("Usage: python client_advanced.py host:port bulk-upload remote_dir local_file [local_file ...]")
+            sys.exit(1)
+        bulk_upload(server_address, sys.argv[3], sys.argv[4:])
+    elif operation in ("bulk-delete", "bulk-stat"):
+        if len(sys.argv) < 4:
+            print(f"Usage: python client_advanced.py host:port {operation} remote_file [remote_file ...]")
+            sys.exit(1)
+        bulk_request(server_address, operation[len("bulk-"):], sys.argv[3:])
     else:
         print(f"Unknown operation: {operation}")
         sys.exit(1)
\ No newline at end of file
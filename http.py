@@ -1,5 +1,161 @@
+import io
 import os
+import json
+import stat
+import time
+import tarfile
+import threading
 from datetime import datetime, timezone
+from email.parser import BytesParser
+from email.policy import HTTP as HTTP_POLICY
+from urllib.parse import parse_qs, unquote
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http_io import FileRegion
+from archive import ARCHIVE_FORMATS, archive_stream
+from storage import open_storage
+from metadata import MetadataIndex, SEARCH_LIMIT
+from capture import CaptureLog, response_info
+from changes import ChangeFeed, InotifyWatcher
+
+
+class StreamingResponse:
+    """
+    A response whose body is produced piece by piece instead of being
+    built in memory. `chunks` yields bytes or http_io.FileRegion.
+    Iterating yields what to put on the wire:
+     - HTTP/1.1 clients get Transfer-Encoding: chunked
+     - HTTP/1.0 clients get the raw body, delimited by closing the connection
+    """
+    def __init__(self, status, reason, chunks, headers=None):
+        self.status = status
+        self.reason = reason
+        self.chunks = chunks
+        self.headers = headers or {}
+        self.chunked = False
+
+    def head(self):
+        date_str = datetime.now(timezone.utc).strftime('%a, %d %b %Y %H:%M:%S GMT')
+        version = 'HTTP/1.1' if self.chunked else 'HTTP/1.0'
+        lines = [
+            f"{version} {self.status} {self.reason}\r\n",
+            f"Date: {date_str}\r\n",
+            "Server: myserver/1.0\r\n",
+            "Connection: close\r\n",
+        ]
+        if self.chunked:
+            lines.append("Transfer-Encoding: chunked\r\n")
+        for key, val in self.headers.items():
+            lines.append(f"{key}: {val}\r\n")
+        lines.append("\r\n")
+        return ''.join(lines).encode()
+
+    def __iter__(self):
+        yield self.head()
+        for chunk in self.chunks:
+            if not chunk:
+                continue
+            if not self.chunked:
+                yield chunk
+            elif isinstance(chunk, FileRegion):
+                yield b'%x\r\n' % len(chunk)
+                yield chunk
+                yield b'\r\n'
+            else:
+                yield self.frame(chunk)
+        if self.chunked:
+            yield self.trailer()
+
+    def frame(self, data: bytes):
+        """
+        Wire form of one piece of body bytes.
+        """
+        if not self.chunked or not data:
+            return data
+        return b'%x\r\n' % len(data) + data + b'\r\n'
+
+    def trailer(self):
+        return b'0\r\n\r\n' if self.chunked else b''
+
+
+class ChangeStream(StreamingResponse):
+    """
+    Response to GET /_changes, as server-sent events or a long-poll.
+
+    poll(now) is the non-blocking step: it returns (body bytes, done)
+    and moves the stream's cursor forward; `deadline` says when to call it
+    again if no event arrives first (heartbeat or long-poll timeout).
+    Event-loop servers drive it through feed.listen() and poll(); blocking
+    servers just iterate it like any StreamingResponse, which waits on the
+    feed between polls.
+    """
+    HEARTBEAT = 15.0
+
+    def __init__(self, feed, cursor, prefix, sse, timeout):
+        if sse:
+            headers = {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'}
+        else:
+            headers = {'Content-Type': 'application/json', 'Cache-Control': 'no-cache'}
+        super().__init__(200, 'OK', self.blocking(), headers)
+        self.feed = feed
+        self.prefix = prefix
+        self.sse = sse
+        self.seq, self.reset = feed.resolve(cursor)
+        now = time.monotonic()
+        if sse:
+            self.deadline = now + self.HEARTBEAT
+            self.started = False
+        else:
+            # Without a cursor, answer at once with one to start from
+            self.deadline = now + timeout if cursor else now
+
+    def event_json(self, event):
+        return {'cursor': self.feed.cursor(event.seq), 'type': event.kind,
+                'path': event.path, 'time': event.time}
+
+    def poll(self, now):
+        events, latest, lost = self.feed.read(self.seq)
+        reset = self.reset or lost
+        self.reset = False
+        self.seq = latest
+        if reset:
+            events = []
+        events = [e for e in events if e.path.startswith(self.prefix)]
+
+        if not self.sse:
+            if not (events or reset or now >= self.deadline):
+                return b'', False
+            body = {'cursor': self.feed.cursor(latest), 'reset': reset,
+                    'events': [self.event_json(e) for e in events]}
+            return (json.dumps(body) + '\n').encode(), True
+
+        parts = []
+        if not self.started:
+            self.started = True
+            parts.append('retry: 2000\n\n')
+        if reset:
+            parts.append(f"event: reset\ndata: {json.dumps({'cursor': self.feed.cursor(latest)})}\n\n")
+        for e in events:
+            parts.append(f"id: {self.feed.cursor(e.seq)}\nevent: {e.kind}\n"
+                         f"data: {json.dumps(self.event_json(e))}\n\n")
+        if not parts and now >= self.deadline:
+            parts.append(': keepalive\n\n')
+        if parts:
+            self.deadline = now + self.HEARTBEAT
+        return ''.join(parts).encode(), False
+
+    def blocking(self):
+        while True:
+            data, done = self.poll(time.monotonic())
+            if data:
+                yield data
+            if done:
+                return
+            self.feed.wait(self.seq, self.deadline - time.monotonic())
+
+# Long-poll wait for /_changes; capped below the default send timeout
+POLL_TIMEOUT = 25.0
+MAX_POLL_TIMEOUT = 55.0
+
 
 class HttpServer:
     """
@@ -7,8 +163,22 @@ class HttpServer:
       - GET: serve files or directory listings
       - POST: upload files under /upload/
       - DELETE: remove files
+      - POST /_batch/{upload,delete,stat}: many file operations per request
+      - GET /_search?q=: glob or prefix search (needs the metadata index)
+      - GET /_changes: create/delete events as SSE or long-poll
+    Uploads and deletes go through a storage backend: 'plain' files or the
+    deduplicating content store 'cas' (see storage.py), which also gives
+    GET a strong ETag. With `index` (an SQLite file path) listings, search
+    and lookups are answered from a metadata index (see metadata.py)
+    instead of the filesystem. With `capture` (a file path) every request's
+    method, path, sizes, status and handler time are appended to a binary
+    capture log for replay.py (see capture.py). A SharedFileCache set as
+    `cache` answers GETs for unchanged small files without reading them.
     """
-    def __init__(self):
+    # Disk operations of one batch request run concurrently, at most this many
+    batch_workers = 8
+
+    def __init__(self, basedir=None, storage='plain', index=None, capture=None, rebuild_index=True):
         # Mapping of file extensions to MIME types
         self.types = {
             '.pdf': 'application/pdf',
@@ -17,7 +187,26 @@ class HttpServer:
             '.html': 'text/html'
         }
         # Base directory for all file operations
-        self.basedir = os.path.abspath('.')
+        self.basedir = os.path.abspath(basedir or '.')
+        self.storage = open_storage(storage, self.basedir)
+        self.index = None
+        if index:
+            self.index = MetadataIndex(self.basedir, index, skip=self.hidden)
+            # Off where another handler sharing the index file already did it
+            if rebuild_index:
+                self.index.rebuild()
+        self.capture = CaptureLog(capture) if capture else None
+        # Read-only snapshot of small files (see shmcache.py), installed by
+        # servers that share one between their workers
+        self.cache = None
+        # Change feed (and its inotify watcher), started on first use in
+        # each process: threads do not survive fork()
+        self._changes = None
+        self._changes_pid = None
+        self._changes_lock = threading.Lock()
+        # Created on first use so forked workers each get their own threads
+        self._batch_pool = None
+        self._batch_lock = threading.Lock()
 
     def response(self, status=404, reason='Not Found', body=b'', headers=None):
         """
@@ -60,19 +249,79 @@ class HttpServer:
         header_part, _, body = raw_request.partition(b'\r\n\r\n')
         lines = header_part.decode('utf-8', 'ignore').split('\r\n')
         try:
-            method, path = lines[0].split()[:2]
+            request_line = lines[0].split()
+            method, path = request_line[:2]
             method = method.upper()
         except ValueError:
             return self.response(400, 'Bad Request', b'Malformed request')
 
+        result = self.dispatch(method, path, lines[1:], body)
+        if isinstance(result, StreamingResponse):
+            result.chunked = len(request_line) > 2 and request_line[2] == 'HTTP/1.1'
+        return result
+
+    def reject(self, error, request_line=b'', started=None):
+        """
+        Response to a request refused while it was being read (a
+        RequestError: 408, 413, 431...). It still goes to the capture log,
+        with whatever part of the request line arrived and the time since
+        `started` (time.monotonic()) as its duration.
+        """
+        response = self.response(error.status, error.reason, error.message)
+        if self.capture:
+            parts = request_line.decode('latin-1').split(' ')
+            method = parts[0].upper()
+            path = parts[1] if len(parts) > 1 else ''
+            duration = time.monotonic() - started if started is not None else 0.0
+            status, resp_size = response_info(response)
+            self.capture.record(time.time() - duration, method, path, 0, status, resp_size, duration)
+        return response
+
+    def close(self):
+        """
+        Release what this handler holds open (the capture log), e.g. when a
+        reloaded config replaces it.
+        """
+        if self.capture:
+            self.capture.close()
+
+    def dispatch(self, method, path, header_lines, body):
+        if not self.capture:
+            return self.route(method, path, header_lines, body)
+        started, clock = time.time(), time.perf_counter()
+        result = self.route(method, path, header_lines, body)
+        status, resp_size = response_info(result)
+        self.capture.record(started, method, path, len(body), status, resp_size,
+                            time.perf_counter() - clock)
+        return result
+
+    def route(self, method, path, header_lines, body):
         if method == 'GET':
-            return self.http_get(path, lines[1:])
+            if path.split('?', 1)[0] == '/_search':
+                return self.http_search(path)
+            if path.split('?', 1)[0] == '/_changes':
+                return self.http_changes(path, header_lines)
+            return self.http_get(path, header_lines)
         if method == 'POST':
-            return self.http_post(path, lines[1:], body)
+            if path.startswith('/_batch/'):
+                return self.http_batch(path, header_lines, body)
+            return self.http_post(path, header_lines, body)
         if method == 'DELETE':
-            return self.http_delete(path, lines[1:])
+            return self.http_delete(path, header_lines)
         return self.response(405, 'Method Not Allowed', b'')
 
+    @staticmethod
+    def header_value(header_lines, name):
+        """
+        Return the value of header `name` (case-insensitive) or None.
+        """
+        name = name.lower()
+        for line in header_lines:
+            key, sep, val = line.partition(':')
+            if sep and key.strip().lower() == name:
+                return val.strip()
+        return None
+
     def get_safe_path(self, url_path: str):
         """
         Convert URL path to a filesystem path under basedir,
@@ -80,10 +329,34 @@ class HttpServer:
         """
         segment = url_path.lstrip('/')
         abs_path = os.path.normpath(os.path.join(self.basedir, segment))
-        if not abs_path.startswith(self.basedir):
+        if not abs_path.startswith(self.basedir) or self.hidden(abs_path):
             return None
         return abs_path
 
+    def hidden(self, fs_path: str):
+        """
+        Server-owned paths (content store, index files) never served.
+        """
+        return self.storage.reserved(fs_path) or bool(self.index and self.index.reserved(fs_path))
+
+    def stat_path(self, fs_path: str):
+        """
+        {'type': 'file'|'dir', 'size', 'mtime'} for fs_path or None if it
+        does not exist; from the metadata index when there is one.
+        """
+        if self.index:
+            return self.index.lookup(fs_path)
+        try:
+            st = os.stat(fs_path)
+        except FileNotFoundError:
+            return None
+        kind = 'dir' if stat.S_ISDIR(st.st_mode) else 'file'
+        return {'type': kind, 'size': st.st_size, 'mtime': st.st_mtime}
+
+    def is_file(self, fs_path: str):
+        info = self.stat_path(fs_path)
+        return info is not None and info['type'] == 'file'
+
     def list_directory(self, url_path: str):
         """
         Return a plain-text index of the given directory.
@@ -91,33 +364,153 @@ class HttpServer:
         fs_path = self.get_safe_path(url_path)
         if not fs_path:
             return self.response(403, 'Forbidden', b'Access denied')
-        if not os.path.isdir(fs_path):
+        if self.index:
+            entries = self.index.list_dir(fs_path)
+        elif os.path.isdir(fs_path):
+            entries = [(name, os.path.isdir(os.path.join(fs_path, name)))
+                       for name in sorted(os.listdir(fs_path))
+                       if not self.hidden(os.path.join(fs_path, name))]
+        else:
+            entries = None
+        if entries is None:
             return self.response(404, 'Not Found', b'Not a directory')
 
-        entries = sorted(os.listdir(fs_path))
         lines = [f"Index of {url_path}", "-"*40]
-        for name in entries:
-            suffix = '/' if os.path.isdir(os.path.join(fs_path, name)) else ''
-            lines.append(name + suffix)
+        for name, is_dir in entries:
+            lines.append(name + ('/' if is_dir else ''))
         body = ('\n'.join(lines) + '\n').encode()
         return self.response(200, 'OK', body, {'Content-Type': 'text/plain'})
 
+    def archive_directory(self, url_path: str, params):
+        """
+        Stream a directory tree as a tar or zip archive, optionally
+        gzip-compressed, without building it in memory.
+        """
+        fs_path = self.get_safe_path(url_path)
+        if not fs_path:
+            return self.response(403, 'Forbidden', b'Access denied')
+        if not os.path.isdir(fs_path):
+            return self.response(404, 'Not Found', b'Not a directory')
+
+        fmt = params['archive'][0]
+        compress = params.get('gzip', ['0'])[0] not in ('0', '', 'false')
+        if fmt not in ARCHIVE_FORMATS:
+            return self.response(400, 'Bad Request',
+                                 f"archive must be one of: {', '.join(ARCHIVE_FORMATS)}".encode())
+
+        root = os.path.basename(fs_path.rstrip(os.sep)) or 'root'
+        chunks, ctype, ext = archive_stream(fmt, fs_path, root, compress,
+                                            skip=self.hidden)
+        headers = {
+            'Content-Type': ctype,
+            'Content-Disposition': f'attachment; filename="{root}{ext}"',
+        }
+        return StreamingResponse(200, 'OK', chunks, headers)
+
     def http_get(self, url_path: str, header_lines):
         """
         Serve a file or directory listing.
+        `GET /dir/?archive=tar|zip[&gzip=1]` streams the whole directory.
         """
+        url_path, _, query = url_path.partition('?')
+        url_path = unquote(url_path)
+        params = parse_qs(query)
         if url_path.endswith('/'):
+            if 'archive' in params:
+                return self.archive_directory(url_path, params)
             return self.list_directory(url_path)
 
         fs_path = self.get_safe_path(url_path)
-        if not fs_path or not os.path.isfile(fs_path):
+        if not fs_path or not self.is_file(fs_path):
             return self.response(404, 'Not Found', b'')
 
-        with open(fs_path, 'rb') as f:
-            content = f.read()
+        headers = {}
+        try:
+            etag = self.storage.etag(fs_path)
+            if etag:
+                headers['ETag'] = etag
+                if self.etag_matches(self.header_value(header_lines, 'If-None-Match'), etag):
+                    return self.response(304, 'Not Modified', b'', headers)
+
+            content = self.cache.get(fs_path) if self.cache else None
+            if content is None:
+                with open(fs_path, 'rb') as f:
+                    content = f.read()
+        except FileNotFoundError:
+            # Removed behind the index's back
+            return self.response(404, 'Not Found', b'')
         ext = os.path.splitext(fs_path)[1].lower()
-        ctype = self.types.get(ext, 'application/octet-stream')
-        return self.response(200, 'OK', content, {'Content-Type': ctype})
+        headers['Content-Type'] = self.types.get(ext, 'application/octet-stream')
+        return self.response(200, 'OK', content, headers)
+
+    @staticmethod
+    def etag_matches(if_none_match, etag):
+        """
+        If-None-Match uses weak comparison (RFC 9110 13.1.2).
+        """
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        tags = [t.strip() for t in if_none_match.split(',')]
+        return any(t.removeprefix('W/') == etag for t in tags)
+
+    def http_search(self, url_path: str):
+        """
+        GET /_search?q=<glob or prefix>[&limit=N]: matching paths with
+        type, size and mtime as JSON, straight from the metadata index.
+        """
+        if not self.index:
+            return self.response(501, 'Not Implemented', b'Search needs the metadata index (index)')
+        params = parse_qs(url_path.partition('?')[2])
+        query = params.get('q', [''])[0]
+        try:
+            limit = max(1, min(int(params.get('limit', [SEARCH_LIMIT])[0]), SEARCH_LIMIT))
+        except ValueError:
+            return self.response(400, 'Bad Request', b'limit must be a number')
+        results, truncated = self.index.search(query, limit)
+        body = json.dumps({'query': query, 'results': results, 'truncated': truncated}, indent=2)
+        return self.response(200, 'OK', body + '\n', {'Content-Type': 'application/json'})
+
+    def changes(self):
+        with self._changes_lock:
+            if self._changes is None or self._changes_pid != os.getpid():
+                self._changes = ChangeFeed()
+                self._changes_pid = os.getpid()
+                InotifyWatcher.start_for(self._changes, self.basedir, skip=self.hidden)
+            return self._changes
+
+    def publish_change(self, kind, fs_path):
+        """
+        Report our own upload/delete right away (inotify would also see
+        it, a moment later; the feed drops the echo).
+        """
+        feed = self._changes
+        if feed is not None and self._changes_pid == os.getpid():
+            rel = os.path.relpath(fs_path, self.basedir).replace(os.sep, '/')
+            feed.publish(kind, '/' + rel)
+
+    def http_changes(self, url_path: str, header_lines):
+        """
+        GET /_changes?cursor=<c>&path=<prefix>&timeout=<s>
+          Long-poll: waits until there are events after the cursor (or the
+          timeout) and returns {cursor, reset, events} as JSON.
+        With `Accept: text/event-stream` or mode=sse the same events are
+        streamed as SSE; the id of each event is its cursor, so a client
+        reconnecting with Last-Event-ID resumes where it left off. A
+        cursor that is unknown or too old yields reset: relist and go on
+        from the new cursor.
+        """
+        params = parse_qs(url_path.partition('?')[2])
+        cursor = params.get('cursor', [None])[0] or self.header_value(header_lines, 'Last-Event-ID')
+        prefix = params.get('path', ['/'])[0]
+        accept = self.header_value(header_lines, 'Accept') or ''
+        sse = params.get('mode', [''])[0] == 'sse' or 'text/event-stream' in accept
+        try:
+            timeout = min(max(float(params.get('timeout', [POLL_TIMEOUT])[0]), 0.0), MAX_POLL_TIMEOUT)
+        except ValueError:
+            return self.response(400, 'Bad Request', b'timeout must be a number')
+        return ChangeStream(self.changes(), cursor, prefix, sse, timeout)
 
     def http_post(self, url_path: str, header_lines, body: bytes):
         """
@@ -126,17 +519,18 @@ class HttpServer:
         if not url_path.startswith('/upload/'):
             return self.response(400, 'Bad Request', b'Uploads must go to /upload/<filename>')
 
-        filename = url_path[len('/upload/'):]
+        filename = unquote(url_path[len('/upload/'):])
         fs_path = self.get_safe_path(filename)
         if not fs_path:
             return self.response(403, 'Forbidden', b'Invalid path')
 
-        os.makedirs(os.path.dirname(fs_path), exist_ok=True)
         try:
-            with open(fs_path, 'wb') as f:
-                f.write(body)
+            digest = self.write_file(fs_path, body)
             msg = f"File '{filename}' uploaded\n".encode()
-            return self.response(201, 'Created', msg, {'Content-Type': 'text/plain'})
+            headers = {'Content-Type': 'text/plain'}
+            if digest:
+                headers['ETag'] = f'"{digest}"'
+            return self.response(201, 'Created', msg, headers)
         except Exception as e:
             return self.response(500, 'Internal Server Error', str(e).encode())
 
@@ -144,14 +538,143 @@ class HttpServer:
         """
         Handle file deletion via DELETE /<filename>.
         """
-        fs_path = self.get_safe_path(url_path)
+        fs_path = self.get_safe_path(unquote(url_path))
         if not fs_path:
             return self.response(403, 'Forbidden', b'Access denied')
-        if not os.path.isfile(fs_path):
+        if not self.is_file(fs_path):
             return self.response(404, 'Not Found', b'')
 
         try:
-            os.remove(fs_path)
+            self.remove_file(fs_path)
             return self.response(204, 'No Content', b'')
         except Exception as e:
-            return self.response(500, 'Internal Server Error', str(e).encode())
\ No newline at end of file
+            return self.response(500, 'Internal Server Error', str(e).encode())
+
+    def write_file(self, fs_path: str, data: bytes):
+        """
+        Store an upload at fs_path (already checked by get_safe_path).
+        Single and batch uploads both go through here. Returns the content
+        digest when the storage backend keeps one, else None.
+        """
+        digest = self.storage.write(fs_path, data)
+        if self.index:
+            self.index.record(fs_path)
+        self.publish_change('create', fs_path)
+        return digest
+
+    def remove_file(self, fs_path: str):
+        """
+        Delete the file at fs_path (already checked by get_safe_path).
+        Single and batch deletes both go through here.
+        """
+        try:
+            self.storage.remove(fs_path)
+        finally:
+            if self.index:
+                self.index.forget(fs_path)
+        self.publish_change('delete', fs_path)
+
+    def batch_pool(self):
+        with self._batch_lock:
+            if self._batch_pool is None:
+                self._batch_pool = ThreadPoolExecutor(max_workers=self.batch_workers,
+                                                      thread_name_prefix='batch')
+            return self._batch_pool
+
+    def http_batch(self, url_path: str, header_lines, body: bytes):
+        """
+        Run many file operations from one request:
+          POST /_batch/upload  tar stream or multipart/form-data body
+          POST /_batch/delete  JSON list of paths
+          POST /_batch/stat    JSON list of paths
+        Operations run concurrently in a bounded pool; one JSON result per
+        item is streamed back as soon as it finishes (NDJSON), followed by
+        a summary line.
+        """
+        op = url_path[len('/_batch/'):].split('?', 1)[0]
+        try:
+            if op == 'upload':
+                ctype = self.header_value(header_lines, 'Content-Type') or ''
+                items = [(name, self.batch_write, (name, data))
+                         for name, data in self.batch_upload_items(ctype, body)]
+            elif op in ('delete', 'stat'):
+                paths = json.loads(body or b'[]')
+                if not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+                    raise ValueError('Body must be a JSON list of paths')
+                action = self.batch_remove if op == 'delete' else self.batch_stat
+                items = [(path, action, (path,)) for path in paths]
+            else:
+                return self.response(404, 'Not Found', b'Unknown batch operation')
+        except (ValueError, tarfile.TarError) as e:
+            return self.response(400, 'Bad Request', f"Invalid batch body: {e}".encode())
+
+        pool = self.batch_pool()
+        futures = {pool.submit(func, *args): name for name, func, args in items}
+        return StreamingResponse(200, 'OK', self.batch_results(futures),
+                                 {'Content-Type': 'application/x-ndjson'})
+
+    def batch_results(self, futures):
+        failed = 0
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'path': futures[future], 'status': 500, 'error': str(e)}
+            if result['status'] >= 400:
+                failed += 1
+            yield (json.dumps(result) + '\n').encode()
+        summary = {'done': len(futures), 'failed': failed}
+        yield (json.dumps(summary) + '\n').encode()
+
+    def batch_upload_items(self, ctype: str, body: bytes):
+        """
+        Yield (path, data) pairs from a tar stream or a multipart body.
+        """
+        if ctype.lower().startswith('multipart/form-data'):
+            msg = BytesParser(policy=HTTP_POLICY).parsebytes(
+                f"Content-Type: {ctype}\r\n\r\n".encode() + body)
+            if not msg.is_multipart():
+                raise ValueError('Malformed multipart body')
+            for part in msg.iter_parts():
+                name = part.get_filename() or part.get_param('name', header='content-disposition')
+                if not name:
+                    raise ValueError('Multipart part without a filename')
+                yield name, part.get_payload(decode=True) or b''
+            return
+
+        with tarfile.open(fileobj=io.BytesIO(body), mode='r|*') as tar:
+            for member in tar:
+                if member.isdir():
+                    continue
+                if not member.isfile():
+                    raise ValueError(f"Unsupported tar member type: {member.name}")
+                yield member.name, tar.extractfile(member).read()
+
+    def batch_write(self, path: str, data: bytes):
+        fs_path = self.get_safe_path(path)
+        if not fs_path or fs_path == self.basedir:
+            return {'path': path, 'status': 403, 'error': 'Invalid path'}
+        digest = self.write_file(fs_path, data)
+        result = {'path': path, 'status': 201, 'size': len(data)}
+        if digest:
+            result['sha256'] = digest
+        return result
+
+    def batch_remove(self, path: str):
+        fs_path = self.get_safe_path(path)
+        if not fs_path:
+            return {'path': path, 'status': 403, 'error': 'Access denied'}
+        if not self.is_file(fs_path):
+            return {'path': path, 'status': 404, 'error': 'Not Found'}
+        self.remove_file(fs_path)
+        return {'path': path, 'status': 204}
+
+    def batch_stat(self, path: str):
+        fs_path = self.get_safe_path(path)
+        if not fs_path:
+            return {'path': path, 'status': 403, 'error': 'Access denied'}
+        info = self.stat_path(fs_path)
+        if info is None:
+            return {'path': path, 'status': 404, 'error': 'Not Found'}
+        return {'path': path, 'status': 200, 'type': info['type'],
+                'size': info['size'], 'mtime': info['mtime']}
\ No newline at end of file
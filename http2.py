@@ -0,0 +1,480 @@
+import ssl
+import time
+import socket
+import logging
+import selectors
+import threading
+from collections import deque
+from http import StreamingResponse
+from http_io import FileRegion
+
+# HTTP/2 needs the optional `h2` package (pip install h2); without it the
+# TLS server only offers http/1.1 through ALPN.
+try:
+    import h2.config
+    import h2.events
+    import h2.errors
+    import h2.settings
+    import h2.exceptions
+    import h2.connection
+except ImportError:
+    h2 = None
+
+AVAILABLE = h2 is not None
+
+# Response bytes buffered per stream before its producer has to wait
+STREAM_BUFFER = 256 * 1024
+# Largest DATA frame payload handed to h2 per scheduling round
+QUANTUM = 16 * 1024
+DEFAULT_WEIGHT = 16
+
+# Connection-level headers that must not appear in HTTP/2 responses
+HOP_BY_HOP = {'connection', 'transfer-encoding', 'keep-alive', 'proxy-connection', 'upgrade'}
+
+
+def alpn_protocols(enabled=True):
+    """
+    Protocols to advertise through ALPN, most preferred first.
+    """
+    if enabled and AVAILABLE:
+        return ['h2', 'http/1.1']
+    return ['http/1.1']
+
+
+def split_response(response):
+    """
+    Turn an HttpServer response (HTTP/1.0 bytes or StreamingResponse) into
+    (status, [(name, value)], body_pieces) for an HTTP/2 stream.
+    """
+    if isinstance(response, StreamingResponse):
+        headers = [(k.lower(), str(v)) for k, v in response.headers.items()]
+        pieces = (p.read() if isinstance(p, FileRegion) else p for p in response.chunks)
+        return response.status, headers, pieces
+
+    head, _, body = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = []
+    for line in lines[1:]:
+        key, sep, val = line.partition(':')
+        if sep and key.strip().lower() not in HOP_BY_HOP:
+            headers.append((key.strip().lower(), val.strip()))
+    return status, headers, iter((body,))
+
+
+class Stream:
+    """
+    Per-stream state. The request body arrives as a list of DATA chunks,
+    joined once when the stream is dispatched. The handler thread produces
+    response bytes into `buffer` (bounded by STREAM_BUFFER); the connection
+    thread drains it into DATA frames as flow control allows.
+    """
+    __slots__ = ('stream_id', 'headers', 'body', 'received', 'buffer', 'buffered', 'done',
+                 'cancelled', 'weight', 'vtime', 'started', 'responding', 'early',
+                 'opened', 'progress', 'stalled')
+
+    def __init__(self, stream_id, headers, now):
+        self.stream_id = stream_id
+        self.headers = headers
+        self.body = []
+        self.received = 0
+        self.buffer = deque()
+        self.buffered = 0
+        self.done = False
+        self.cancelled = False
+        self.weight = DEFAULT_WEIGHT
+        self.vtime = 0.0
+        self.started = False
+        self.responding = False
+        # Answered before the client finished sending the request
+        self.early = False
+        # When the stream opened and last received body bytes; since when
+        # its response has been held up by the client's flow-control window
+        self.opened = now
+        self.progress = now
+        self.stalled = None
+
+
+class H2Session:
+    """
+    Serve one HTTP/2 connection on an already handshaken TLS socket.
+
+    A single thread owns the socket and the h2 state machine: it reads
+    frames, applies flow control and writes frames. Each request stream is
+    dispatched to HttpServer.dispatch() on `pool`, a bounded executor the
+    server shares between all its HTTP/2 connections, so many requests
+    share the connection without head-of-line blocking. Handler threads
+    only hand results back through a queue and a wake-up pipe.
+
+    The request limits apply per stream: a body must arrive within
+    body_timeout (and idle_timeout between chunks) or the stream gets a
+    408, a response the client stops reading for send_timeout is reset.
+    Request bodies not yet consumed by a handler are capped per
+    connection at max_body_bytes in total: received DATA is acknowledged
+    at once so uploads keep flowing, and a stream that would go past the
+    cap is refused (REFUSED_STREAM, safe to retry) rather than buffered.
+    A connection without open streams is closed after idle_timeout, or
+    after header_timeout if bytes keep trickling in without completing a
+    request.
+
+    Outgoing DATA is scheduled by stream weight (weighted fair queuing on
+    a per-stream virtual time); the RFC 7540 dependency tree is not
+    modelled, in line with RFC 9113 deprecating it.
+    """
+    def __init__(self, sock, httpserver, limits, pool, max_streams=100, stopping=None,
+                 subscribers=None):
+        self.sock = sock
+        # threading.Event set when the server drains: refuse new streams,
+        # finish open ones, then say GOAWAY instead of waiting for the
+        # idle timeout
+        self.stopping = stopping
+        self.httpserver = httpserver
+        self.limits = limits
+        self.max_streams = max_streams
+        self.conn = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.space = threading.Condition(self.lock)
+        self.actions = deque()
+        # Handler threads wake the connection thread through this pair
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        # Not select(): that fails once descriptors go past FD_SETSIZE
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+        # Request body bytes held for streams whose handler has not used them
+        self.body_bytes = 0
+        self.pool = pool
+        # scheduling.SubscriberSlots capping /_changes streams on `pool`
+        self.subscribers = subscribers
+        self.vclock = 0.0
+        self.closed = False
+        self.draining = False
+
+    def wake(self):
+        try:
+            self.wake_w.send(b'x')
+        except OSError:
+            # Pipe full (a wake-up is pending anyway) or session closed
+            pass
+
+    def serve(self):
+        try:
+            self.conn.initiate_connection()
+            self.conn.update_settings({
+                h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: self.max_streams,
+            })
+            self.flush()
+            self.loop()
+        except ssl.SSLEOFError:
+            # Client went away without close_notify; common and harmless
+            pass
+        except (OSError, h2.exceptions.ProtocolError) as e:
+            logging.warning(f"h2 connection error: {e}")
+        finally:
+            with self.lock:
+                self.closed = True
+                for stream in self.streams.values():
+                    stream.cancelled = True
+                self.space.notify_all()
+            self.selector.close()
+            self.wake_r.close()
+            self.wake_w.close()
+
+    def loop(self):
+        # last_active: last byte from the client; last_request: last time
+        # a stream was open (or the connection started)
+        last_active = last_request = time.monotonic()
+        while not self.closed:
+            if self.sock.pending():
+                readable = [self.sock]
+            else:
+                readable = [key.fileobj for key, _ in self.selector.select(1.0)]
+
+            if self.sock in readable:
+                self.sock.settimeout(self.limits.idle_timeout)
+                data = self.sock.recv(65536)
+                if not data:
+                    return
+                self.handle_events(self.conn.receive_data(data))
+                last_active = time.monotonic()
+            if self.wake_r in readable:
+                try:
+                    self.wake_r.recv(4096)
+                except BlockingIOError:
+                    pass
+
+            now = time.monotonic()
+            if self.stopping is not None and self.stopping.is_set() and not self.draining:
+                self.draining = True
+                self.conn.update_settings({h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: 0})
+            self.apply_actions()
+            self.expire(now)
+            self.send_data()
+            self.flush()
+
+            if self.streams:
+                last_active = last_request = now
+            elif (now - last_active > self.limits.idle_timeout
+                  or now - last_request > self.limits.header_timeout
+                  or self.draining):
+                self.conn.close_connection()
+                self.flush()
+                return
+
+    def expire(self, now):
+        """
+        Answer 408 to streams whose body is late, reset those whose
+        response the client has stopped reading.
+        """
+        limits = self.limits
+        for stream in list(self.streams.values()):
+            if not stream.started:
+                if (now - stream.opened > min(limits.body_timeout, limits.total_timeout)
+                        or now - stream.progress > limits.idle_timeout):
+                    self.reject(stream, 408, 'Request Timeout', 'Client too slow')
+            elif stream.stalled is not None and now - stream.stalled > limits.send_timeout:
+                logging.warning(f"h2 stream {stream.stream_id} not read, resetting")
+                self.reset(stream, h2.errors.ErrorCodes.CANCEL)
+
+    def flush(self):
+        out = self.conn.data_to_send()
+        if out:
+            self.sock.settimeout(self.limits.send_timeout)
+            self.sock.sendall(out)
+
+    def handle_events(self, events):
+        for event in events:
+            if isinstance(event, h2.events.RequestReceived):
+                stream = Stream(event.stream_id, event.headers, time.monotonic())
+                if event.priority_updated is not None:
+                    stream.weight = event.priority_updated.weight
+                self.streams[event.stream_id] = stream
+                if self.draining:
+                    # Sent before the client saw our new limit; safe to retry
+                    self.reset(stream, h2.errors.ErrorCodes.REFUSED_STREAM)
+                elif self.announced_length(stream) > self.limits.max_body_bytes:
+                    self.reject(stream, 413, 'Payload Too Large', 'Request body too large')
+                elif event.stream_ended is not None:
+                    self.start(stream)
+            elif isinstance(event, h2.events.DataReceived):
+                stream = self.streams.get(event.stream_id)
+                self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                if stream is None or stream.started:
+                    continue
+                stream.progress = time.monotonic()
+                if stream.received + len(event.data) > self.limits.max_body_bytes:
+                    self.reject(stream, 413, 'Payload Too Large', 'Request body too large')
+                    continue
+                with self.lock:
+                    over = self.body_bytes + len(event.data) > self.limits.max_body_bytes
+                    if not over:
+                        self.body_bytes += len(event.data)
+                if over:
+                    logging.warning(f"h2 stream {stream.stream_id}: connection body buffer full, refusing")
+                    self.reset(stream, h2.errors.ErrorCodes.REFUSED_STREAM)
+                    continue
+                stream.body.append(event.data)
+                stream.received += len(event.data)
+                if event.stream_ended is not None:
+                    self.start(stream)
+            elif isinstance(event, h2.events.StreamEnded):
+                stream = self.streams.get(event.stream_id)
+                if stream is not None and not stream.started:
+                    self.start(stream)
+            elif isinstance(event, h2.events.PriorityUpdated):
+                stream = self.streams.get(event.stream_id)
+                if stream is not None:
+                    stream.weight = event.weight
+            elif isinstance(event, h2.events.StreamReset):
+                stream = self.streams.pop(event.stream_id, None)
+                if stream is not None:
+                    with self.lock:
+                        stream.cancelled = True
+                        self.space.notify_all()
+                        if not stream.started:
+                            self.release_body(stream)
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                self.closed = True
+
+    def start(self, stream):
+        if stream.started:
+            return
+        stream.started = True
+        self.pool.submit(self.run_stream, stream)
+
+    def reset(self, stream, code):
+        self.streams.pop(stream.stream_id, None)
+        with self.lock:
+            stream.cancelled = True
+            self.space.notify_all()
+            if not stream.started:
+                self.release_body(stream)
+        self.conn.reset_stream(stream.stream_id, error_code=code)
+
+    def release_body(self, stream):
+        # Caller holds self.lock
+        self.body_bytes -= stream.received
+        stream.received = 0
+        stream.body = None
+
+    def reject(self, stream, status, reason, message):
+        """
+        Answer a stream whose request is still arriving with an error
+        response. The body goes out through send_data() like any other,
+        within the flow-control window; once it is sent the stream is reset
+        (NO_ERROR) so the client stops sending.
+        """
+        response = self.httpserver.response(status, reason, message)
+        status, headers, pieces = split_response(response)
+        body = b''.join(pieces)
+        with self.lock:
+            stream.started = stream.early = True
+            self.release_body(stream)
+            if body:
+                stream.buffer.append(body)
+                stream.buffered += len(body)
+            stream.done = True
+        self.conn.send_headers(stream.stream_id, [(':status', str(status))] + headers)
+        stream.responding = True
+
+    @staticmethod
+    def announced_length(stream):
+        for key, value in stream.headers:
+            if key == 'content-length':
+                try:
+                    return int(value)
+                except ValueError:
+                    return 0
+        return 0
+
+    def run_stream(self, stream):
+        """
+        Handler thread: run the request through HttpServer and pump the
+        body into the stream buffer, waiting while it is full. A /_changes
+        subscriber holds a slot of `subscribers` until its stream ends, or
+        is answered 503 when none is free.
+        """
+        pseudo = {k: v for k, v in stream.headers if k.startswith(':')}
+        header_lines = [f"{k}: {v}" for k, v in stream.headers if not k.startswith(':')]
+        method = pseudo.get(':method', 'GET').upper()
+        path = pseudo.get(':path', '/')
+        slots = None
+        if (self.subscribers is not None and method == 'GET'
+                and path.split('?', 1)[0] == '/_changes'):
+            slots = self.subscribers
+        try:
+            if slots is not None and not slots.acquire():
+                slots = None
+                response = self.subscribers.busy(self.httpserver)
+            else:
+                response = self.httpserver.dispatch(method, path, header_lines,
+                                                    b''.join(stream.body))
+            status, headers, pieces = split_response(response)
+        except Exception as e:
+            logging.error(f"h2 stream {stream.stream_id} handler error: {e}")
+            status, headers, pieces = 500, [], iter((b'',))
+        try:
+            self.pump(stream, status, headers, pieces)
+        finally:
+            if slots is not None:
+                slots.release()
+
+    def pump(self, stream, status, headers, pieces):
+        with self.lock:
+            self.release_body(stream)
+
+        with self.lock:
+            self.actions.append((stream, [(':status', str(status))] + headers))
+        self.wake()
+
+        for piece in pieces:
+            if not piece:
+                continue
+            with self.lock:
+                while stream.buffered >= STREAM_BUFFER and not stream.cancelled:
+                    self.space.wait()
+                if stream.cancelled:
+                    return
+                stream.buffer.append(piece)
+                stream.buffered += len(piece)
+            self.wake()
+        with self.lock:
+            stream.done = True
+        self.wake()
+
+    def stop_sending(self, stream):
+        """
+        Tell a client still uploading to a stream we have answered to stop.
+        """
+        try:
+            self.conn.reset_stream(stream.stream_id, error_code=h2.errors.ErrorCodes.NO_ERROR)
+        except h2.exceptions.StreamClosedError:
+            # It had already finished sending
+            pass
+
+    def apply_actions(self):
+        with self.lock:
+            actions, self.actions = self.actions, deque()
+        for stream, headers in actions:
+            if stream.stream_id in self.streams:
+                self.conn.send_headers(stream.stream_id, headers)
+                stream.responding = True
+
+    def ready_streams(self):
+        """
+        Streams whose headers went out and that have data (or their end)
+        to send and stream-level window left.
+        """
+        ready = []
+        now = time.monotonic()
+        for stream in self.streams.values():
+            if not stream.responding:
+                continue
+            if stream.buffered == 0 and not stream.done:
+                continue
+            if stream.buffered and self.conn.local_flow_control_window(stream.stream_id) <= 0:
+                if stream.stalled is None:
+                    stream.stalled = now
+                continue
+            ready.append(stream)
+        return ready
+
+    def send_data(self):
+        """
+        Weighted fair queuing: repeatedly pick the ready stream with the
+        smallest virtual time and send one quantum; a stream's virtual time
+        advances by bytes sent / weight.
+        """
+        while True:
+            ready = self.ready_streams()
+            if not ready:
+                return
+            stream = min(ready, key=lambda s: max(s.vtime, self.vclock))
+            self.vclock = max(stream.vtime, self.vclock)
+
+            with self.lock:
+                if stream.buffered == 0 and stream.done:
+                    del self.streams[stream.stream_id]
+                    self.conn.end_stream(stream.stream_id)
+                    if stream.early:
+                        self.stop_sending(stream)
+                    continue
+                window = min(self.conn.local_flow_control_window(stream.stream_id),
+                             self.conn.max_outbound_frame_size, QUANTUM)
+                if window <= 0:
+                    return
+                piece = stream.buffer.popleft()
+                if len(piece) > window:
+                    stream.buffer.appendleft(piece[window:])
+                    piece = piece[:window]
+                stream.buffered -= len(piece)
+                self.space.notify_all()
+            self.conn.send_data(stream.stream_id, piece)
+            stream.stalled = None
+            stream.vtime = self.vclock + len(piece) / stream.weight
+            # Keep frames flowing to the socket instead of building them all up
+            self.flush()
@@ -0,0 +1,224 @@
+import socket
+import time
+
+
+class RequestLimits:
+    """
+    Per-connection deadlines and size caps shared by all server loops.
+    Timeouts are in seconds, sizes in bytes.
+    """
+    def __init__(self, header_timeout=10.0, body_timeout=60.0, idle_timeout=5.0,
+                 total_timeout=120.0, send_timeout=60.0,
+                 max_header_bytes=16 * 1024, max_body_bytes=64 * 1024 * 1024,
+                 max_header_count=100):
+        # Whole header block must arrive within header_timeout
+        self.header_timeout = header_timeout
+        # Whole body must arrive within body_timeout after the headers
+        self.body_timeout = body_timeout
+        # Longest allowed gap between two recv() calls returning data
+        self.idle_timeout = idle_timeout
+        # Hard cap on reading the complete request
+        self.total_timeout = total_timeout
+        # Hard cap on writing the response
+        self.send_timeout = send_timeout
+        self.max_header_bytes = max_header_bytes
+        self.max_body_bytes = max_body_bytes
+        self.max_header_count = max_header_count
+
+
+class RequestError(Exception):
+    """
+    Raised while reading a request; carries the HTTP status to answer with.
+    """
+    def __init__(self, status, reason, message=''):
+        super().__init__(f"{status} {reason}: {message}")
+        self.status = status
+        self.reason = reason
+        self.message = message
+
+
+def parse_headers(header_part: bytes, limits: RequestLimits):
+    """
+    Parse the header block (without the request line) into a dict with
+    lowercase names, enforcing the header count and Content-Length caps.
+    """
+    lines = header_part.split(b'\r\n')[1:]
+    if len(lines) > limits.max_header_count:
+        raise RequestError(431, 'Request Header Fields Too Large', 'Too many headers')
+
+    headers = {}
+    for line in lines:
+        if b':' in line:
+            key, val = line.split(b':', 1)
+            headers[key.strip().lower().decode('latin-1')] = val.strip().decode('latin-1')
+
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise RequestError(400, 'Bad Request', 'Invalid Content-Length')
+    if length < 0:
+        raise RequestError(400, 'Bad Request', 'Invalid Content-Length')
+    if length > limits.max_body_bytes:
+        raise RequestError(413, 'Payload Too Large', 'Request body too large')
+    return headers
+
+
+def content_length(headers):
+    return int(headers.get('content-length', 0))
+
+
+class RequestReader:
+    """
+    Read one HTTP request from a blocking socket under RequestLimits:
+     - every recv() is bounded by the idle timeout and the phase deadline
+     - the header block is capped in bytes and in number of fields
+     - the body is capped by max_body_bytes
+    Violations raise RequestError with 408/413/431 so the caller can answer.
+    """
+    def __init__(self, conn, limits=None, recv_size=4096):
+        self.conn = conn
+        self.limits = limits or RequestLimits()
+        self.recv_size = recv_size
+        self.started = time.monotonic()
+        # Header bytes received so far, for request_line
+        self.head = b''
+
+    @property
+    def request_line(self):
+        """
+        As much of the request line as has arrived (b'' before any byte).
+        """
+        return self.head.split(b'\r\n', 1)[0]
+
+    def _recv(self, size, phase_deadline):
+        now = time.monotonic()
+        deadline = min(phase_deadline, self.started + self.limits.total_timeout)
+        timeout = min(self.limits.idle_timeout, deadline - now)
+        if timeout <= 0:
+            raise RequestError(408, 'Request Timeout', 'Request took too long')
+        self.conn.settimeout(timeout)
+        try:
+            return self.conn.recv(size)
+        except socket.timeout:
+            raise RequestError(408, 'Request Timeout', 'Client too slow')
+
+    def read_head(self):
+        """
+        Read up to the end of the header block.
+        Returns (header_part, spill, headers), or None if the client closed
+        the connection before sending anything.
+        """
+        deadline = self.started + self.limits.header_timeout
+        buffer = b''
+        while b'\r\n\r\n' not in buffer:
+            if len(buffer) > self.limits.max_header_bytes:
+                raise RequestError(431, 'Request Header Fields Too Large', 'Header block too large')
+            chunk = self._recv(self.recv_size, deadline)
+            if not chunk:
+                if not buffer:
+                    return None
+                raise RequestError(400, 'Bad Request', 'Incomplete request headers')
+            buffer += chunk
+            self.head = buffer
+
+        header_part, _, spill = buffer.partition(b'\r\n\r\n')
+        if len(header_part) > self.limits.max_header_bytes:
+            raise RequestError(431, 'Request Header Fields Too Large', 'Header block too large')
+        return header_part, spill, parse_headers(header_part, self.limits)
+
+    def read_body(self, headers, spill):
+        """
+        Read the rest of a Content-Length delimited body.
+        """
+        length = content_length(headers)
+        deadline = time.monotonic() + self.limits.body_timeout
+        parts = [spill]
+        remaining = length - len(spill)
+        while remaining > 0:
+            chunk = self._recv(min(remaining, max(self.recv_size, 65536)), deadline)
+            if not chunk:
+                raise RequestError(400, 'Bad Request', 'Incomplete request body')
+            parts.append(chunk)
+            remaining -= len(chunk)
+        return b''.join(parts)[:length] if length else b''
+
+    def read_request(self):
+        """
+        Read a complete request and return it as raw bytes, or None if the
+        client went away without sending anything.
+        """
+        head = self.read_head()
+        if head is None:
+            return None
+        header_part, spill, headers = head
+        body = self.read_body(headers, spill)
+        return header_part + b'\r\n\r\n' + body
+
+
+class FileRegion:
+    """
+    A byte range of a file inside a streamed response body. Blocking
+    senders hand it to socket.sendfile() so the bytes go from the page
+    cache to the socket without passing through Python; others call read().
+    If the file shrank or was deleted since it was stat()ed, the region is
+    padded with NUL bytes so framing (chunk sizes, tar blocks) stays valid.
+    """
+    __slots__ = ('path', 'offset', 'count')
+
+    def __init__(self, path, offset, count):
+        self.path = path
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def read(self):
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read(self.count)
+        except (FileNotFoundError, NotADirectoryError):
+            data = b''
+        return data + b'\0' * (self.count - len(data))
+
+    def sendfile(self, conn):
+        try:
+            with open(self.path, 'rb') as f:
+                sent = conn.sendfile(f, self.offset, self.count)
+        except (FileNotFoundError, NotADirectoryError):
+            sent = 0
+        if sent < self.count:
+            conn.sendall(b'\0' * (self.count - sent))
+
+
+def send_response(conn, response, limits=None):
+    """
+    Write a response (bytes, or an iterable of bytes / FileRegion such as
+    http.StreamingResponse) so slow readers cannot hold a worker forever:
+    bytes must go out within send_timeout in total; a stream (archive,
+    SSE) may run as long as each piece goes out within send_timeout, as
+    cutting it short would leave the client a truncated body.
+    """
+    limits = limits or RequestLimits()
+    conn.settimeout(limits.send_timeout)
+    if isinstance(response, (bytes, bytearray)):
+        conn.sendall(response)
+        return
+
+    for piece in response:
+        if isinstance(piece, FileRegion):
+            piece.sendfile(conn)
+        else:
+            conn.sendall(piece)
+
+
+def as_bytes(response):
+    """
+    The whole response as one bytes object, for callers that cannot
+    stream (e.g. a response handed back from another interpreter).
+    """
+    if isinstance(response, (bytes, bytearray)):
+        return bytes(response)
+    return b''.join(piece.read() if isinstance(piece, FileRegion) else piece
+                    for piece in response)
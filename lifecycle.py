@@ -0,0 +1,94 @@
+import os
+import sys
+import signal
+import socket
+import logging
+import subprocess
+
+# Environment variables used to hand the listening socket to a new generation
+LISTEN_FD_ENV = 'PROGJAR_LISTEN_FD'
+PARENT_PID_ENV = 'PROGJAR_PARENT_PID'
+
+
+def open_listener(host, port, backlog, setup=None):
+    """
+    Return the listening socket for this generation:
+     - if a previous generation handed us its FD, adopt it as-is
+       (already bound and listening, so no connection is ever refused)
+     - otherwise bind a fresh socket, calling setup(sock) before bind()
+       so buffer sizes apply to the listen queue as well
+    """
+    fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if fd is not None:
+        srv = socket.socket(fileno=int(fd))
+        logging.warning(f"Adopted listening socket FD {fd} from previous generation")
+        return srv
+
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if setup is not None:
+        setup(srv)
+    srv.bind((host, port))
+    srv.listen(backlog)
+    return srv
+
+
+def spawn_next_generation(listener):
+    """
+    Re-exec the current program with the listening FD inherited.
+    The child calls notify_previous_generation() once it is serving,
+    which tells this process to drain and exit.
+    """
+    fd = listener.fileno()
+    os.set_inheritable(fd, True)
+    env = dict(os.environ)
+    env[LISTEN_FD_ENV] = str(fd)
+    env[PARENT_PID_ENV] = str(os.getpid())
+    child = subprocess.Popen([sys.executable] + sys.orig_argv[1:], env=env, pass_fds=(fd,))
+    logging.warning(f"Started next generation pid={child.pid} on FD {fd}")
+    return child
+
+
+def notify_previous_generation():
+    """
+    Called by a new generation once it accepts connections: ask the
+    generation that spawned us to drain (SIGTERM) and step aside.
+    """
+    parent = os.environ.pop(PARENT_PID_ENV, None)
+    if parent is None:
+        return
+    try:
+        os.kill(int(parent), signal.SIGTERM)
+        logging.warning(f"Asked previous generation pid={parent} to drain")
+    except (ProcessLookupError, ValueError):
+        pass
+
+
+class SignalFlags:
+    """
+    Signal handlers only record what was requested; the server loop acts
+    on the flags at a safe point (between accepts).
+      SIGTERM / SIGINT -> drain
+      SIGHUP           -> reload
+      SIGUSR2          -> restart (hand the listener to a new generation)
+    """
+    def __init__(self):
+        self.drain = False
+        self.reload = False
+        self.restart = False
+
+    def install(self):
+        signal.signal(signal.SIGTERM, self._on_drain)
+        signal.signal(signal.SIGINT, self._on_drain)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGUSR2, self._on_restart)
+        return self
+
+    def _on_drain(self, signum, frame):
+        self.drain = True
+
+    def _on_reload(self, signum, frame):
+        self.reload = True
+
+    def _on_restart(self, signum, frame):
+        self.restart = True
@@ -0,0 +1,241 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path       TEXT PRIMARY KEY,  -- relative to basedir, '/'-separated, '' is the root
+    parent     TEXT,
+    name       TEXT NOT NULL,
+    is_dir     INTEGER NOT NULL,
+    size       INTEGER NOT NULL,
+    mtime      REAL NOT NULL,
+    scanned_ns INTEGER            -- dirs: st_mtime_ns when its entries were last read
+);
+CREATE INDEX IF NOT EXISTS files_parent ON files (parent, name);
+"""
+
+# Sorts after every character, for prefix range queries
+MAX_CHAR = '\U0010ffff'
+SEARCH_LIMIT = 1000
+GLOB_CHARS = set('*?[')
+
+
+class MetadataIndex:
+    """
+    SQLite (WAL) index of every file and directory under basedir, so
+    listings, search and size/mtime lookups do not touch the tree.
+
+     - rebuild() runs at startup and only re-reads directories whose
+       mtime changed since they were last read
+     - record()/forget() are called for every upload and delete, each in
+       its own transaction
+     - every thread (and forked worker process) opens its own connection;
+       readers never wait for writers (WAL)
+
+    Files changed on disk behind the server's back are picked up by the
+    next rebuild, when their directory's mtime has changed.
+    """
+    def __init__(self, basedir, db_path, skip=None):
+        self.basedir = basedir
+        self.db_path = os.path.abspath(db_path)
+        self.skip = skip
+        self.local = threading.local()
+        self.connection().executescript(SCHEMA)
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        # A connection must not be used across fork()
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.row_factory = sqlite3.Row
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def transaction(self):
+        return _Transaction(self.connection())
+
+    def reserved(self, fs_path):
+        return fs_path in (self.db_path, self.db_path + '-wal',
+                           self.db_path + '-shm', self.db_path + '-journal')
+
+    def rel(self, fs_path):
+        rel = os.path.relpath(fs_path, self.basedir)
+        return '' if rel == '.' else rel.replace(os.sep, '/')
+
+    def fs_path(self, rel):
+        return os.path.join(self.basedir, *rel.split('/')) if rel else self.basedir
+
+    @staticmethod
+    def split(rel):
+        if not rel:
+            return None, ''
+        parent, _, name = rel.rpartition('/')
+        return parent, name
+
+    # Startup
+
+    def rebuild(self):
+        """
+        Bring the index in line with the tree. Directories whose mtime is
+        unchanged since their last scan are trusted (only their subdirs
+        are visited); the others are re-read and their rows replaced.
+        """
+        started = time.monotonic()
+        scanned = trusted = 0
+        with self.transaction() as conn:
+            stack = ['']
+            while stack:
+                rel = stack.pop()
+                try:
+                    st = os.stat(self.fs_path(rel))
+                except FileNotFoundError:
+                    self.delete(conn, rel)
+                    continue
+                row = conn.execute('SELECT scanned_ns FROM files WHERE path = ?', (rel,)).fetchone()
+                if row is not None and row['scanned_ns'] == st.st_mtime_ns:
+                    trusted += 1
+                else:
+                    self.scan(conn, rel, st)
+                    scanned += 1
+                stack.extend(r['path'] for r in conn.execute(
+                    'SELECT path FROM files WHERE parent = ? AND is_dir = 1', (rel,)))
+        logging.warning(f"Metadata index: {scanned} directories read, {trusted} unchanged "
+                        f"({time.monotonic() - started:.2f}s)")
+
+    def scan(self, conn, rel, st):
+        fs_dir = self.fs_path(rel)
+        entries = {}
+        with os.scandir(fs_dir) as it:
+            for entry in it:
+                if entry.is_symlink() or (self.skip and self.skip(entry.path)):
+                    continue
+                try:
+                    entries[entry.name] = (entry.is_dir(), entry.stat())
+                except FileNotFoundError:
+                    continue
+
+        for row in conn.execute('SELECT path, name, is_dir FROM files WHERE parent = ?', (rel,)).fetchall():
+            current = entries.get(row['name'])
+            if current is None or current[0] != bool(row['is_dir']):
+                self.delete(conn, row['path'])
+        for name, (is_dir, est) in entries.items():
+            self.upsert(conn, f"{rel}/{name}" if rel else name, is_dir, est)
+        self.upsert(conn, rel, True, st, scanned=True)
+
+    # Writes
+
+    def upsert(self, conn, rel, is_dir, st, scanned=False):
+        """
+        Insert or update one row. A directory's scanned_ns only moves when
+        its own entries have been read (scanned=True).
+        """
+        parent, name = self.split(rel)
+        size = 0 if is_dir else st.st_size
+        scanned_ns = st.st_mtime_ns if scanned else None
+        conn.execute(
+            'INSERT INTO files (path, parent, name, is_dir, size, mtime, scanned_ns) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (path) DO UPDATE SET is_dir = excluded.is_dir, size = excluded.size, '
+            'mtime = excluded.mtime, scanned_ns = COALESCE(excluded.scanned_ns, files.scanned_ns)',
+            (rel, parent, name, int(is_dir), size, st.st_mtime, scanned_ns))
+
+    def delete(self, conn, rel):
+        conn.execute('DELETE FROM files WHERE path = ?', (rel,))
+        if rel:
+            conn.execute('DELETE FROM files WHERE path >= ? AND path < ?', (rel + '/', rel + '0'))
+
+    def touch_parents(self, conn, rel):
+        """
+        Refresh the rows of every directory above rel. Directories that
+        were fully indexed stay so: the change in their mtime is ours.
+        """
+        parent = self.split(rel)[0]
+        while parent is not None:
+            st = os.stat(self.fs_path(parent))
+            row = conn.execute('SELECT scanned_ns FROM files WHERE path = ?', (parent,)).fetchone()
+            self.upsert(conn, parent, True, st,
+                        scanned=row is not None and row['scanned_ns'] is not None)
+            parent = self.split(parent)[0]
+
+    def record(self, fs_path):
+        """
+        Index a file that was just written.
+        """
+        rel = self.rel(fs_path)
+        st = os.stat(fs_path)
+        with self.transaction() as conn:
+            self.upsert(conn, rel, False, st)
+            self.touch_parents(conn, rel)
+
+    def forget(self, fs_path):
+        """
+        Drop a path that was just removed.
+        """
+        rel = self.rel(fs_path)
+        with self.transaction() as conn:
+            self.delete(conn, rel)
+            self.touch_parents(conn, rel)
+
+    # Reads
+
+    @staticmethod
+    def describe(row):
+        return {'path': '/' + row['path'], 'type': 'dir' if row['is_dir'] else 'file',
+                'size': row['size'], 'mtime': row['mtime']}
+
+    def lookup(self, fs_path):
+        """
+        {'path', 'type', 'size', 'mtime'} for fs_path, or None.
+        """
+        conn = self.connection()
+        row = conn.execute('SELECT * FROM files WHERE path = ?', (self.rel(fs_path),)).fetchone()
+        return self.describe(row) if row is not None else None
+
+    def list_dir(self, fs_path):
+        """
+        Sorted [(name, is_dir)] of a directory, or None if it is not one.
+        """
+        rel = self.rel(fs_path)
+        conn = self.connection()
+        row = conn.execute('SELECT is_dir FROM files WHERE path = ?', (rel,)).fetchone()
+        if row is None or not row['is_dir']:
+            return None
+        return [(r['name'], bool(r['is_dir'])) for r in conn.execute(
+            'SELECT name, is_dir FROM files WHERE parent = ? ORDER BY name', (rel,))]
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """
+        Paths matching a glob (if query has * ? or [) or starting with a
+        prefix, in path order. Returns (results, truncated).
+        """
+        query = query.lstrip('/')
+        conn = self.connection()
+        if GLOB_CHARS & set(query):
+            rows = conn.execute("SELECT * FROM files WHERE path != '' AND path GLOB ? "
+                                'ORDER BY path LIMIT ?', (query, limit + 1))
+        else:
+            rows = conn.execute("SELECT * FROM files WHERE path != '' AND path >= ? AND path < ? "
+                                'ORDER BY path LIMIT ?', (query, query + MAX_CHAR, limit + 1))
+        results = [self.describe(r) for r in rows]
+        return results[:limit], len(results) > limit
+
+
+class _Transaction:
+    """
+    `with index.transaction() as conn:` runs the block in one transaction
+    (BEGIN IMMEDIATE, so concurrent writers queue on the busy timeout).
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('COMMIT' if exc_type is None else 'ROLLBACK')
@@ -3,3 +3,9 @@
 
 ab -n 100 -c 50 http://localhost:8887/testing.txt
 
+
+# bandingkan mode server (throughput, latency p50/p90/p99, RSS)
+python3 bench.py --modes threadpool,processpool,asyncio,reactor -n 5000 -c 50
+
+# putar ulang trafik yang direkam dengan --capture
+python3 replay.py /var/tmp/prod.cap --mode reactor --seed --speed 2 -- --docroot /tmp/replay
@@ -0,0 +1,5 @@
+"""
+Unified launcher for the progjar HTTP servers.
+
+    python -m progjar serve --mode threadpool|processpool|asyncio|tls|reactor
+"""
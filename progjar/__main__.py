@@ -0,0 +1,14 @@
+import os
+import sys
+
+# The server modules live at the repository root and import the local
+# http.py (which shadows the stdlib package), so the root must come first
+# on sys.path before anything imports `http`.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if sys.path[0] != ROOT:
+    sys.path.insert(0, ROOT)
+
+from progjar.cli import main
+
+if __name__ == "__main__":
+    sys.exit(main())
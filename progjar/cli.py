@@ -0,0 +1,100 @@
+import sys
+import json
+import logging
+import argparse
+import importlib
+from progjar.config import ServerConfig, MODE_DEFAULTS
+
+# mode -> module exposing run(config)
+MODES = {
+    'threadpool': 'server_thread_pool_http',
+    'processpool': 'server_process_pool_http',
+    'asyncio': 'server_asyncio_stream_http',
+    'tls': 'server_thread_http_secure',
+    'reactor': 'server_async_http',
+    'interppool': 'server_interp_pool_http',
+}
+
+
+def parse_limit(text):
+    """
+    Parse a --limit NAME=VALUE option; VALUE is read as JSON (so 5, 2.5).
+    """
+    name, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got '{text}'")
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid value for {name}: '{value}'")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m progjar')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    serve = sub.add_parser('serve', help='run one of the HTTP servers')
+    serve.add_argument('--mode', choices=sorted(MODE_DEFAULTS), help='concurrency model')
+    serve.add_argument('--config', help='JSON config file')
+    serve.add_argument('--host')
+    serve.add_argument('--port', type=int)
+    serve.add_argument('--workers', type=int, help='pool size, small lane (threadpool, processpool); connection threads (interppool)')
+    serve.add_argument('--large-workers', dest='large_workers', type=int,
+                       help='workers in the large-request lane, 0 disables lanes')
+    serve.add_argument('--large-threshold', dest='large_threshold', type=int,
+                       help='bytes (file size or Content-Length) that make a request large')
+    serve.add_argument('--subscribers', type=int,
+                       help='/_changes subscribers served at once, more get 503')
+    serve.add_argument('--interpreters', type=int,
+                       help='subinterpreters running handlers (interppool, default one per CPU)')
+    serve.add_argument('--file-cache', dest='file_cache', type=int,
+                       help='bytes of small files snapshotted in shared memory (interppool), 0 disables')
+    serve.add_argument('--test-interpreters', dest='test_interpreters', action=argparse.BooleanOptionalAction,
+                       help="interppool on Python 3.13: use the internal test.support.interpreters")
+    serve.add_argument('--backlog', type=int, help='listen() backlog')
+    serve.add_argument('--recv-size', dest='recv_size', type=int, help='bytes per recv() call')
+    serve.add_argument('--tcp-nodelay', dest='tcp_nodelay', action=argparse.BooleanOptionalAction,
+                       help='set TCP_NODELAY on the listener')
+    serve.add_argument('--rcvbuf', type=int, help='SO_RCVBUF in bytes')
+    serve.add_argument('--sndbuf', type=int, help='SO_SNDBUF in bytes')
+    serve.add_argument('--docroot', help='directory served and written to')
+    serve.add_argument('--storage', choices=('plain', 'cas'),
+                       help='upload storage; cas stores identical content once')
+    serve.add_argument('--index', metavar='PATH',
+                       help='SQLite metadata index for listings, /_search and lookups')
+    serve.add_argument('--capture', metavar='PATH',
+                       help='append request metadata and timing to a capture log (see replay.py)')
+    serve.add_argument('--certfile', help='TLS certificate (tls mode)')
+    serve.add_argument('--keyfile', help='TLS private key (tls mode)')
+    serve.add_argument('--http2', dest='http2', action=argparse.BooleanOptionalAction,
+                       help='offer h2 through ALPN (tls mode, default on)')
+    serve.add_argument('--limit', dest='limits', action='append', type=parse_limit, default=[],
+                       metavar='NAME=VALUE', help='request limit, e.g. header_timeout=5 (repeatable)')
+    serve.add_argument('--print-config', action='store_true',
+                       help='print the resolved config and exit')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    overrides = {key: val for key, val in vars(args).items()
+                 if key not in ('command', 'config', 'limits', 'print_config') and val is not None}
+    if args.limits:
+        overrides['limits'] = dict(args.limits)
+    try:
+        config = ServerConfig(args.config, overrides)
+    except (OSError, ValueError) as e:
+        print(f"Config error: {e}", file=sys.stderr)
+        return 2
+
+    # Always show what is actually running so benchmark runs are reproducible
+    print(config.describe(), flush=True)
+    if args.print_config:
+        return 0
+
+    server = importlib.import_module(MODES[config.mode])
+    server.run(config)
+    return 0
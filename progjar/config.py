@@ -0,0 +1,139 @@
+import os
+import json
+import socket
+from http_io import RequestLimits
+from storage import STORAGE_BACKENDS
+
+# Defaults that used to be hardcoded in each server script
+MODE_DEFAULTS = {
+    'threadpool':  {'port': 8885, 'backlog': 50, 'recv_size': 1024},
+    'processpool': {'port': 8889, 'backlog': 50, 'recv_size': 4096},
+    'asyncio':     {'port': 8886, 'backlog': 100, 'recv_size': 65536},
+    'tls':         {'port': 8443, 'backlog': 1, 'recv_size': 32},
+    'reactor':     {'port': 8887, 'backlog': 128, 'recv_size': 8192},
+    'interppool':  {'port': 8890, 'backlog': 50, 'recv_size': 65536},
+}
+
+# Settings shared by every mode
+DEFAULTS = {
+    'mode': 'threadpool',
+    'host': '0.0.0.0',
+    'port': None,
+    'workers': 20,
+    # Size lanes (threadpool, processpool): requests at or above
+    # large_threshold bytes run on large_workers separate workers; 0 disables
+    'large_threshold': 1024 * 1024,
+    'large_workers': 4,
+    # /_changes long-polls and SSE streams held at once, the rest get 503.
+    # threadpool runs them on this many threads of their own; processpool,
+    # interppool and tls serve them from the pool, capped at workers - 1
+    'subscribers': 8,
+    # interppool: subinterpreters running handlers (None = one per CPU) and
+    # bytes of small files kept in a shared memory snapshot (0 disables)
+    'interpreters': None,
+    'file_cache': 64 * 1024 * 1024,
+    # interppool on 3.13: use test.support.interpreters (CPython's internal
+    # test helper) since concurrent.interpreters only exists from 3.14
+    'test_interpreters': False,
+    'backlog': None,
+    'recv_size': None,
+    'tcp_nodelay': False,
+    'rcvbuf': None,
+    'sndbuf': None,
+    'docroot': '.',
+    # 'plain' files, or 'cas': deduplicated content store with ETags
+    'storage': 'plain',
+    # SQLite metadata index file for listings/search/lookups, None to disable
+    'index': None,
+    # Binary request log for replay.py (metadata only, no bodies), None to disable
+    'capture': None,
+    'certfile': 'certs/domain.crt',
+    'keyfile': 'certs/domain.key',
+    'http2': True,
+    'limits': {},
+}
+
+
+class ServerConfig:
+    """
+    Resolved server settings. Values are layered, later wins:
+      DEFAULTS -> MODE_DEFAULTS[mode] -> JSON config file -> CLI overrides
+    The file path and overrides are kept so SIGHUP can re-read the file.
+    """
+    def __init__(self, path=None, overrides=None):
+        self.path = path
+        self.overrides = dict(overrides or {})
+
+        values = dict(DEFAULTS)
+        from_file = {}
+        if path:
+            with open(path) as f:
+                from_file = json.load(f)
+        mode = self.overrides.get('mode') or from_file.get('mode') or values['mode']
+        if mode not in MODE_DEFAULTS:
+            raise ValueError(f"Unknown mode '{mode}', expected one of: {', '.join(MODE_DEFAULTS)}")
+        values.update(MODE_DEFAULTS[mode])
+
+        for layer in (from_file, self.overrides):
+            for key, val in layer.items():
+                if key not in DEFAULTS:
+                    raise ValueError(f"Unknown config key '{key}'")
+                if key == 'limits':
+                    values['limits'] = dict(values['limits'], **val)
+                elif val is not None:
+                    values[key] = val
+        values['mode'] = mode
+
+        # Fail early on misspelled limit names and unknown backends
+        self.request_limits_from(values['limits'])
+        if values['storage'] not in STORAGE_BACKENDS:
+            raise ValueError(f"Unknown storage '{values['storage']}', "
+                             f"expected one of: {', '.join(STORAGE_BACKENDS)}")
+        for key, val in values.items():
+            setattr(self, key, val)
+
+    @classmethod
+    def for_mode(cls, mode):
+        return cls(overrides={'mode': mode})
+
+    def reloaded(self):
+        """
+        Re-read the config file with the same CLI overrides (SIGHUP).
+        host/port/backlog only change on restart, since the listener is kept.
+        """
+        return ServerConfig(self.path, self.overrides)
+
+    @staticmethod
+    def request_limits_from(values):
+        try:
+            return RequestLimits(**values)
+        except TypeError as e:
+            raise ValueError(f"Invalid limits: {e}")
+
+    def request_limits(self):
+        return self.request_limits_from(self.limits)
+
+    def cert_paths(self):
+        return os.path.abspath(self.certfile), os.path.abspath(self.keyfile)
+
+    def apply_socket_options(self, sock):
+        """
+        Apply tuning options to the listening socket; accepted sockets
+        inherit them on Linux.
+        """
+        if self.tcp_nodelay:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.rcvbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        if self.sndbuf:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+
+    def as_dict(self):
+        values = {key: getattr(self, key) for key in DEFAULTS}
+        values['limits'] = vars(self.request_limits())
+        values['docroot'] = os.path.abspath(self.docroot)
+        values['config_file'] = self.path
+        return values
+
+    def describe(self):
+        return json.dumps(self.as_dict(), indent=2, sort_keys=True)
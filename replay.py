@@ -0,0 +1,203 @@
+import sys
+import time
+import random
+import argparse
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from capture import read_capture
+from bench import fetch, percentile, summarize, print_table, serving
+
+# Body size used to seed files whose size the capture does not tell
+DEFAULT_SEED_SIZE = 1024
+
+
+def payload(seed, size):
+    """
+    Deterministic filler for a request body: the same record always sends
+    the same bytes, different records different bytes (so a
+    deduplicating store sees as many distinct uploads as in production).
+    """
+    return random.Random(seed).randbytes(size)
+
+
+def build_request(host, record, seed):
+    body = payload(seed, record.req_size) if record.req_size else b''
+    lines = [f"{record.method} {record.path} HTTP/1.0", f"Host: {host}"]
+    if record.method == 'POST' or body:
+        lines.append(f"Content-Length: {len(body)}")
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode() + body
+
+
+def file_key(path):
+    """
+    The file a request touches: query dropped, /upload/<name> and /<name>
+    are the same file.
+    """
+    path = path.split('?', 1)[0]
+    if path.startswith('/upload/'):
+        return '/' + path[len('/upload/'):]
+    return path
+
+
+def files_to_seed(records):
+    """
+    Paths that are read or deleted in the capture before (or without)
+    being uploaded in it, with the best size estimate for each: these
+    existed on the captured server and must exist on the target.
+    """
+    uploaded, needed = set(), {}
+    for record in records:
+        path = record.path.split('?', 1)[0]
+        if path.startswith('/_') or path.endswith('/'):
+            continue
+        if record.method == 'POST' and path.startswith('/upload/'):
+            uploaded.add(file_key(path))
+        elif record.method in ('GET', 'DELETE') and path not in uploaded and record.status < 400:
+            size = record.resp_size if record.method == 'GET' else None
+            if size is not None or path not in needed:
+                needed[path] = size if size is not None else DEFAULT_SEED_SIZE
+    return needed
+
+
+def seed(address, records):
+    needed = files_to_seed(records)
+    for i, (path, size) in enumerate(sorted(needed.items())):
+        body = payload(-1 - i, size)
+        request = (f"POST /upload{path} HTTP/1.0\r\nHost: {address[0]}\r\n"
+                   f"Content-Length: {size}\r\n\r\n").encode() + body
+        status, _ = fetch(address, request)
+        if status >= 400:
+            print(f"seed {path}: HTTP {status}", file=sys.stderr)
+    return len(needed)
+
+
+def replay(address, records, speed, concurrency):
+    """
+    Re-issue the captured requests open-loop: record i is due at its
+    original offset from the first record divided by `speed` (0 means no
+    waiting), on at most `concurrency` connections at a time. Latency is
+    measured from when a request was due, not from when it went out, so
+    a server (or replayer) falling behind shows up in it instead of
+    delaying the requests that would have measured it. Requests for the
+    same file go one at a time in capture order, as they did when they
+    were captured. Returns per-method latency summaries, the send lag and
+    status mismatches.
+    """
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    mismatched = [0]
+    lags = []
+    lock = threading.Lock()
+    # Per file with a request in flight: (i, record, due) waiting behind it
+    waiting = {}
+
+    def send(key, i, record, due):
+        while True:
+            # Bodies are built here, one per request in flight, not up front
+            request = build_request(address[0], record, i)
+            try:
+                status, _ = fetch(address, request, timeout=120)
+            except OSError:
+                status = 0
+            elapsed = time.perf_counter() - due
+            with lock:
+                if status == 0:
+                    errors[record.method] += 1
+                else:
+                    latencies[record.method].append(elapsed)
+                if status != record.status:
+                    mismatched[0] += 1
+                if not waiting[key]:
+                    del waiting[key]
+                    return
+                i, record, due = waiting[key].popleft()
+
+    first = records[0].time
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        for i, record in enumerate(records):
+            if speed:
+                due = started + (record.time - first) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                lags.append(max(0.0, -delay))
+            else:
+                due = time.perf_counter()
+            key = file_key(record.path)
+            with lock:
+                if key in waiting:
+                    waiting[key].append((i, record, due))
+                    continue
+                waiting[key] = deque()
+            pool.submit(send, key, i, record, due)
+    elapsed = time.perf_counter() - started
+
+    rows = []
+    everything = []
+    for method in sorted(latencies.keys() | errors.keys()):
+        everything += latencies[method]
+        rows.append((method, summarize(latencies[method], errors[method], elapsed)))
+    rows.append(('all', summarize(everything, sum(errors.values()), elapsed)))
+    return rows, lags, mismatched[0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Replay a capture log (progjar serve --capture) against a server '
+                    'and report the latency distribution per method.')
+    parser.add_argument('capture', help='capture log file')
+    parser.add_argument('--target', help='host:port of a running server')
+    parser.add_argument('--mode', help='start this progjar mode instead of using --target')
+    parser.add_argument('--port', type=int, default=18600, help='port used with --mode')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='time scale: 1 = as captured, 4 = four times faster, 0 = no pauses')
+    parser.add_argument('-c', '--concurrency', type=int, default=64,
+                        help='most requests in flight at once')
+    parser.add_argument('-n', '--limit', type=int, help='replay only the first N records')
+    parser.add_argument('--seed', action='store_true',
+                        help='first upload files the capture reads but never uploads')
+    parser.epilog = 'Extra `progjar serve` options for --mode go after --, e.g. -- --workers 8'
+    # Split off the serve options by hand: REMAINDER after a positional
+    # would swallow our own options too
+    argv = sys.argv[1:] if argv is None else list(argv)
+    serve_args = []
+    if '--' in argv:
+        cut = argv.index('--')
+        argv, serve_args = argv[:cut], argv[cut + 1:]
+    args = parser.parse_args(argv)
+    if bool(args.target) == bool(args.mode):
+        parser.error('give exactly one of --target or --mode')
+
+    records = sorted(read_capture(args.capture), key=lambda r: r.time)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        parser.error('capture log is empty')
+    span = records[-1].time - records[0].time
+    print(f"{len(records)} requests over {span:.1f}s captured, replaying at "
+          f"{'full speed' if not args.speed else f'{args.speed:g}x'}")
+
+    def run(address):
+        if args.seed:
+            print(f"seeded {seed(address, records)} files")
+        return replay(address, records, args.speed, args.concurrency)
+
+    if args.mode:
+        with serving(args.mode, args.port, serve_args):
+            rows, lags, mismatched = run(('localhost', args.port))
+    else:
+        host, port = args.target.rsplit(':', 1)
+        rows, lags, mismatched = run((host, int(port)))
+
+    print_table(rows)
+    if lags:
+        lags.sort()
+        print(f"send lag p99 {percentile(lags, 99) * 1000:.2f} ms, max {lags[-1] * 1000:.2f} ms")
+    print(f"status differs from capture: {mismatched}/{len(records)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+import os
+import json
+import bisect
+import threading
+import multiprocessing as mp
+from urllib.parse import unquote
+from http_io import content_length
+
+SMALL = 'small'
+LARGE = 'large'
+LANES = (SMALL, LARGE)
+# /_changes subscribers: own capped lane, no latency histogram (a
+# subscriber's "latency" is just how long it listened)
+CHANGES = 'changes'
+
+# Upper bounds (ms) of the latency histogram buckets; the last one is open
+BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500,
+              1000, 2000, 5000, 10000, 30000, 60000, float('inf'))
+
+
+def classify(httpserver, header_part: bytes, headers, threshold):
+    """
+    Pick a lane from what is known right after the headers are read:
+     - uploads by Content-Length
+     - file GETs by their size on disk
+     - archives and batch operations are always large
+    Everything else (listings, deletes, errors) is small.
+    """
+    try:
+        method, target = header_part.split(b'\r\n', 1)[0].decode('latin-1').split()[:2]
+    except ValueError:
+        return SMALL
+    path, _, query = target.partition('?')
+    method = method.upper()
+
+    if path.startswith('/_batch/'):
+        return LARGE
+    if method == 'POST':
+        return LARGE if content_length(headers) >= threshold else SMALL
+    if method != 'GET':
+        return SMALL
+    if path.endswith('/'):
+        return LARGE if 'archive=' in query else SMALL
+    fs_path = httpserver.get_safe_path(unquote(path))
+    info = httpserver.stat_path(fs_path) if fs_path else None
+    return LARGE if info and info['size'] >= threshold else SMALL
+
+
+class LaneStats:
+    """
+    Per-lane latency histogram (time from accept to response sent).
+    With shared=True the counters live in shared memory so forked worker
+    processes all record into, and report, the same numbers.
+    """
+    def __init__(self, shared=False):
+        # Per lane: one counter per bucket, then the sum of latencies (ms)
+        self.width = len(BUCKETS_MS) + 1
+        size = self.width * len(LANES)
+        if shared:
+            self.values = mp.Array('d', size)
+            self.lock = self.values.get_lock()
+        else:
+            self.values = [0.0] * size
+            self.lock = threading.Lock()
+
+    def record(self, lane, seconds):
+        if lane not in LANES:
+            return
+        ms = seconds * 1000.0
+        base = LANES.index(lane) * self.width
+        bucket = bisect.bisect_left(BUCKETS_MS, ms)
+        with self.lock:
+            self.values[base + bucket] += 1
+            self.values[base + self.width - 1] += ms
+
+    def snapshot(self):
+        """
+        Return {lane: {count, mean_ms, p50_ms, p90_ms, p99_ms}}. Percentiles
+        are reported as the upper bound of the bucket they fall in.
+        """
+        with self.lock:
+            values = list(self.values)
+        result = {}
+        for i, lane in enumerate(LANES):
+            row = values[i * self.width:(i + 1) * self.width]
+            counts, total_ms = row[:-1], row[-1]
+            count = int(sum(counts))
+            lane_stats = {'count': count, 'mean_ms': round(total_ms / count, 3) if count else 0.0}
+            for pct in (50, 90, 99):
+                lane_stats[f'p{pct}_ms'] = self.bucket_percentile(counts, count, pct)
+            result[lane] = lane_stats
+        return result
+
+    @staticmethod
+    def bucket_percentile(counts, count, pct):
+        if not count:
+            return 0.0
+        rank = pct / 100.0 * count
+        seen = 0
+        for bound, n in zip(BUCKETS_MS, counts):
+            seen += n
+            if seen >= rank:
+                return bound if bound != float('inf') else None
+        return None
+
+    def response(self, httpserver):
+        body = (json.dumps(self.snapshot(), indent=2) + '\n').encode()
+        return httpserver.response(200, 'OK', body, {'Content-Type': 'application/json'})
+
+
+def is_stats_request(header_part: bytes):
+    return header_part.startswith(b'GET /_stats/lanes ')
+
+
+def is_changes_request(header_part: bytes):
+    return header_part.startswith(b'GET /_changes') and header_part[13:14] in (b' ', b'?')
+
+
+class SubscriberSlots:
+    """
+    Caps how many /_changes subscribers (long-polls, SSE streams) are
+    held at once, so they cannot occupy every worker of a pool; a
+    subscriber over the cap is answered 503 right away. With shared=True
+    the slots live in shared memory and are taken by forked worker
+    processes: a slot is a pid, and one held by a process that has died
+    (e.g. killed after a drain timeout) counts as free.
+    """
+    def __init__(self, count, shared=False):
+        self.count = max(0, count)
+        self.shared = shared
+        if shared:
+            self.holders = mp.Array('i', self.count or 1)
+            self.lock = self.holders.get_lock()
+        else:
+            self.held = 0
+            self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if not self.shared:
+                if self.held >= self.count:
+                    return False
+                self.held += 1
+                return True
+            for i in range(self.count):
+                if not self.holders[i] or not pid_alive(self.holders[i]):
+                    self.holders[i] = os.getpid()
+                    return True
+        return False
+
+    def release(self):
+        with self.lock:
+            if not self.shared:
+                self.held -= 1
+                return
+            # Worker processes are single-threaded: at most one slot each
+            for i in range(self.count):
+                if self.holders[i] == os.getpid():
+                    self.holders[i] = 0
+                    return
+
+    @staticmethod
+    def busy(httpserver):
+        body = b'Too many change feed subscribers, retry later\n'
+        return httpserver.response(503, 'Service Unavailable', body,
+                                   {'Content-Type': 'text/plain', 'Retry-After': '5'})
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -1,61 +1,384 @@
-import socket
-import time
+import os
 import sys
-import asyncore
+import time
+import socket
 import logging
-from http import HttpServer
-
-httpserver = HttpServer()
-rcv = ""
-
-class ProcessTheClient(asyncore.dispatcher_with_send):
-	def handle_read(self):
-		global rcv
-		data = self.recv(1024)
-		if data:
-			d = data.decode()
-			rcv = rcv + d
-			if rcv[-2:] == '\r\n':
-				# end of command, proses string
-				logging.warning("data dari client: {}".format(rcv))
-				hasil = httpserver.proses(rcv)
-				#hasil sudah dalam bentuk bytes
-				hasil = hasil + "\r\n\r\n".encode()
-				#agar bisa dioperasikan dengan string \r\n\r\n maka harus diencode dulu => bytes
-				logging.warning("balas ke  client: {}".format(hasil))
-				self.send(hasil) #hasil sudah dalam bentuk bytes, kirimkan balik ke client
-				rcv = ""
-				self.close()
-
-		#self.send('HTTP/1.1 200 OK \r\n\r\n'.encode())
-			#self.send("{}" . format(httpserver.proses(d)))
-		self.close()
-
-class Server(asyncore.dispatcher):
-	def __init__(self,portnumber):
-		asyncore.dispatcher.__init__(self)
-		self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
-		self.set_reuse_addr()
-		self.bind(('',portnumber))
-		self.listen(1)
-		logging.warning("running on port {}" . format(portnumber))
-
-	def handle_accept(self):
-		pair = self.accept()
-		if pair is not None:
-			sock, addr = pair
-			logging.warning("connection from {}" . format(repr(addr)))
-			handler = ProcessTheClient(sock)
+import selectors
+from collections import deque
+from http import HttpServer, ChangeStream
+from http_io import RequestError, FileRegion, parse_headers, content_length
+from lifecycle import open_listener
+from progjar.config import ServerConfig
+
+# Set by configure(): resolved config, HTTP handler and request limits
+config = None
+httpserver = None
+limits = None
+
+# How often the loop wakes up to expire stalled connections
+SWEEP_INTERVAL = 0.5
+# Max buffers handed to one sendmsg() call (writev)
+IOV_MAX = 64
+# Pull more pieces of a streaming response while less than this is queued
+STREAM_WATERMARK = 256 * 1024
+
+
+def configure(cfg):
+    global config, httpserver, limits
+    config = cfg
+    httpserver = HttpServer(cfg.docroot, cfg.storage, cfg.index, cfg.capture)
+    limits = cfg.request_limits()
+
+configure(ServerConfig.for_mode('reactor'))
+
+
+class Connection:
+    """
+    State of one client connection. __slots__ keeps the per-connection
+    footprint to the slots plus the preallocated read buffer.
+    """
+    __slots__ = ('sock', 'addr', 'buf', 'filled', 'scanned', 'header_len',
+                 'expected', 'out', 'out_bytes', 'pieces', 'region',
+                 'started', 'last_active', 'phase_deadline', 'responding', 'follow')
+
+    def __init__(self, sock, addr, now):
+        self.sock = sock
+        self.addr = addr
+        self.buf = bytearray(config.recv_size)
+        self.filled = 0
+        self.scanned = 0
+        self.header_len = None
+        self.expected = 0
+        self.out = deque()
+        self.out_bytes = 0
+        self.pieces = None
+        self.region = None
+        self.started = now
+        self.last_active = now
+        self.phase_deadline = now + limits.header_timeout
+        self.responding = False
+        # ChangeStream of a /_changes subscriber, None otherwise
+        self.follow = None
+
+    def grow(self, size):
+        buf = bytearray(size)
+        buf[:self.filled] = self.buf[:self.filled]
+        self.buf = buf
+
+    def request_line(self):
+        if self.buf is None:
+            return b''
+        end = self.buf.find(b'\r\n', 0, self.filled)
+        return bytes(self.buf[:end if end >= 0 else self.filled])
+
+    def queue(self, data):
+        if data:
+            self.out.append(memoryview(data))
+            self.out_bytes += len(data)
+
+
+class Reactor:
+    """
+    Single-threaded event loop on selectors.DefaultSelector (epoll on Linux).
+    Requests are read into per-connection buffers with recv_into(), handled
+    inline by HttpServer, and responses are written with sendmsg() over a
+    queue of buffers; FileRegion pieces go out through os.sendfile().
+    Handlers run on the loop thread, so a slow handler (e.g. a large batch)
+    delays other connections while it runs.
+    /_changes subscribers are parked without a thread: the change feed
+    wakes the loop through a socketpair and each subscriber is polled.
+    """
+    def __init__(self, listener):
+        self.listener = listener
+        self.listener.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(listener, selectors.EVENT_READ, None)
+        self.conns = {}
+        self.next_sweep = time.monotonic() + SWEEP_INTERVAL
+        self.followers = set()
+        self.feeds = set()
+        # Change feeds publish from other threads; they wake us through this pair
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ, self)
+
+    def serve_forever(self):
+        while True:
+            for key, mask in self.selector.select(SWEEP_INTERVAL):
+                conn = key.data
+                if conn is None:
+                    self.accept()
+                    continue
+                if conn is self:
+                    self.on_wake()
+                    continue
+                try:
+                    if mask & selectors.EVENT_READ:
+                        self.on_readable(conn)
+                    elif mask & selectors.EVENT_WRITE:
+                        self.on_writable(conn)
+                except RequestError as e:
+                    self.respond(conn, httpserver.reject(e, conn.request_line(), conn.started))
+                except OSError as e:
+                    logging.warning(f"[{conn.addr}] Connection error: {e}")
+                    self.close(conn)
+                except Exception as e:
+                    # A failing handler only costs its own connection
+                    logging.error(f"[{conn.addr}] Unexpected error: {e}")
+                    self.close(conn)
+            now = time.monotonic()
+            if now >= self.next_sweep:
+                self.sweep(now)
+                self.next_sweep = now + SWEEP_INTERVAL
+
+    def accept(self):
+        # Drain the accept queue in one go
+        while True:
+            try:
+                sock, addr = self.listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logging.error(f"Accept error: {e}")
+                return
+            sock.setblocking(False)
+            conn = Connection(sock, addr, time.monotonic())
+            self.conns[sock.fileno()] = conn
+            self.selector.register(sock, selectors.EVENT_READ, conn)
+
+    def on_readable(self, conn):
+        if conn.follow is not None:
+            # A subscriber only sends to hang up
+            if not conn.sock.recv(4096):
+                self.close(conn)
+            return
+        if conn.filled == len(conn.buf):
+            self.make_room(conn)
+        n = conn.sock.recv_into(memoryview(conn.buf)[conn.filled:])
+        if not n:
+            self.close(conn)
+            return
+        conn.filled += n
+        conn.last_active = time.monotonic()
+
+        if conn.header_len is None:
+            # Only rescan the new bytes (plus 3 for a split terminator)
+            end = conn.buf.find(b'\r\n\r\n', max(0, conn.scanned - 3), conn.filled)
+            conn.scanned = conn.filled
+            if end < 0:
+                if conn.filled > limits.max_header_bytes:
+                    raise RequestError(431, 'Request Header Fields Too Large', 'Header block too large')
+                return
+            if end > limits.max_header_bytes:
+                raise RequestError(431, 'Request Header Fields Too Large', 'Header block too large')
+            headers = parse_headers(bytes(conn.buf[:end]), limits)
+            conn.header_len = end + 4
+            conn.expected = content_length(headers)
+            conn.phase_deadline = conn.last_active + limits.body_timeout
+
+        total = conn.header_len + conn.expected
+        if conn.filled >= total:
+            request = bytes(conn.buf[:total])
+            conn.buf = None
+            self.respond(conn, httpserver.proses(request))
+
+    def make_room(self, conn):
+        if conn.header_len is not None:
+            # Body: double as it arrives, never past what was announced, so
+            # a bare Content-Length header costs nothing up front
+            conn.grow(min(len(conn.buf) * 2, conn.header_len + conn.expected))
+            return
+        if len(conn.buf) > limits.max_header_bytes:
+            raise RequestError(431, 'Request Header Fields Too Large', 'Header block too large')
+        conn.grow(min(len(conn.buf) * 2, limits.max_header_bytes + 4))
+
+    def respond(self, conn, response):
+        conn.responding = True
+        conn.last_active = time.monotonic()
+        # A complete response must be sent within send_timeout; a stream
+        # (archive, batch results) may take as long as it keeps moving,
+        # see sweep()
+        conn.phase_deadline = float('inf')
+        if isinstance(response, (bytes, bytearray)):
+            conn.phase_deadline = conn.last_active + limits.send_timeout
+            conn.queue(response)
+        elif isinstance(response, ChangeStream):
+            conn.follow = response
+            conn.queue(response.head())
+            self.followers.add(conn)
+            if response.feed not in self.feeds:
+                self.feeds.add(response.feed)
+                response.feed.listen(self.wake)
+            self.advance(conn, time.monotonic())
+            return
+        else:
+            conn.pieces = iter(response)
+        self.selector.modify(conn.sock, selectors.EVENT_WRITE, conn)
+        self.on_writable(conn)
+
+    def wake(self):
+        try:
+            self.wake_w.send(b'x')
+        except OSError:
+            # Buffer full: a wake-up is pending anyway
+            pass
+
+    def on_wake(self):
+        try:
+            while self.wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        now = time.monotonic()
+        for conn in list(self.followers):
+            self.advance(conn, now)
+
+    def advance(self, conn, now):
+        """
+        Poll a subscriber's ChangeStream and queue whatever it produced.
+        """
+        data, done = conn.follow.poll(now)
+        conn.queue(conn.follow.frame(data))
+        if done:
+            conn.queue(conn.follow.trailer())
+            conn.follow = None
+            self.followers.discard(conn)
+        if conn.out or conn.follow is None:
+            try:
+                self.selector.modify(conn.sock, selectors.EVENT_WRITE, conn)
+                self.on_writable(conn)
+            except OSError as e:
+                logging.warning(f"[{conn.addr}] Connection error: {e}")
+                self.close(conn)
+
+    def fill(self, conn):
+        """
+        Pull pieces of a streaming response until enough is queued or a
+        FileRegion is reached (sent separately with sendfile).
+        """
+        while conn.pieces is not None and conn.region is None and conn.out_bytes < STREAM_WATERMARK:
+            piece = next(conn.pieces, None)
+            if piece is None:
+                conn.pieces = None
+            elif isinstance(piece, FileRegion):
+                conn.region = [piece, None, piece.offset, piece.count]
+            else:
+                conn.queue(piece)
+
+    def on_writable(self, conn):
+        self.fill(conn)
+        if conn.out:
+            try:
+                sent = conn.sock.sendmsg(list(conn.out)[:IOV_MAX])
+            except BlockingIOError:
+                return
+            conn.out_bytes -= sent
+            conn.last_active = time.monotonic()
+            while sent:
+                head = conn.out[0]
+                if sent >= len(head):
+                    sent -= len(head)
+                    conn.out.popleft()
+                else:
+                    conn.out[0] = head[sent:]
+                    sent = 0
+            if conn.out:
+                return
+        if conn.region is not None:
+            self.send_region(conn)
+            return
+        if conn.follow is not None:
+            # Everything sent; wait for events (or a hang-up) again
+            self.selector.modify(conn.sock, selectors.EVENT_READ, conn)
+            return
+        if conn.pieces is None and not conn.out:
+            self.close(conn)
+
+    def send_region(self, conn):
+        region, f, offset, remaining = conn.region
+        if f is None:
+            try:
+                f = conn.region[1] = open(region.path, 'rb')
+            except OSError:
+                # Deleted since it was listed: pad like a shrunk file
+                conn.queue(b'\0' * remaining)
+                conn.region = None
+                return
+        try:
+            sent = os.sendfile(conn.sock.fileno(), f.fileno(), offset, remaining)
+        except BlockingIOError:
+            return
+        conn.last_active = time.monotonic()
+        if sent == 0:
+            # File shrank: keep the framing valid
+            conn.queue(b'\0' * remaining)
+            remaining = 0
+        else:
+            offset += sent
+            remaining -= sent
+        conn.region[2], conn.region[3] = offset, remaining
+        if remaining <= 0:
+            f.close()
+            conn.region = None
+
+    def sweep(self, now):
+        """
+        Drop connections past a deadline. Reading clients get a 408;
+        readers of a response that made no progress for send_timeout are
+        simply closed.
+        """
+        for conn in list(self.conns.values()):
+            if conn.follow is not None:
+                if conn.out and now - conn.last_active > limits.send_timeout:
+                    logging.warning(f"[{conn.addr}] Subscriber not reading, closing")
+                    self.close(conn)
+                elif now >= conn.follow.deadline:
+                    self.advance(conn, now)
+                continue
+            if conn.responding:
+                expired = now - conn.last_active > limits.send_timeout or now > conn.phase_deadline
+            else:
+                expired = (now - conn.last_active > limits.idle_timeout
+                           or now > conn.phase_deadline
+                           or now - conn.started > limits.total_timeout)
+            if not expired:
+                continue
+            if conn.responding:
+                logging.warning(f"[{conn.addr}] Send timed out")
+                self.close(conn)
+            else:
+                try:
+                    error = RequestError(408, 'Request Timeout', 'Client too slow')
+                    self.respond(conn, httpserver.reject(error, conn.request_line(), conn.started))
+                except OSError:
+                    self.close(conn)
+
+    def close(self, conn):
+        if self.conns.pop(conn.sock.fileno(), None) is None:
+            return
+        self.followers.discard(conn)
+        if conn.region is not None and conn.region[1] is not None:
+            conn.region[1].close()
+        self.selector.unregister(conn.sock)
+        conn.sock.close()
+
+
+def run(cfg):
+    configure(cfg)
+    srv = open_listener(config.host, config.port, config.backlog,
+                        setup=config.apply_socket_options)
+    logging.warning(f"Listening on {config.host}:{config.port} (reactor mode)")
+    Reactor(srv).serve_forever()
 
 def main():
-	portnumber=8887
-	try:
-		portnumber=int(sys.argv[1])
-	except:
-		pass
-	svr = Server(portnumber)
-	asyncore.loop()
+    logging.basicConfig(level=logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        config.port = int(sys.argv[1])
+    except (IndexError, ValueError):
+        pass
+    run(config)
 
 if __name__=="__main__":
-	main()
-
+    main()
@@ -6,26 +6,206 @@ import logging
 import multiprocessing
 from concurrent.futures import ProcessPoolExecutor
 import asyncio
-from http import HttpServer
+from http import HttpServer, ChangeStream
+from http_io import RequestError, FileRegion, parse_headers, content_length
+from lifecycle import open_listener
+from progjar.config import ServerConfig
 
-httpserver = HttpServer()
+config = None
+httpserver = None
+limits = None
+
+def configure(cfg):
+	global config, httpserver, limits
+	config = cfg
+	httpserver = HttpServer(cfg.docroot, cfg.storage, cfg.index, cfg.capture)
+	limits = cfg.request_limits()
+
+configure(ServerConfig.for_mode('asyncio'))
+#bytes per panggilan loop.sendfile; send_timeout berlaku per potongan
+SENDFILE_SLICE = 1024 * 1024
 
 class ProcessTheClient(asyncio.Protocol):
+		"""
+		One request per connection. Reading is bounded by `limits`:
+		header/body/total deadlines and an idle timer are armed with
+		loop.call_later, and header/body sizes are checked as data arrives.
+		"""
 		def connection_made(self, transport):
 			peername = transport.get_extra_info('peername')
 			print('Connection from {}'.format(peername))
 			self.transport = transport
-			self.rcv = ""
+			self.loop = asyncio.get_running_loop()
+			self.rcv = bytearray()
+			self.started = time.monotonic()
+			self.headers = None
+			self.header_len = 0
+			self.expected = 0
+			self.done = False
+			self.can_write = asyncio.Event()
+			self.can_write.set()
+			self.wake = None
+			self.idle_timer = None
+			self.phase_timer = self.loop.call_later(limits.header_timeout, self.timed_out)
+			self.total_timer = self.loop.call_later(limits.total_timeout, self.timed_out)
+			self.touch()
+
+		def touch(self):
+			if self.idle_timer is not None:
+				self.idle_timer.cancel()
+			self.idle_timer = self.loop.call_later(limits.idle_timeout, self.timed_out)
+
+		def cancel_timers(self):
+			for timer in (self.idle_timer, self.phase_timer, self.total_timer):
+				if timer is not None:
+					timer.cancel()
+
+		def timed_out(self):
+			self.reject(RequestError(408, 'Request Timeout', 'Client too slow'))
+
+		def reject(self, e):
+			#request ditolak tetap dicatat di capture log
+			end = self.rcv.find(b'\r\n')
+			request_line = bytes(self.rcv[:end if end >= 0 else len(self.rcv)])
+			self.reply(httpserver.reject(e, request_line, self.started))
+
+		def reply(self, hasil):
+			if self.done:
+				return
+			self.done = True
+			self.cancel_timers()
+			if isinstance(hasil, (bytes, bytearray)):
+				self.transport.write(hasil)
+				self.transport.close()
+				return
+			if isinstance(hasil, ChangeStream):
+				self.loop.create_task(self.follow(hasil))
+				return
+			self.loop.create_task(self.stream(hasil))
+
+		async def follow(self, changes):
+			"""
+			Serve /_changes without a thread: sleep until the feed calls
+			us back (from whatever thread published) or the stream's
+			deadline (heartbeat / long-poll timeout) passes, then poll.
+			An idle subscriber costs one task and one Event.
+			"""
+			self.wake = asyncio.Event()
+			def notify():
+				try:
+					self.loop.call_soon_threadsafe(self.wake.set)
+				except RuntimeError:
+					#loop sudah ditutup
+					pass
+			changes.feed.listen(notify)
+			try:
+				self.transport.write(changes.head())
+				while not self.transport.is_closing():
+					self.wake.clear()
+					data, done = changes.poll(time.monotonic())
+					if data:
+						self.transport.write(changes.frame(data))
+					if done:
+						self.transport.write(changes.trailer())
+						break
+					#pelanggan yang tidak membaca selama send_timeout diputus
+					await asyncio.wait_for(self.can_write.wait(), limits.send_timeout)
+					try:
+						await asyncio.wait_for(self.wake.wait(), max(0.0, changes.deadline - time.monotonic()))
+					except asyncio.TimeoutError:
+						pass
+			except asyncio.TimeoutError:
+				logging.warning("subscriber not reading, closing")
+			finally:
+				changes.feed.unlisten(notify)
+				self.transport.close()
+
+		async def stream(self, response):
+			"""
+			Send a StreamingResponse. Pieces are produced in the default
+			executor (they may touch the disk or wait on worker threads)
+			and writing pauses while the transport buffer is full; the
+			stream is cut only if the client reads nothing for send_timeout.
+			"""
+			try:
+				await self.write_pieces(iter(response))
+			except asyncio.TimeoutError:
+				logging.warning("client stopped reading the response, closing")
+			finally:
+				self.transport.close()
+
+		async def write_pieces(self, pieces):
+			while not self.transport.is_closing():
+				piece = await self.loop.run_in_executor(None, next, pieces, None)
+				if piece is None:
+					break
+				if isinstance(piece, FileRegion):
+					await self.send_region(piece)
+					continue
+				self.transport.write(piece)
+				await asyncio.wait_for(self.can_write.wait(), limits.send_timeout)
+
+		async def send_region(self, region):
+			#loop.sendfile memakai os.sendfile jika transport mendukung,
+			#selain itu fallback membaca file per blok
+			try:
+				f = open(region.path, 'rb')
+			except OSError:
+				#file sudah dihapus: isi dengan NUL seperti file yang menyusut
+				sent = 0
+			else:
+				#per potongan, agar batas send_timeout berlaku untuk progres
+				#dan bukan untuk seluruh file
+				sent = 0
+				with f:
+					while sent < region.count:
+						size = min(SENDFILE_SLICE, region.count - sent)
+						n = await asyncio.wait_for(
+							self.loop.sendfile(self.transport, f, region.offset + sent, size),
+							limits.send_timeout)
+						sent += n
+						if n < size:
+							break
+			if sent < region.count:
+				self.transport.write(b'\0' * (region.count - sent))
+
+		def pause_writing(self):
+			self.can_write.clear()
+
+		def resume_writing(self):
+			self.can_write.set()
+
+		def connection_lost(self, exc):
+			self.done = True
+			self.cancel_timers()
+			self.can_write.set()
+			if self.wake is not None:
+				self.wake.set()
+
 		def data_received(self, data: bytes) -> None:
+			if self.done:
+				return
 			try:
-				d = data.decode()
-				self.rcv=self.rcv+d
-				if self.rcv[-2:]=='\r\n':
-					hasil = httpserver.proses(self.rcv)
-					hasil=hasil+"\r\n\r\n".encode()
-					self.transport.write(hasil)
-					self.transport.close()
-					self.rcv=""
+				self.touch()
+				self.rcv += data
+				if self.headers is None:
+					end = self.rcv.find(b'\r\n\r\n')
+					if end < 0:
+						if len(self.rcv) > limits.max_header_bytes:
+							raise RequestError(431, 'Request Header Fields Too Large', 'Header block too large')
+						return
+					if end > limits.max_header_bytes:
+						raise RequestError(431, 'Request Header Fields Too Large', 'Header block too large')
+					self.headers = parse_headers(bytes(self.rcv[:end]), limits)
+					self.header_len = end + 4
+					self.expected = content_length(self.headers)
+					self.phase_timer.cancel()
+					self.phase_timer = self.loop.call_later(limits.body_timeout, self.timed_out)
+				if len(self.rcv) - self.header_len >= self.expected:
+					request = bytes(self.rcv[:self.header_len + self.expected])
+					self.reply(httpserver.proses(request))
+			except RequestError as e:
+				self.reject(e)
 			except OSError as e:
 				pass
 
@@ -34,13 +214,20 @@ class ProcessTheClient(asyncio.Protocol):
 async def Server():
 	loop = asyncio.get_running_loop()
 
+	srv = open_listener(config.host, config.port, config.backlog,
+						setup=config.apply_socket_options)
 	server = await loop.create_server(
 		lambda: ProcessTheClient(),
-		'0.0.0.0', 8886)
+		sock=srv)
+	logging.warning("Listening on {}:{} (asyncio mode)".format(config.host, config.port))
 
 	async with server:
 		await server.serve_forever()
 
+def run(cfg):
+	configure(cfg)
+	asyncio.run(Server())
+
 if __name__=="__main__":
 	asyncio.run(Server())
 
@@ -0,0 +1,238 @@
+import os
+import socket
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from http import HttpServer
+from http_io import RequestReader, RequestError, send_response
+from lifecycle import (open_listener, spawn_next_generation,
+                       notify_previous_generation, SignalFlags)
+from progjar.config import ServerConfig
+from scheduling import SubscriberSlots, is_changes_request
+from shmcache import SharedFileCache
+from subinterp import (InterpreterPool, execution_model, use_test_support,
+                       SUBINTERPRETERS, THREADS)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Set by configure(): resolved config, HTTP handler and request limits
+config = None
+httpserver = None
+limits = None
+# Set by start_workers(): subinterpreter pool (None when handlers run on
+# the connection threads), how handlers run, shared file cache
+workers = None
+execution = None
+cache = None
+# How often the accept loop wakes up to check for signals
+ACCEPT_POLL = 1.0
+# /_changes subscribers held by pool threads at once; set in Server()
+subscriber_slots = SubscriberSlots(0)
+
+# Runs once in every subinterpreter; names come from prepare_main(). The
+# main interpreter has already rebuilt the metadata index. A worker's own
+# change feed has no subscribers (/_changes runs on the main interpreter),
+# so its uploads and deletes reach /_changes only through inotify.
+WORKER_SETUP = """
+import sys
+import logging
+sys.path.insert(0, root)
+logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+from http import HttpServer
+from http_io import as_bytes
+from shmcache import SharedFileCache
+
+httpserver = HttpServer(docroot, storage, index, capture, rebuild_index=False)
+if cache_index is not None:
+    httpserver.cache = SharedFileCache(cache_view, cache_index)
+
+def handle(raw):
+    return as_bytes(httpserver.proses(raw))
+"""
+
+def runs_in_main(header_part):
+    """
+    Requests whose response is a long or endless stream (change feed,
+    batch results, archives) stay on the main interpreter: a worker can
+    only hand back a complete response.
+    """
+    target = header_part.split(b'\r\n', 1)[0].split(b' ')[1:2]
+    target = target[0] if target else b''
+    path, _, query = target.partition(b'?')
+    return (path.startswith((b'/_changes', b'/_batch/'))
+            or (path.endswith(b'/') and b'archive=' in query))
+
+def ProcessTheClient(conn, addr):
+    """
+    Handle a single client connection on a pool thread:
+     1. Read the request (bounded by limits)
+     2. Run HttpServer.proses() on a subinterpreter if there is a pool,
+        else right here (free-threaded build, or the GIL-bound fallback)
+     3. Send the response
+    A /_changes subscriber holds a slot until its response is sent and is
+    answered 503 when none is free.
+    """
+    slot = False
+    try:
+        reader = RequestReader(conn, limits, recv_size=config.recv_size)
+        try:
+            head = reader.read_head()
+            if head is None:
+                return
+            header_part, spill, headers = head
+            body = reader.read_body(headers, spill)
+        except RequestError as e:
+            logging.warning(f"[{addr}] Rejected request: {e}")
+            send_response(conn, httpserver.reject(e, reader.request_line, reader.started), limits)
+            return
+
+        if is_changes_request(header_part):
+            slot = subscriber_slots.acquire()
+            if not slot:
+                send_response(conn, subscriber_slots.busy(httpserver), limits)
+                return
+
+        full_request = header_part + b'\r\n\r\n' + body
+        pool = workers
+        response = None
+        if pool is not None and not runs_in_main(header_part):
+            response = pool.run(full_request)
+        if response is None:
+            response = httpserver.proses(full_request)
+        send_response(conn, response, limits)
+
+    except (socket.timeout, ConnectionResetError) as e:
+        logging.error(f"[{addr}] Connection error: {e}")
+    except Exception as e:
+        logging.error(f"[{addr}] Unexpected error: {e}")
+    finally:
+        if slot:
+            subscriber_slots.release()
+        conn.close()
+
+def configure(cfg):
+    """
+    Install a ServerConfig: HTTP handler (docroot) and request limits.
+    Workers are (re)started separately by start_workers().
+    """
+    global config, httpserver, limits
+    config = cfg
+    previous = httpserver
+    httpserver = HttpServer(cfg.docroot, cfg.storage, cfg.index, cfg.capture)
+    if previous is not None:
+        # Reload: the new handler reopened the capture log
+        previous.close()
+    httpserver.cache = cache
+    limits = cfg.request_limits()
+
+configure(ServerConfig.for_mode('interppool'))
+
+def start_workers():
+    """
+    Build the shared file cache and pick how handlers run (see
+    subinterp.execution_model). Falls back to threads if the workers
+    cannot start (e.g. an extension module refuses subinterpreters).
+    """
+    global workers, execution, cache
+    cache = None
+    if config.file_cache:
+        cache = SharedFileCache.build(httpserver.basedir, config.file_cache, skip=httpserver.hidden)
+    httpserver.cache = cache
+
+    if config.test_interpreters:
+        use_test_support()
+    execution = execution_model()
+    workers = None
+    if execution == SUBINTERPRETERS:
+        count = config.interpreters or os.cpu_count() or 1
+        view, index = cache.share() if cache else (None, None)
+        shared = {'root': ROOT, 'docroot': httpserver.basedir, 'storage': config.storage,
+                  'index': config.index, 'capture': config.capture,
+                  'cache_view': view, 'cache_index': index}
+        try:
+            workers = InterpreterPool(count, WORKER_SETUP, shared)
+        except Exception as e:
+            logging.error(f"Subinterpreters unavailable ({e}), running handlers on threads")
+            execution = THREADS
+    if execution == SUBINTERPRETERS:
+        logging.warning(f"Handlers run on {count} subinterpreters")
+    elif execution == THREADS:
+        logging.warning("No free-threaded build or subinterpreters here (on 3.13 see "
+                        "--test-interpreters): handlers run on threads and share the GIL")
+    else:
+        logging.warning("GIL disabled: handlers run on threads in parallel")
+
+def stop_workers():
+    """
+    Retire the pool; requests arriving meanwhile run on the main
+    interpreter, requests in flight finish first.
+    """
+    global workers
+    pool, workers = workers, None
+    if pool is not None:
+        pool.close()
+
+def Server():
+    """
+    Listen on config.host:config.port (default 0.0.0.0:8890). Connections
+    are read and answered on a pool of config.workers threads; handlers
+    run on config.interpreters subinterpreters (one GIL each; on 3.13 only
+    with config.test_interpreters) or, on a free-threaded build, on the
+    threads themselves. Small files are served from a snapshot in shared
+    memory (config.file_cache bytes), taken at start and on SIGHUP.
+    /_changes subscribers may hold at most config.subscribers threads,
+    never all of them.
+      SIGTERM / Ctrl-C  stop accepting, finish in-flight requests, exit
+      SIGHUP            re-read the config file, restart the workers
+      SIGUSR2           start a new generation on the same listening FD;
+                        it sends us SIGTERM once it is serving
+    """
+    srv = open_listener(config.host, config.port, config.backlog,
+                        setup=config.apply_socket_options)
+    # Wake up regularly so signals are acted on even when no one connects
+    srv.settimeout(ACCEPT_POLL)
+    start_workers()
+    logging.warning(f"Listening on {config.host}:{config.port} (InterpPool mode, {execution})")
+
+    flags = SignalFlags().install()
+    notify_previous_generation()
+
+    global subscriber_slots
+    subscriber_slots = SubscriberSlots(min(config.subscribers, config.workers - 1))
+    with ThreadPoolExecutor(max_workers=config.workers) as pool:
+        while not flags.drain:
+            try:
+                if flags.reload:
+                    flags.reload = False
+                    logging.warning("SIGHUP: reloading config")
+                    stop_workers()
+                    configure(config.reloaded())
+                    start_workers()
+                if flags.restart:
+                    flags.restart = False
+                    logging.warning("SIGUSR2: handing listener to a new generation")
+                    spawn_next_generation(srv)
+                try:
+                    conn, addr = srv.accept()
+                except socket.timeout:
+                    continue
+                logging.warning(f"Accepted connection from {addr}")
+                pool.submit(ProcessTheClient, conn, addr)
+            except Exception as e:
+                logging.error(f"Server loop error: {e}")
+
+        # Leaving the with-block waits for every accepted connection
+        logging.warning("Server shutting down: draining in-flight requests")
+        srv.close()
+    stop_workers()
+
+def run(cfg):
+    configure(cfg)
+    Server()
+
+def main():
+    logging.basicConfig(level=logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    Server()
+
+if __name__ == "__main__":
+    main()
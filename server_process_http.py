@@ -5,8 +5,10 @@ import sys
 import logging
 import multiprocessing
 from http import HttpServer
+from http_io import RequestLimits, RequestReader, RequestError, send_response
 
 httpserver = HttpServer()
+limits = RequestLimits()
 
 
 class ProcessTheClient(multiprocessing.Process):
@@ -16,32 +18,26 @@ class ProcessTheClient(multiprocessing.Process):
 		multiprocessing.Process.__init__(self)
 
 	def run(self):
-		rcv=""
-		while True:
+		try:
+			reader = RequestReader(self.connection, limits, recv_size=32)
 			try:
-				data = self.connection.recv(32)
-				if data:
-					#merubah input dari socket (berupa bytes) ke dalam string
-					#agar bisa mendeteksi \r\n
-					d = data.decode()
-					rcv=rcv+d
-					if rcv[-2:]=='\r\n':
-						#end of command, proses string
-						#logging.warning("data dari client: {}" . format(rcv))
-						hasil = httpserver.proses(rcv)
-						#hasil akan berupa bytes
-						#untuk bisa ditambahi dengan string, maka string harus di encode
-						hasil=hasil+"\r\n\r\n".encode()
-						#logging.warning("balas ke  client: {}" . format(hasil))
-						#hasil sudah dalam bentuk bytes
-						self.connection.sendall(hasil)
-						rcv=""
-						self.connection.close()
-				else:
-					break
-			except OSError as e:
-				pass
-		self.connection.close()
+				rcv = reader.read_request()
+			except RequestError as e:
+				logging.warning("request ditolak: {}" . format(e))
+				send_response(self.connection, httpserver.reject(e, reader.request_line, reader.started), limits)
+				return
+			if rcv is None:
+				return
+			#end of command, proses request
+			logging.warning("data dari client: {}" . format(rcv))
+			hasil = httpserver.proses(rcv)
+			#hasil berupa bytes atau StreamingResponse
+			logging.warning("balas ke  client: {}" . format(hasil))
+			send_response(self.connection, hasil, limits)
+		except (OSError, ValueError) as e:
+			logging.warning("connection error: {}" . format(e))
+		finally:
+			self.connection.close()
 
 
 
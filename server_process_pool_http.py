@@ -1,102 +1,372 @@
 import os
+import json
+import time
+import struct
+import signal
 import socket
 import logging
 import multiprocessing as mp
-from concurrent.futures import ProcessPoolExecutor
 from http import HttpServer
+from http_io import RequestReader, RequestError, parse_headers, send_response
+from lifecycle import (open_listener, spawn_next_generation,
+                       notify_previous_generation, SignalFlags)
+from progjar.config import ServerConfig
+from scheduling import (SMALL, LARGE, CHANGES, LaneStats, SubscriberSlots, classify,
+                        is_stats_request, is_changes_request)
 
 # Force 'fork' start method so worker processes inherit the listener FD
 mp.set_start_method('fork', force=True)
 
-httpserver = HttpServer()
+# Set by configure(): resolved config, HTTP handler and request limits
+config = None
+httpserver = None
+limits = None
 
-def worker_loop(listener_fd):
+# How often idle workers wake up from accept() to check for a drain request
+ACCEPT_POLL = 1.0
+# Lane handoff message: accept time (monotonic), then the raw request head
+HANDOFF = struct.Struct('!d')
+HANDOFF_MAX = 256 * 1024
+# Per-lane latency; replaced by a shared-memory one in run()
+lane_stats = LaneStats()
+# /_changes slots shared by all workers; set in run()
+subscriber_slots = SubscriberSlots(0)
+
+
+def configure(cfg):
+    """
+    Install a ServerConfig. Called by the supervisor at startup and on
+    SIGHUP before it forks a fresh set of workers, which inherit the new
+    objects; old workers keep serving with the old ones until drained.
+    """
+    global config, httpserver, limits
+    config = cfg
+    previous = httpserver
+    httpserver = HttpServer(cfg.docroot, cfg.storage, cfg.index, cfg.capture)
+    if previous is not None:
+        # Reload: the new handler reopened the capture log
+        previous.close()
+    limits = cfg.request_limits()
+
+configure(ServerConfig.for_mode('processpool'))
+
+def respond(conn, addr, reader, head, lane, accepted):
+    """
+    Read the body of a request whose head is already parsed, process it,
+    send the response and record its latency in the lane's histogram.
+    """
+    header_part, spill, headers = head
+    if is_stats_request(header_part):
+        response = lane_stats.response(httpserver)
+    else:
+        try:
+            body = reader.read_body(headers, spill)
+        except RequestError as e:
+            logging.warning(f"Rejected request from {addr}: {e}")
+            send_response(conn, httpserver.reject(e, reader.request_line, reader.started), limits)
+            return
+        full_request = header_part + b'\r\n\r\n' + body
+        logging.warning(f"Processing {len(full_request)} bytes from {addr} ({lane} lane)")
+        response = httpserver.proses(full_request)
+    send_response(conn, response, limits)
+    lane_stats.record(lane, time.monotonic() - accepted)
+
+
+def hand_off(lane_sock, conn, head, accepted):
+    """
+    Pass an accepted connection and its already-read head to the large
+    lane over the SOCK_SEQPACKET pair. Returns False if the lane is
+    backed up (or the head is too big for one message); the caller then
+    serves the request itself instead of blocking.
     """
-    Worker process:
+    header_part, spill, _ = head
+    message = HANDOFF.pack(accepted) + header_part + b'\r\n\r\n' + spill
+    try:
+        socket.send_fds(lane_sock, [message], [conn.fileno()], socket.MSG_DONTWAIT)
+    except OSError:
+        return False
+    return True
+
+
+def ignore_signals():
+    """
+    Signals are handled by the supervisor, which sets the stop event.
+    A direct SIGTERM (e.g. the whole process group) also means drain;
+    only flip a local flag here, Event.set() takes a lock.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+    terminated = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: terminated.append(signum))
+    return terminated
+
+
+def worker_loop(listener_fd, lane_fd, stop_event):
+    """
+    Small-lane worker process:
      1. Reconstruct the listening socket from listener_fd
-     2. Loop: accept connections, read request, process, send response
+     2. Loop: accept connections, read the request head
+     3. Hand large requests to the large lane through lane_fd, serve the rest
+        (a /_changes subscriber only while a shared slot is free, else 503)
+     4. Once stop_event is set, finish the in-flight request and return
+    Every connection is bounded by `limits`, so a slow or oversized
+    client can hold a worker for at most limits.total_timeout seconds.
     """
     proc_name = mp.current_process().name
     # Recreate the listening socket in this worker
     srv = socket.socket(fileno=listener_fd,
                         family=socket.AF_INET,
                         type=socket.SOCK_STREAM)
+    srv.settimeout(ACCEPT_POLL)
+    lane_sock = socket.socket(fileno=lane_fd)
+    terminated = ignore_signals()
 
-    while True:
+    while not stop_event.is_set() and not terminated:
+        conn = None
         try:
-            conn, addr = srv.accept()
+            try:
+                conn, addr = srv.accept()
+            except socket.timeout:
+                continue
+            accepted = time.monotonic()
             logging.warning(f"[{proc_name}] Accepted connection from {addr}")
 
-            # Read request headers
-            buffer = b''
-            while b'\r\n\r\n' not in buffer:
-                chunk = conn.recv(4096)
-                if not chunk:
-                    break
-                buffer += chunk
-            if not buffer:
+            # Read headers under deadlines and size caps
+            reader = RequestReader(conn, limits, recv_size=config.recv_size)
+            try:
+                head = reader.read_head()
+            except RequestError as e:
+                logging.warning(f"[{proc_name}] Rejected request from {addr}: {e}")
+                send_response(conn, httpserver.reject(e, reader.request_line, reader.started), limits)
+                conn.close()
+                continue
+            if head is None:
                 conn.close()
                 continue
 
-            # Split header/body and parse Content-Length
-            header_part, _, spill = buffer.partition(b'\r\n\r\n')
-            headers = {}
-            for line in header_part.split(b'\r\n')[1:]:
-                if b': ' in line:
-                    key, val = line.split(b': ', 1)
-                    headers[key.lower()] = val
-            length = int(headers.get(b'content-length', b'0'))
-
-            # Read remaining body
-            body = spill
-            remaining = length - len(body)
-            while remaining > 0:
-                chunk = conn.recv(remaining)
-                if not chunk:
-                    break
-                body += chunk
-                remaining -= len(chunk)
+            if is_changes_request(head[0]):
+                if not subscriber_slots.acquire():
+                    send_response(conn, subscriber_slots.busy(httpserver), limits)
+                    conn.close()
+                    continue
+                try:
+                    respond(conn, addr, reader, head, CHANGES, accepted)
+                finally:
+                    subscriber_slots.release()
+                conn.close()
+                continue
 
-            # Process the complete request
-            full_request = header_part + b'\r\n\r\n' + body
-            logging.warning(f"[{proc_name}] Processing {len(full_request)} bytes")
-            response = httpserver.proses(full_request)
+            lane = SMALL
+            if config.large_workers > 0:
+                lane = classify(httpserver, head[0], head[2], config.large_threshold)
+            if lane == LARGE and hand_off(lane_sock, conn, head, accepted):
+                # The large worker now holds its own copy of the connection
+                conn.close()
+                continue
 
-            # Send response and close
-            conn.sendall(response)
+            respond(conn, addr, reader, head, lane, accepted)
             conn.close()
 
         except Exception as e:
             logging.error(f"[{proc_name}] Error: {e}")
+            if conn is not None:
+                conn.close()
+    logging.warning(f"[{proc_name}] Drained, exiting")
 
-def main():
-    logging.basicConfig(level=logging.WARNING,
-                        format="%(asctime)s %(levelname)s %(message)s")
 
-    host, port = '0.0.0.0', 8889
-    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    srv.bind((host, port))
-    srv.listen(50)
-    logging.warning("Listening on 0.0.0.0:8889 (ProcessPool mode)")
+def large_worker_loop(lane_fd, stop_event):
+    """
+    Large-lane worker process: receive connections handed off by the
+    small-lane workers (fd + request head) and serve them. stop_event is
+    set only once the small lane of the same generation has exited; the
+    worker then keeps going until the lane has been idle for ACCEPT_POLL
+    seconds, so handed-off requests are not dropped.
+    """
+    proc_name = mp.current_process().name
+    lane_sock = socket.socket(fileno=lane_fd)
+    lane_sock.settimeout(ACCEPT_POLL)
+    terminated = ignore_signals()
+
+    while True:
+        conn = None
+        try:
+            try:
+                message, fds, _, _ = socket.recv_fds(lane_sock, HANDOFF_MAX, 1)
+            except socket.timeout:
+                if stop_event.is_set() or terminated:
+                    break
+                continue
+            if not fds:
+                continue
+            conn = socket.socket(fileno=fds[0])
+            addr = conn.getpeername()
+            (accepted,) = HANDOFF.unpack_from(message)
+            header_part, _, spill = message[HANDOFF.size:].partition(b'\r\n\r\n')
+            head = (header_part, spill, parse_headers(header_part, limits))
+
+            reader = RequestReader(conn, limits, recv_size=config.recv_size)
+            respond(conn, addr, reader, head, LARGE, accepted)
+            conn.close()
+
+        except Exception as e:
+            logging.error(f"[{proc_name}] Error: {e}")
+            if conn is not None:
+                conn.close()
+    logging.warning(f"[{proc_name}] Drained, exiting")
+
+
+def start_workers(target, args, count):
+    """
+    Fork `count` worker processes running target(*args, stop_event),
+    each with its own stop event.
+    """
+    workers = []
+    for _ in range(count):
+        stop_event = mp.Event()
+        proc = mp.Process(target=target, args=args + (stop_event,), daemon=True)
+        proc.start()
+        workers.append((proc, stop_event))
+    return workers
+
+
+class Generation:
+    """
+    One set of worker processes of both lanes, plus the lane socketpair
+    that connects them. Every generation gets its own pair, so large-lane
+    workers that are being drained never receive handoffs from newer
+    small-lane workers.
+    """
+    def __init__(self, listener_fd):
+        # Small -> large lane handoff channel; one message per connection
+        self.lane_rx, self.lane_tx = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        # Every pool: (target, args, workers); small lane first, it may
+        # hand requests to the large lane until it has exited
+        self.groups = [(target, args, start_workers(target, args, count)) for target, args, count in (
+            (worker_loop, (listener_fd, self.lane_tx.fileno()), config.workers),
+            (large_worker_loop, (self.lane_rx.fileno(),), config.large_workers))]
+        # Workers keep the limits they were forked with
+        self.drain_timeout = limits.total_timeout + limits.send_timeout
+        self.pending = None
+        self.deadline = None
+
+    def respawn(self):
+        """
+        Replace workers that died unexpectedly.
+        """
+        for target, args, workers in self.groups:
+            for i, (proc, stop_event) in enumerate(workers):
+                if not proc.is_alive() and not stop_event.is_set():
+                    logging.error(f"Worker {proc.name} exited (code {proc.exitcode}), respawning")
+                    workers[i] = start_workers(target, args, 1)[0]
+
+    def drain(self):
+        """
+        Start draining without waiting: the small lane is asked to stop
+        now, the large lane once the small one is gone (see step()).
+        """
+        self.pending = list(self.groups)
+        self.stop_next()
+
+    def stop_next(self):
+        _, _, workers = self.pending[0]
+        for _, stop_event in workers:
+            stop_event.set()
+        self.deadline = time.monotonic() + self.drain_timeout
+
+    def step(self):
+        """
+        Advance a drain; kill what is still running past the deadline.
+        Returns True once every worker has exited.
+        """
+        while self.pending:
+            _, _, workers = self.pending[0]
+            alive = [proc for proc, _ in workers if proc.is_alive()]
+            if alive and time.monotonic() < self.deadline:
+                return False
+            for proc in alive:
+                logging.warning(f"Worker {proc.name} did not drain in time, terminating")
+                proc.kill()
+                proc.join()
+            self.pending.pop(0)
+            if self.pending:
+                self.stop_next()
+        self.lane_rx.close()
+        self.lane_tx.close()
+        return True
+
+
+def run(cfg):
+    """
+    Supervisor: owns the listener and the worker processes.
+      SIGTERM / Ctrl-C  stop accepting, finish in-flight requests, exit
+      SIGHUP            re-read the config file, roll workers to a new
+                        generation; the old one drains in the background
+      SIGUSR2           start a new generation of this program on the same
+                        listening FD; it sends us SIGTERM once it is serving
+    config.workers small-lane processes accept connections; requests of
+    config.large_threshold bytes or more are passed, fd and all, to
+    config.large_workers large-lane processes (0 disables the lanes).
+    At most config.subscribers (and never every) small-lane workers are
+    held by /_changes subscribers at once.
+    """
+    global lane_stats, subscriber_slots
+    configure(cfg)
+    srv = open_listener(config.host, config.port, config.backlog,
+                        setup=config.apply_socket_options)
+    logging.warning(f"Listening on {config.host}:{config.port} (ProcessPool mode)")
 
     # Mark listener FD as inheritable by fork
     listener_fd = srv.fileno()
     os.set_inheritable(listener_fd, True)
+    lane_stats = LaneStats(shared=True)
+    # Sized once: workers forked after a reload share the same slots
+    subscriber_slots = SubscriberSlots(min(config.subscribers, config.workers - 1), shared=True)
 
-    WORKERS = 20
-    # Pre-fork WORKERS long-running worker_loop tasks
-    with ProcessPoolExecutor(max_workers=WORKERS) as pool:
-        for _ in range(WORKERS):
-            pool.submit(worker_loop, listener_fd)
+    flags = SignalFlags().install()
+    # Pre-fork the long-running worker processes of both lanes
+    current = Generation(listener_fd)
+    notify_previous_generation()
+    # Generations replaced by SIGHUP whose workers have not all exited;
+    # checked every tick so the loop keeps respawning and handling signals
+    draining = []
 
-        try:
-            # Keep workers running until shutdown
-            pool.shutdown(wait=True)
-        except KeyboardInterrupt:
-            logging.warning("Server shutting down")
-        finally:
-            srv.close()
+    try:
+        while not flags.drain:
+            time.sleep(0.5)
+            if flags.reload:
+                flags.reload = False
+                logging.warning("SIGHUP: reloading config and rolling workers")
+                try:
+                    configure(config.reloaded())
+                except (OSError, ValueError) as e:
+                    logging.error(f"Config reload failed, keeping current config: {e}")
+                    continue
+                old, current = current, Generation(listener_fd)
+                old.drain()
+                draining.append(old)
+            if flags.restart:
+                flags.restart = False
+                logging.warning("SIGUSR2: handing listener to a new generation")
+                spawn_next_generation(srv)
+            if not flags.drain:
+                current.respawn()
+            draining = [gen for gen in draining if not gen.step()]
+    finally:
+        logging.warning("Server shutting down: draining workers")
+        current.drain()
+        draining.append(current)
+        while draining:
+            draining = [gen for gen in draining if not gen.step()]
+            if draining:
+                time.sleep(0.1)
+        srv.close()
+        logging.warning(f"Lane latency: {json.dumps(lane_stats.snapshot())}")
+
+def main():
+    logging.basicConfig(level=logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    run(config)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -6,86 +6,175 @@ import time
 import sys
 import logging
 import ssl
+from concurrent.futures import ThreadPoolExecutor
 
 
 
 
 from http import HttpServer
-
-httpserver = HttpServer()
+from http_io import RequestReader, RequestError, send_response
+from lifecycle import SignalFlags
+from http2 import H2Session, alpn_protocols
+from progjar.config import ServerConfig
+from scheduling import SubscriberSlots, is_changes_request
+
+config = None
+httpserver = None
+limits = None
+
+def configure(cfg):
+	global config, httpserver, limits
+	config = cfg
+	previous = httpserver
+	httpserver = HttpServer(cfg.docroot, cfg.storage, cfg.index, cfg.capture)
+	if previous is not None:
+		#reload: capture log sudah dibuka ulang oleh handler baru
+		previous.close()
+	limits = cfg.request_limits()
+
+configure(ServerConfig.for_mode('tls'))
+#di-set saat drain, agar koneksi HTTP/2 yang idle ditutup (GOAWAY)
+stopping = threading.Event()
+ACCEPT_POLL = 1.0
 
 
 class ProcessTheClient(threading.Thread):
-	def __init__(self, connection, address):
+	def __init__(self, connection, address, h2_pool, subscribers):
 		self.connection = connection
 		self.address = address
+		self.h2_pool = h2_pool
+		self.subscribers = subscribers
 		threading.Thread.__init__(self)
 
 	def run(self):
-		rcv=""
-		while True:
+		try:
+			# TLS handshake runs here, not in the accept loop, and is bounded
+			# by the header deadline so a stalled handshake cannot block accept()
+			self.connection.settimeout(limits.header_timeout)
+			self.connection.do_handshake()
+			if self.connection.selected_alpn_protocol() == 'h2':
+				#HTTP/2: banyak request berbagi satu koneksi TLS ini
+				H2Session(self.connection, httpserver, limits, self.h2_pool,
+						  stopping=stopping, subscribers=self.subscribers).serve()
+				return
+			reader = RequestReader(self.connection, limits, recv_size=config.recv_size)
 			try:
-				data = self.connection.recv(32)
-				if data:
-					#merubah input dari socket (berupa bytes) ke dalam string
-					#agar bisa mendeteksi \r\n
-					d = data.decode()
-					rcv=rcv+d
-					if rcv[-2:]=='\r\n':
-						#end of command, proses string
-						logging.warning("data dari client: {}" . format(rcv))
-						hasil = httpserver.proses(rcv)
-						#hasil akan berupa bytes
-						#untuk bisa ditambahi dengan string, maka string harus di encode
-						hasil=hasil+"\r\n\r\n".encode()
-						logging.warning("balas ke  client: {}" . format(hasil))
-						#hasil sudah dalam bentuk bytes
-						self.connection.sendall(hasil)
-						rcv=""
-						self.connection.close()
-				else:
-					break
-			except OSError as e:
-				pass
-		self.connection.close()
+				rcv = reader.read_request()
+			except RequestError as e:
+				logging.warning("request ditolak: {}" . format(e))
+				send_response(self.connection, httpserver.reject(e, reader.request_line, reader.started), limits)
+				return
+			if rcv is None:
+				return
+			#pelanggan /_changes memakai slot sampai responnya selesai, 503 bila penuh
+			if is_changes_request(rcv):
+				if not self.subscribers.acquire():
+					send_response(self.connection, self.subscribers.busy(httpserver), limits)
+					return
+				try:
+					send_response(self.connection, httpserver.proses(rcv), limits)
+				finally:
+					self.subscribers.release()
+				return
+			#end of command, proses request
+			logging.warning("data dari client: {}" . format(rcv))
+			hasil = httpserver.proses(rcv)
+			#hasil berupa bytes atau StreamingResponse
+			logging.warning("balas ke  client: {}" . format(hasil))
+			send_response(self.connection, hasil, limits)
+		except (OSError, ValueError) as e:
+			logging.warning("connection error: {}" . format(e))
+		finally:
+			self.connection.close()
 
 
 
 class Server(threading.Thread):
 	def __init__(self,hostname='testing.net'):
 		self.the_clients = []
+		self.running = True
 #------------------------------
 		self.hostname = hostname
-		cert_location = os.getcwd() + '/certs/'
-		self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-		self.context.load_cert_chain(certfile=cert_location + 'domain.crt',
-									 keyfile=cert_location + 'domain.key')
+		self.context = self.load_context()
+		#satu pool handler stream HTTP/2 untuk semua koneksi
+		self.h2_pool = ThreadPoolExecutor(max_workers=config.workers, thread_name_prefix='h2-stream')
+		#pelanggan /_changes (HTTP/1.1 dan h2) tidak boleh memakai semua thread pool
+		self.subscribers = SubscriberSlots(min(config.subscribers, config.workers - 1))
 #---------------------------------
 		self.my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		self.my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		config.apply_socket_options(self.my_socket)
 		threading.Thread.__init__(self)
 
+	def load_context(self):
+		certfile, keyfile = config.cert_paths()
+		context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+		context.load_cert_chain(certfile=certfile, keyfile=keyfile)
+		#ALPN: tawarkan h2 jika paket h2 terpasang, selain itu http/1.1
+		context.set_alpn_protocols(alpn_protocols(config.http2))
+		return context
+
+	def reload_certs(self):
+		#config dan sertifikat baru dipakai untuk koneksi berikutnya,
+		#koneksi yang sedang berjalan tetap memakai context lama
+		try:
+			configure(config.reloaded())
+			self.context = self.load_context()
+			logging.warning("config and certificates reloaded")
+		except (OSError, ValueError, ssl.SSLError) as e:
+			logging.warning("certificate reload failed, keeping old ones: {}".format(e))
+
+	def stop(self):
+		self.running = False
+		stopping.set()
+
 	def run(self):
-		self.my_socket.bind(('0.0.0.0', 8443))
-		self.my_socket.listen(1)
-		while True:
-			self.connection, self.client_address = self.my_socket.accept()
+		self.my_socket.bind((config.host, config.port))
+		self.my_socket.listen(config.backlog)
+		#timeout agar loop bisa melihat permintaan stop
+		self.my_socket.settimeout(ACCEPT_POLL)
+		while self.running:
+			try:
+				self.connection, self.client_address = self.my_socket.accept()
+			except socket.timeout:
+				continue
 			try:
-				self.secure_connection = self.context.wrap_socket(self.connection, server_side=True)
+				self.secure_connection = self.context.wrap_socket(self.connection, server_side=True,
+															 do_handshake_on_connect=False)
 				logging.warning("connection from {}".format(self.client_address))
-				clt = ProcessTheClient(self.secure_connection, self.client_address)
+				clt = ProcessTheClient(self.secure_connection, self.client_address, self.h2_pool,
+											   self.subscribers)
 				clt.start()
+				self.the_clients = [c for c in self.the_clients if c.is_alive()]
 				self.the_clients.append(clt)
 			except ssl.SSLError as essl:
 				print(str(essl))
+		#drain: tunggu request yang sedang berjalan selesai
+		self.my_socket.close()
+		for clt in self.the_clients:
+			clt.join()
+		self.h2_pool.shutdown()
 
 
 
 
+def run(cfg):
+	configure(cfg)
+	main()
+
 def main():
+	#SIGTERM/Ctrl-C: drain lalu keluar, SIGHUP: reload sertifikat TLS
+	flags = SignalFlags().install()
 	svr = Server()
 	svr.start()
+	while not flags.drain:
+		time.sleep(0.5)
+		if flags.reload:
+			flags.reload = False
+			svr.reload_certs()
+	logging.warning("shutting down, draining connections")
+	svr.stop()
+	svr.join()
 
 if __name__=="__main__":
 	main()
-
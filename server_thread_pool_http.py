@@ -1,62 +1,105 @@
-from socket import AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+import json
+import time
 import socket
 import logging
 from concurrent.futures import ThreadPoolExecutor
 from http import HttpServer
+from http_io import RequestReader, RequestError, send_response
+from lifecycle import (open_listener, spawn_next_generation,
+                       notify_previous_generation, SignalFlags)
+from progjar.config import ServerConfig
+from scheduling import (SMALL, LARGE, CHANGES, LaneStats, SubscriberSlots, classify,
+                        is_stats_request, is_changes_request)
 
-# Initialize HTTP server logic
-httpserver = HttpServer()
+# Set by configure(): resolved config, HTTP handler and request limits
+config = None
+httpserver = None
+limits = None
+# How often the accept loop wakes up to check for signals
+ACCEPT_POLL = 1.0
+# Large-lane pool (None when lanes are disabled) and per-lane latencies
+large_pool = None
+lane_stats = LaneStats()
+# Changes lane: /_changes subscribers run on their own capped pool
+changes_pool = None
+subscriber_slots = SubscriberSlots(0)
 
-def get_headers(data_bytes):
+def ProcessTheClient(conn, addr, accepted):
     """
-    Parse HTTP headers from raw request bytes up to "\r\n\r\n".
-    Returns a dict mapping lowercase header names to values.
-    """
-    if b'\r\n' not in data_bytes:
-        return {}
-    header_str = data_bytes.split(b'\r\n\r\n', 1)[0].decode('utf-8', errors='ignore')
-    lines = header_str.split('\r\n')[1:]  # Skip the request line
-    headers = {}
-    for line in lines:
-        if ': ' in line:
-            key, val = line.split(': ', 1)
-            headers[key.lower()] = val
-    return headers
-
-def ProcessTheClient(conn, addr):
-    """
-    Handle a single client connection:
-     1. Read request headers until "\r\n\r\n"
-     2. Parse Content-Length and read the body
-     3. Process the full request via HttpServer.proses()
-     4. Send the response and close the connection
+    Handle a single client connection (small lane thread):
+     1. Read request headers until "\r\n\r\n" (bounded by limits)
+     2. Classify by size; large requests are handed to the large lane,
+        /_changes subscribers to the changes lane (503 when it is full)
+     3. Read the body, process via HttpServer.proses() and respond
+    Requests that break the limits are answered with 408/413/431.
     """
+    handed_off = False
     try:
-        # 1) Read headers
-        buffer = b''
-        while b'\r\n\r\n' not in buffer:
-            chunk = conn.recv(1024)
-            if not chunk:
-                conn.close()
-                return
-            buffer += chunk
+        reader = RequestReader(conn, limits, recv_size=config.recv_size)
+        try:
+            head = reader.read_head()
+        except RequestError as e:
+            logging.warning(f"[{addr}] Rejected request: {e}")
+            send_response(conn, httpserver.reject(e, reader.request_line, reader.started), limits)
+            return
+        if head is None:
+            return
 
-        header_part, _, spill = buffer.partition(b'\r\n\r\n')
+        header_part, spill, headers = head
+        if is_changes_request(header_part):
+            if not subscriber_slots.acquire():
+                send_response(conn, subscriber_slots.busy(httpserver), limits)
+                return
+            changes_pool.submit(FinishSubscriber, conn, addr, reader, head, accepted)
+            handed_off = True
+            return
+        lane = SMALL
+        if large_pool is not None:
+            lane = classify(httpserver, header_part, headers, config.large_threshold)
+        if lane == LARGE:
+            large_pool.submit(FinishRequest, conn, addr, reader, head, lane, accepted)
+            handed_off = True
+            return
+        FinishRequest(conn, addr, reader, head, lane, accepted)
+        handed_off = True
+    except Exception as e:
+        logging.error(f"[{addr}] Unexpected error: {e}")
+    finally:
+        if not handed_off:
+            conn.close()
 
-        # 2) Read body if Content-Length is set
-        headers = get_headers(header_part)
-        length = int(headers.get('content-length', 0))
-        body = spill
-        if len(body) < length:
-            body += conn.recv(length - len(body), socket.MSG_WAITALL)
+def FinishSubscriber(conn, addr, reader, head, accepted):
+    """
+    Changes lane: serve a /_changes long-poll or SSE stream, then give
+    its slot back.
+    """
+    try:
+        FinishRequest(conn, addr, reader, head, CHANGES, accepted)
+    finally:
+        subscriber_slots.release()
 
-        # 3) Process request
-        full_request = header_part + b'\r\n\r\n' + body
-        logging.warning(f"[{addr}] Processing {len(full_request)} bytes")
-        response = httpserver.proses(full_request)
+def FinishRequest(conn, addr, reader, head, lane, accepted):
+    """
+    Read the body, process the request, send the response, close the
+    connection and record the latency for the lane it ran in.
+    """
+    header_part, spill, headers = head
+    try:
+        if is_stats_request(header_part):
+            response = lane_stats.response(httpserver)
+        else:
+            try:
+                body = reader.read_body(headers, spill)
+            except RequestError as e:
+                logging.warning(f"[{addr}] Rejected request: {e}")
+                send_response(conn, httpserver.reject(e, reader.request_line, reader.started), limits)
+                return
+            full_request = header_part + b'\r\n\r\n' + body
+            logging.warning(f"[{addr}] Processing {len(full_request)} bytes ({lane} lane)")
+            response = httpserver.proses(full_request)
 
-        # 4) Send response
-        conn.sendall(response)
+        send_response(conn, response, limits)
+        lane_stats.record(lane, time.monotonic() - accepted)
 
     except (socket.timeout, ConnectionResetError) as e:
         logging.error(f"[{addr}] Connection error: {e}")
@@ -66,29 +109,89 @@ def ProcessTheClient(conn, addr):
         logging.warning(f"[{addr}] Closing connection")
         conn.close()
 
+def configure(cfg):
+    """
+    Install a ServerConfig: HTTP handler (docroot) and request limits.
+    Requests already running keep the objects they started with.
+    """
+    global config, httpserver, limits
+    config = cfg
+    previous = httpserver
+    httpserver = HttpServer(cfg.docroot, cfg.storage, cfg.index, cfg.capture)
+    if previous is not None:
+        # Reload: the new handler reopened the capture log
+        previous.close()
+    limits = cfg.request_limits()
+
+configure(ServerConfig.for_mode('threadpool'))
+
 def Server():
     """
-    Listen on 0.0.0.0:8885 and dispatch each connection
-    to a thread from a fixed-size pool.
+    Listen on config.host:config.port (default 0.0.0.0:8885) and dispatch
+    each connection to a thread from a fixed-size pool (the small lane).
+    Requests classified as large after header parsing move to a separate
+    pool of config.large_workers threads, so they cannot starve small ones.
+    /_changes subscribers get config.subscribers threads of their own.
+    GET /_stats/lanes reports per-lane latency.
+      SIGTERM / Ctrl-C  stop accepting, finish in-flight requests, exit
+      SIGHUP            re-read the config file (limits, docroot)
+      SIGUSR2           start a new generation on the same listening FD;
+                        it sends us SIGTERM once it is serving
     """
-    srv = socket.socket(AF_INET, SOCK_STREAM)
-    srv.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-    srv.bind(('0.0.0.0', 8885))
-    srv.listen(50)
-    logging.warning("Listening on 0.0.0.0:8885 (ThreadPool mode)")
-
-    with ThreadPoolExecutor(max_workers=20) as pool:
-        while True:
+    srv = open_listener(config.host, config.port, config.backlog,
+                        setup=config.apply_socket_options)
+    # Wake up regularly so signals are acted on even when no one connects
+    srv.settimeout(ACCEPT_POLL)
+    logging.warning(f"Listening on {config.host}:{config.port} (ThreadPool mode)")
+
+    flags = SignalFlags().install()
+    notify_previous_generation()
+
+    # Size lanes: the pool below reads headers and serves small requests,
+    # large ones move to their own pool so they cannot occupy every thread
+    global large_pool, changes_pool, subscriber_slots
+    large_pool = None
+    if config.large_workers > 0:
+        large_pool = ThreadPoolExecutor(max_workers=config.large_workers,
+                                        thread_name_prefix='large')
+    # Subscribers wait for events for minutes; a slot per thread means
+    # they never queue behind each other or take a small-lane thread
+    subscriber_slots = SubscriberSlots(config.subscribers)
+    changes_pool = ThreadPoolExecutor(max_workers=max(1, config.subscribers),
+                                      thread_name_prefix='changes')
+
+    with ThreadPoolExecutor(max_workers=config.workers, thread_name_prefix='small') as pool:
+        while not flags.drain:
             try:
-                conn, addr = srv.accept()
+                if flags.reload:
+                    flags.reload = False
+                    logging.warning("SIGHUP: reloading config")
+                    configure(config.reloaded())
+                if flags.restart:
+                    flags.restart = False
+                    logging.warning("SIGUSR2: handing listener to a new generation")
+                    spawn_next_generation(srv)
+                try:
+                    conn, addr = srv.accept()
+                except socket.timeout:
+                    continue
                 logging.warning(f"Accepted connection from {addr}")
-                pool.submit(ProcessTheClient, conn, addr)
-            except KeyboardInterrupt:
-                logging.warning("Server shutting down")
-                break
+                pool.submit(ProcessTheClient, conn, addr, time.monotonic())
             except Exception as e:
                 logging.error(f"Server loop error: {e}")
 
+        # Leaving the with-block waits for every accepted connection
+        logging.warning("Server shutting down: draining in-flight requests")
+        srv.close()
+    if large_pool is not None:
+        large_pool.shutdown(wait=True)
+    changes_pool.shutdown(wait=True)
+    logging.warning(f"Lane latency: {json.dumps(lane_stats.snapshot())}")
+
+def run(cfg):
+    configure(cfg)
+    Server()
+
 def main():
     logging.basicConfig(level=logging.WARNING,
                         format="%(asctime)s %(levelname)s %(message)s")
@@ -0,0 +1,76 @@
+import bisect
+import hashlib
+
+# Points per node on the ring; more points spread keys more evenly
+VNODES = 64
+# Copies kept of every file
+REPLICAS = 2
+
+
+def ring_hash(text):
+    """
+    Position on the ring: stable across processes and restarts, unlike
+    the built-in hash().
+    """
+    return int.from_bytes(hashlib.md5(text.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent-hash ring of backend nodes ("host:port"), each placed at
+    `vnodes` points. A key belongs to the first `n` distinct nodes met
+    walking clockwise from its hash, so adding a node only moves the keys
+    that now fall to it (about 1/N of them).
+
+    Rings are never modified: with_node() returns a new one, which the
+    proxy swaps in with a single assignment.
+    """
+    def __init__(self, nodes=(), vnodes=VNODES):
+        self.nodes = tuple(dict.fromkeys(nodes))
+        self.vnodes = vnodes
+        points = sorted((ring_hash(f"{node}#{i}"), node)
+                        for node in self.nodes for i in range(vnodes))
+        self.hashes = [h for h, _ in points]
+        self.points = [node for _, node in points]
+
+    def with_node(self, node):
+        return HashRing(self.nodes + (node,), self.vnodes)
+
+    def owners(self, key, n):
+        """
+        The n distinct nodes holding `key` (fewer if the ring is smaller),
+        primary first.
+        """
+        n = min(n, len(self.nodes))
+        found = []
+        start = bisect.bisect(self.hashes, ring_hash(key))
+        for i in range(len(self.points)):
+            node = self.points[(start + i) % len(self.points)]
+            if node not in found:
+                found.append(node)
+                if len(found) == n:
+                    break
+        return found
+
+    def share(self):
+        """
+        Fraction of the hash space each node is primary for.
+        """
+        if len(self.nodes) < 2:
+            return dict.fromkeys(self.nodes, 1.0)
+        share = dict.fromkeys(self.nodes, 0)
+        for i, node in enumerate(self.points):
+            share[node] += (self.hashes[i] - self.hashes[i - 1]) % 2 ** 64
+        return {node: arc / 2 ** 64 for node, arc in share.items()}
+
+
+def placement(ring, key, holders, replicas):
+    """
+    What a rebalance does for a key found on `holders`:
+    (owners, copy_to, drop_from). Copies are made before anything is
+    dropped, so the key is readable somewhere at every step.
+    """
+    owners = ring.owners(key, replicas)
+    copy_to = [node for node in owners if node not in holders]
+    drop_from = [node for node in holders if node not in owners]
+    return owners, copy_to, drop_from
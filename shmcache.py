@@ -0,0 +1,89 @@
+import os
+import json
+import mmap
+import stat
+import logging
+import tempfile
+
+# Files larger than this are never cached
+CACHE_FILE_MAX = 256 * 1024
+# tmpfs, so the snapshot lives in memory rather than on disk
+SHM_DIR = '/dev/shm'
+
+
+class SharedFileCache:
+    """
+    Read-only snapshot of the small files under a docroot, packed into one
+    shared memory mapping that is never copied per worker: threads use
+    the mapping directly, subinterpreters get a memoryview onto it
+    (share() here, SharedFileCache(view, index) there).
+
+    An entry is served only while the file on disk still has the inode,
+    size and mtime it had when the snapshot was taken: uploads, deletes
+    and outside edits turn it into a miss until the next build.
+    """
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        if isinstance(index, str):
+            self.index_json, self.index = index, json.loads(index)
+        else:
+            self.index_json, self.index = json.dumps(index), index
+
+    @classmethod
+    def build(cls, basedir, budget, skip=None, file_max=CACHE_FILE_MAX):
+        """
+        Snapshot files of at most file_max bytes, in path order, until
+        `budget` bytes are used.
+        """
+        with tempfile.TemporaryFile(dir=SHM_DIR if os.path.isdir(SHM_DIR) else None) as f:
+            index, used = {}, 0
+            for dirpath, dirnames, filenames in os.walk(basedir):
+                dirnames[:] = sorted(d for d in dirnames
+                                     if not (skip and skip(os.path.join(dirpath, d))))
+                for name in sorted(filenames):
+                    path = os.path.join(dirpath, name)
+                    if skip and skip(path):
+                        continue
+                    try:
+                        st = os.stat(path)
+                        if (not stat.S_ISREG(st.st_mode) or st.st_size > file_max
+                                or used + st.st_size > budget):
+                            continue
+                        with open(path, 'rb') as src:
+                            data = src.read(st.st_size + 1)
+                    except OSError:
+                        continue
+                    # Changed while we read it: leave it out
+                    if len(data) != st.st_size:
+                        continue
+                    f.write(data)
+                    index[path] = (used, st.st_size, st.st_ino, st.st_mtime_ns)
+                    used += st.st_size
+            f.flush()
+            # The mapping keeps the (already unlinked) file alive
+            buffer = mmap.mmap(f.fileno(), used, prot=mmap.PROT_READ) if used else b''
+        logging.warning(f"File cache: {len(index)} files, {used / 2 ** 20:.1f} MiB in shared memory")
+        return cls(buffer, index)
+
+    def share(self):
+        """
+        (view, index) to rebuild this cache in another interpreter; both
+        can be passed to Interpreter.prepare_main().
+        """
+        return memoryview(self.buffer), self.index_json
+
+    def get(self, fs_path):
+        """
+        Content of fs_path if it is cached and unchanged, else None.
+        """
+        entry = self.index.get(fs_path)
+        if entry is None:
+            return None
+        offset, size, ino, mtime_ns = entry
+        try:
+            st = os.stat(fs_path)
+        except OSError:
+            return None
+        if (st.st_ino, st.st_size, st.st_mtime_ns) != (ino, size, mtime_ns):
+            return None
+        return bytes(self.buffer[offset:offset + size])
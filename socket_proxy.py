@@ -3,64 +3,494 @@ import socket
 import threading
 import time
 import sys
+import json
+import random
 import logging
+import argparse
+import posixpath
+from urllib.parse import quote, unquote
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from http_io import RequestLimits, RequestReader, RequestError, send_response
+from sharding import HashRing, VNODES, REPLICAS, ring_hash, placement
 
+# Batas waktu connect/recv ke backend (detik)
+BACKEND_TIMEOUT = 30.0
+# Lock per nama file, dibagi ke sejumlah stripe
+LOCK_STRIPES = 256
+# Header dari klien yang ikut diteruskan ke backend
+FORWARD_HEADERS = ('content-type', 'if-none-match', 'accept')
+# Upload ke replika dikirim paralel lewat pool ini
+FANOUT_WORKERS = 32
+# Endpoint backend yang mencakup semua file (tidak bisa di-shard)
+SPANNING_PATHS = ('/_search', '/_changes')
+
+limits = RequestLimits()
+
+
+def respond(status, reason, body=b'', headers=None):
+	"""
+	Response made by the proxy itself (not relayed from a backend).
+	"""
+	if not isinstance(body, bytes):
+		body = body.encode()
+	date_str = datetime.now(timezone.utc).strftime('%a, %d %b %Y %H:%M:%S GMT')
+	lines = [f"HTTP/1.0 {status} {reason}", f"Date: {date_str}", "Server: myproxy/1.0",
+		"Connection: close", f"Content-Length: {len(body)}"]
+	for key, val in (headers or {}).items():
+		lines.append(f"{key}: {val}")
+	return ('\r\n'.join(lines) + '\r\n\r\n').encode() + body
+
+def json_response(status, reason, data):
+	return respond(status, reason, json.dumps(data, indent=2) + '\n', {'Content-Type': 'application/json'})
+
+def with_header(head, name, value):
+	return head + f"\r\n{name}: {value}".encode()
+
+def parse_node(text):
+	host, sep, port = text.strip().rpartition(':')
+	if not sep or not host or not port.isdigit():
+		raise ValueError(f"expected host:port, got '{text.strip()}'")
+	return f"{host}:{int(port)}"
+
+
+class Backend:
+	"""
+	HTTP/1.0 client for one backend node, one connection per request.
+	Paths are file names as stored (e.g. with spaces) and are
+	percent-encoded on the request line. Connection problems and
+	malformed replies raise OSError.
+	"""
+	def __init__(self, node):
+		host, port = node.rsplit(':', 1)
+		self.node = node
+		self.address = (host, int(port))
+
+	def open(self, method, path, body=b'', headers=None):
+		"""
+		Send a request and read up to the end of the response headers.
+		Returns (sock, status, head, rest); the caller closes sock.
+		"""
+		lines = [f"{method} {quote(path)} HTTP/1.0", f"Host: {self.node}"]
+		for key, val in (headers or {}).items():
+			lines.append(f"{key}: {val}")
+		if body or method == 'POST':
+			lines.append(f"Content-Length: {len(body)}")
+		request = ('\r\n'.join(lines) + '\r\n\r\n').encode() + body
+
+		sock = socket.create_connection(self.address, timeout=BACKEND_TIMEOUT)
+		try:
+			sock.sendall(request)
+			buffer = b''
+			while b'\r\n\r\n' not in buffer:
+				if len(buffer) > limits.max_header_bytes:
+					raise ConnectionError(f"{self.node}: response headers too large")
+				chunk = sock.recv(65536)
+				if not chunk:
+					raise ConnectionError(f"{self.node} closed the connection before responding")
+				buffer += chunk
+			head, _, rest = buffer.partition(b'\r\n\r\n')
+			try:
+				status = int(head.split(b' ', 2)[1])
+			except (IndexError, ValueError):
+				raise ConnectionError(f"{self.node} sent a malformed response")
+		except BaseException:
+			sock.close()
+			raise
+		return sock, status, head, rest
+
+	def request(self, method, path, body=b'', headers=None):
+		"""
+		Complete request; returns (status, head, body).
+		"""
+		sock, status, head, rest = self.open(method, path, body, headers)
+		parts = [rest]
+		with sock:
+			while True:
+				chunk = sock.recv(65536)
+				if not chunk:
+					break
+				parts.append(chunk)
+		return status, head, b''.join(parts)
+
+	def exists(self, key):
+		"""
+		Whether `key` is a file on this node (POST /_batch/stat).
+		"""
+		status, _, body = self.request('POST', '/_batch/stat', json.dumps([key]).encode(),
+			{'Content-Type': 'application/json'})
+		if status != 200:
+			raise ConnectionError(f"{self.node}: /_batch/stat answered {status}")
+		result = json.loads(body.split(b'\n', 1)[0])
+		return result.get('status') == 200 and result.get('type') == 'file'
+
+	def walk(self):
+		"""
+		Yield the path of every file on this node, following the
+		plain-text directory listings from / down.
+		"""
+		stack = ['/']
+		while stack:
+			current = stack.pop()
+			status, _, body = self.request('GET', current)
+			if status != 200:
+				raise ConnectionError(f"{self.node}: listing {current} answered {status}")
+			# Dua baris pertama listing adalah judul dan garis
+			for name in body.decode('utf-8', 'replace').split('\n')[2:]:
+				if name.endswith('/'):
+					stack.append(current + name)
+				elif name:
+					yield current + name
+
+
+class ShardedProxy:
+	"""
+	Front tier for N backend nodes (server_process_pool_http.py or any
+	other mode). Every file name (the key, e.g. /a/b.jpg) is stored on
+	`replicas` nodes picked by a consistent-hash ring:
+	  POST /upload/<name>     written to every replica in parallel; 201
+	                          once write_quorum of them have it
+	  GET /<name>             read from a random replica, the others on
+	                          failure or 404
+	  DELETE /<name>          removed from every replica
+	  GET /_proxy/nodes       ring, share of keys per node, rebalance state
+	  POST /_proxy/nodes      add a node (body "host:port") and rebalance
+	  POST /_proxy/rebalance  move/restore copies to match the ring
+	Listings, /_search, /_batch and /_changes span every node and are
+	answered with 501.
+
+	A rebalance walks every node, and for each key copies it to owners
+	that miss it, then drops it from nodes that no longer own it. Keys
+	are locked (striped) against uploads and deletes while they move;
+	while it runs, reads that miss on the owners try every node.
+	"""
+	def __init__(self, nodes, replicas=REPLICAS, vnodes=VNODES, write_quorum=None):
+		self.ring = HashRing(nodes, vnodes)
+		self.replicas = replicas
+		self.write_quorum = write_quorum or replicas
+		self.pool = ThreadPoolExecutor(max_workers=FANOUT_WORKERS)
+		self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+		self.state_lock = threading.Lock()
+		self.rebalancing = None
+		self.last_rebalance = None
+
+	def lock_for(self, key):
+		return self.locks[ring_hash(key) % LOCK_STRIPES]
+
+	@staticmethod
+	def key(path):
+		#key = nama file apa adanya, sama dengan hasil Backend.walk()
+		return posixpath.normpath('/' + unquote(path).lstrip('/'))
+
+	def handle(self, header_part, body):
+		"""
+		Answer one request: bytes, or an iterable relaying a backend's
+		response (for send_response).
+		"""
+		lines = header_part.decode('utf-8', 'ignore').split('\r\n')
+		try:
+			method, target = lines[0].split()[:2]
+		except ValueError:
+			return respond(400, 'Bad Request', 'Malformed request')
+		method = method.upper()
+		headers = {}
+		for line in lines[1:]:
+			name, sep, val = line.partition(':')
+			if sep and name.strip().lower() in FORWARD_HEADERS:
+				headers[name.strip()] = val.strip()
+		path = target.split('?', 1)[0]
+
+		if path in ('/_proxy/nodes', '/_proxy/rebalance'):
+			if path == '/_proxy/nodes' and method == 'GET':
+				return json_response(200, 'OK', self.describe())
+			if path == '/_proxy/nodes' and method == 'POST':
+				return self.add_node(body)
+			if method == 'POST':
+				return self.start_rebalance('repair')
+			return respond(405, 'Method Not Allowed')
+		if path in SPANNING_PATHS or path.startswith('/_batch/') or path.endswith('/'):
+			return respond(501, 'Not Implemented', 'Not available through the sharded proxy\n')
+
+		if method == 'POST':
+			if not path.startswith('/upload/'):
+				return respond(400, 'Bad Request', 'Uploads must go to /upload/<filename>')
+			key = self.key(path[len('/upload'):])
+			return self.write(key, body, headers) if key != '/' else respond(400, 'Bad Request')
+		if method == 'GET':
+			return self.read(self.key(path), headers)
+		if method == 'DELETE':
+			return self.delete(self.key(path))
+		return respond(405, 'Method Not Allowed')
+
+	def fan_out(self, nodes, method, path, body=b'', headers=None):
+		"""
+		Same request to several nodes at once: {node: (status, head, body)
+		or the OSError it failed with}.
+		"""
+		futures = {node: self.pool.submit(Backend(node).request, method, path, body, headers)
+			for node in nodes}
+		results = {}
+		for node, future in futures.items():
+			try:
+				results[node] = future.result()
+			except OSError as e:
+				results[node] = e
+		return results
+
+	def write(self, key, body, headers):
+		# Owners are read under the key's lock: a rebalance takes every
+		# lock once after switching rings, so no upload lands on the old ring
+		# after it started listing the nodes
+		with self.lock_for(key):
+			owners = self.ring.owners(key, self.replicas)
+			results = self.fan_out(owners, 'POST', '/upload' + key, body, headers)
+		acked = [node for node, r in results.items() if not isinstance(r, OSError) and r[0] < 300]
+		failed = {node: (str(r) if isinstance(r, OSError) else f"HTTP {r[0]}")
+			for node, r in results.items() if node not in acked}
+		if failed:
+			logging.warning(f"Upload {key}: not stored on {failed}; POST /_proxy/rebalance restores it")
+		if len(acked) < min(self.write_quorum, len(owners)):
+			return json_response(502, 'Bad Gateway', {'key': key, 'stored': acked, 'failed': failed})
+		status, head, reply = results[acked[0]]
+		return with_header(head, 'X-Replicas', ','.join(acked)) + b'\r\n\r\n' + reply
+
+	def read(self, key, headers):
+		ring = self.ring
+		nodes = ring.owners(key, self.replicas)
+		random.shuffle(nodes)
+		if self.rebalancing is not None:
+			# Selama rebalance file bisa masih ada di node lama
+			nodes += [node for node in ring.nodes if node not in nodes]
+		not_found = False
+		for node in nodes:
+			try:
+				sock, status, head, rest = Backend(node).open('GET', key, headers=headers)
+			except OSError as e:
+				logging.warning(f"Read {key}: {node} failed: {e}")
+				continue
+			if status == 404 or status >= 500:
+				not_found = not_found or status == 404
+				sock.close()
+				continue
+			return self.relay(sock, with_header(head, 'X-Served-By', node), rest)
+		if not_found:
+			return respond(404, 'Not Found')
+		return respond(502, 'Bad Gateway', f"No replica of {key} reachable\n")
+
+	@staticmethod
+	def relay(sock, head, rest):
+		with sock:
+			yield head + b'\r\n\r\n' + rest
+			while True:
+				chunk = sock.recv(65536)
+				if not chunk:
+					return
+				yield chunk
+
+	def delete(self, key):
+		with self.lock_for(key):
+			ring = self.ring
+			nodes = ring.owners(key, self.replicas)
+			if self.rebalancing is not None:
+				nodes += [node for node in ring.nodes if node not in nodes]
+			results = self.fan_out(nodes, 'DELETE', key)
+		deleted = [node for node, r in results.items() if not isinstance(r, OSError) and r[0] < 300]
+		failed = {node: (str(r) if isinstance(r, OSError) else f"HTTP {r[0]}")
+			for node, r in results.items()
+			if node not in deleted and (isinstance(r, OSError) or r[0] != 404)}
+		if failed:
+			return json_response(502, 'Bad Gateway', {'key': key, 'deleted': deleted, 'failed': failed})
+		if not deleted:
+			return respond(404, 'Not Found')
+		return respond(204, 'No Content', b'', {'X-Replicas': ','.join(deleted)})
+
+	# Ring membership and rebalancing
+
+	def describe(self):
+		ring = self.ring
+		return {
+			'nodes': list(ring.nodes),
+			'replicas': self.replicas,
+			'write_quorum': self.write_quorum,
+			'vnodes': ring.vnodes,
+			'share': {node: round(share, 4) for node, share in ring.share().items()},
+			'rebalance': self.rebalancing,
+			'last_rebalance': self.last_rebalance,
+		}
+
+	def add_node(self, body):
+		try:
+			node = parse_node(body.decode())
+		except (ValueError, UnicodeDecodeError) as e:
+			return respond(400, 'Bad Request', f"{e}\n")
+		if node in self.ring.nodes:
+			return respond(409, 'Conflict', f"{node} is already in the ring\n")
+		try:
+			Backend(node).request('GET', '/')
+		except OSError as e:
+			return respond(502, 'Bad Gateway', f"{node} is not reachable: {e}\n")
+		return self.start_rebalance(f"add {node}", node)
+
+	def start_rebalance(self, reason, new_node=None):
+		with self.state_lock:
+			if self.rebalancing is not None:
+				return respond(409, 'Conflict', 'A rebalance is already running\n')
+			if new_node is not None:
+				self.ring = self.ring.with_node(new_node)
+				logging.warning(f"Added {new_node} to the ring; pass it with --backend on the next start")
+			self.rebalancing = progress = {'reason': reason, 'started': time.time(), 'finished': None,
+				'keys': None, 'checked': 0, 'copied': 0, 'dropped': 0, 'failed': 0,
+			'unreachable': [], 'error': None}
+		threading.Thread(target=self.rebalance, args=(self.ring, progress), daemon=True).start()
+		return json_response(202, 'Accepted', self.describe())
+
+	def rebalance(self, ring, progress):
+		logging.warning(f"Rebalance ({progress['reason']}) started over {len(ring.nodes)} nodes")
+		try:
+			# Tunggu upload/delete yang masih memakai ring lama
+			for lock in self.locks:
+				with lock:
+					pass
+			holders = {}
+			for node in ring.nodes:
+				try:
+					for key in Backend(node).walk():
+						holders.setdefault(key, []).append(node)
+				except (OSError, ValueError) as e:
+					#node lain tetap diproses; salinan tidak dihapus selama
+					#copy ke node ini gagal, jadi tidak ada data yang hilang
+					progress['unreachable'].append(node)
+					logging.warning(f"Rebalance: cannot list {node}: {e}")
+			progress['keys'] = len(holders)
+			for key, nodes in holders.items():
+				self.settle(ring, key, nodes, progress)
+				progress['checked'] += 1
+		except (OSError, ValueError) as e:
+			progress['error'] = str(e)
+			logging.error(f"Rebalance stopped: {e}")
+		finally:
+			progress['finished'] = time.time()
+			logging.warning(f"Rebalance ({progress['reason']}) done: {progress['checked']} keys checked, "
+				f"{progress['copied']} copies made, {progress['dropped']} dropped, "
+				f"{progress['failed']} failed, {len(progress['unreachable'])} nodes unreachable "
+				f"in {progress['finished'] - progress['started']:.1f}s")
+			with self.state_lock:
+				self.rebalancing = None
+				self.last_rebalance = progress
+
+	def settle(self, ring, key, holders, progress):
+		"""
+		Put one key where the ring wants it. Runs under the key's lock and
+		re-checks the owners first: the key may have been uploaded or
+		deleted since the nodes were listed.
+		"""
+		owners, copy_to, drop_from = placement(ring, key, holders, self.replicas)
+		if not copy_to and not drop_from:
+			return
+		with self.lock_for(key):
+			try:
+				copy_to = [node for node in copy_to if not Backend(node).exists(key)]
+				data = None
+				if copy_to:
+					# Salinan di owner paling baru: upload selama rebalance ke sana
+					for node in sorted(holders, key=lambda n: n not in owners):
+						status, _, body = Backend(node).request('GET', key)
+						if status == 200:
+							data = body
+							break
+					if data is None:
+						return
+				for node in copy_to:
+					status, _, _ = Backend(node).request('POST', '/upload' + key, data)
+					if status >= 300:
+						raise ConnectionError(f"{node}: upload of {key} answered {status}")
+					progress['copied'] += 1
+				for node in drop_from:
+					status, _, _ = Backend(node).request('DELETE', key)
+					if status >= 300 and status != 404:
+						raise ConnectionError(f"{node}: delete of {key} answered {status}")
+					progress['dropped'] += 1
+			except (OSError, ValueError) as e:
+				# Salinan lama dibiarkan; rebalance berikutnya mencoba lagi
+				progress['failed'] += 1
+				logging.warning(f"Rebalance {key}: {e}")
 
 
 class ProcessTheClient(threading.Thread):
-	def __init__(self, connection, address, destination_sock_address):
-		self.destination_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		self.destination_sock.connect(destination_sock_address)
+	def __init__(self, connection, address, proxy):
 		self.connection = connection
 		self.address = address
-		threading.Thread.__init__(self)
+		self.proxy = proxy
+		threading.Thread.__init__(self, daemon=True)
 
 	def run(self):
-		rcv=""
-		while True:
+		try:
+			reader = RequestReader(self.connection, limits, recv_size=65536)
 			try:
-				data = self.connection.recv(8192)
-				if data:
-					self.destination_sock.sendall(data)
-					data_balasan = self.destination_sock.recv(8192)
-					self.connection.sendall(data_balasan)
-					logging.warning(data)
-					logging.warning(data_balasan)
-
-				else:
-					break
-			except OSError as e:
-				pass
-		self.connection.close()
+				head = reader.read_head()
+				if head is None:
+					return
+				header_part, spill, headers = head
+				body = reader.read_body(headers, spill)
+			except RequestError as e:
+				logging.warning(f"[{self.address}] Rejected request: {e}")
+				send_response(self.connection, respond(e.status, e.reason, e.message), limits)
+				return
+			send_response(self.connection, self.proxy.handle(header_part, body), limits)
+		except OSError as e:
+			logging.error(f"[{self.address}] Connection error: {e}")
+		except Exception as e:
+			logging.error(f"[{self.address}] Unexpected error: {e}")
+		finally:
+			self.connection.close()
 
 
 
 class Server(threading.Thread):
-	def __init__(self):
-		self.the_clients = []
+	def __init__(self, proxy, host='0.0.0.0', port=18000, backlog=128):
+		self.proxy = proxy
 		self.my_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 		self.my_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-		self.destination_sock_address = ('localhost',8889)
-		threading.Thread.__init__(self)
+		self.my_socket.bind((host, port))
+		self.my_socket.listen(backlog)
+		logging.warning(f"Sharded proxy on {host}:{port}: {', '.join(proxy.ring.nodes)} "
+			f"(replicas={proxy.replicas}, write_quorum={proxy.write_quorum})")
+		threading.Thread.__init__(self, daemon=True)
 
 	def run(self):
-		self.my_socket.bind(('0.0.0.0', 18000))
-		self.my_socket.listen(1)
 		while True:
-			self.connection, self.client_address = self.my_socket.accept()
-			logging.warning("connection from {}".format(self.client_address))
-
-			clt = ProcessTheClient(self.connection, self.client_address,self.destination_sock_address)
+			connection, client_address = self.my_socket.accept()
+			clt = ProcessTheClient(connection, client_address, self.proxy)
 			clt.start()
-			self.the_clients.append(clt)
 
 
 
-def main():
-	svr = Server()
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Sharded, replicated front tier for progjar HTTP servers')
+	parser.add_argument('-b', '--backend', dest='backends', action='append', type=parse_node,
+		metavar='HOST:PORT', help='backend node (repeatable, default localhost:8889)')
+	parser.add_argument('--host', default='0.0.0.0')
+	parser.add_argument('--port', type=int, default=18000)
+	parser.add_argument('--replicas', type=int, default=REPLICAS, help='copies kept of every file')
+	parser.add_argument('--write-quorum', dest='write_quorum', type=int,
+		help='replicas that must store an upload before it succeeds (default: all)')
+	parser.add_argument('--vnodes', type=int, default=VNODES, help='ring points per node')
+	parser.add_argument('--rebalance', action='store_true',
+		help='rebalance at startup (after changing --backend)')
+	args = parser.parse_args(argv)
+	logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+
+	proxy = ShardedProxy(args.backends or ['localhost:8889'], args.replicas, args.vnodes, args.write_quorum)
+	svr = Server(proxy, args.host, args.port)
 	svr.start()
+	if args.rebalance:
+		proxy.start_rebalance('startup')
+	try:
+		while svr.is_alive():
+			svr.join(1.0)
+	except KeyboardInterrupt:
+		logging.warning("Proxy stopped")
+	return 0
 
 if __name__=="__main__":
-	main()
-
+	sys.exit(main())
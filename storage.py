@@ -0,0 +1,200 @@
+import os
+import fcntl
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# Directory under the docroot that holds stored objects (content store)
+OBJECTS_DIR = '.objects'
+# Suffix of the short-lived links made while a name is being replaced
+LINK_SUFFIX = '.cas-link'
+STORAGE_BACKENDS = ('plain', 'cas')
+
+HASH_BLOCK = 1024 * 1024
+# Remembered digests of files on disk, keyed by (dev, inode, mtime, size)
+DIGEST_CACHE_SIZE = 4096
+
+
+class PlainStorage:
+    """
+    Every upload is written as a full file under its own name.
+    """
+    def __init__(self, basedir):
+        self.basedir = basedir
+
+    def write(self, fs_path, data: bytes):
+        os.makedirs(os.path.dirname(fs_path), exist_ok=True)
+        # A name left over from 'cas' storage shares its inode; never
+        # overwrite that in place
+        if os.path.exists(fs_path) and os.stat(fs_path).st_nlink > 1:
+            os.remove(fs_path)
+        with open(fs_path, 'wb') as f:
+            f.write(data)
+        return None
+
+    def remove(self, fs_path):
+        os.remove(fs_path)
+
+    def etag(self, fs_path):
+        return None
+
+    def reserved(self, fs_path):
+        return False
+
+
+class ContentStore:
+    """
+    Content-addressed storage: each distinct content is stored once as
+    .objects/<aa>/<sha256> and user-visible names are hardlinks to it.
+
+     - write: hash the body; if the object exists, only link the name to
+       it (no data written), otherwise store the object first
+     - remove: unlink the name; once only the object's own link is left
+       (st_nlink == 1) the object is deleted too
+     - etag: the sha256 of the content, cached per inode
+
+    Objects are never modified in place: replacing a name swaps the link
+    with os.replace(). Link/unlink steps hold a thread lock plus flock()
+    on .objects/.lock, so worker processes sharing the docroot agree.
+    """
+    def __init__(self, basedir):
+        self.basedir = basedir
+        self.objects = os.path.join(basedir, OBJECTS_DIR)
+        os.makedirs(self.objects, exist_ok=True)
+        self.lock_path = os.path.join(self.objects, '.lock')
+        self.lock = threading.Lock()
+        self.digests = {}
+
+    @contextmanager
+    def locked(self):
+        with self.lock:
+            with open(self.lock_path, 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def object_path(self, digest):
+        return os.path.join(self.objects, digest[:2], digest)
+
+    def reserved(self, fs_path):
+        return (fs_path == self.objects or fs_path.startswith(self.objects + os.sep)
+                or fs_path.endswith(LINK_SUFFIX))
+
+    def write(self, fs_path, data: bytes):
+        """
+        Store `data` under fs_path and return its sha256 hex digest.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        obj = self.object_path(digest)
+        os.makedirs(os.path.dirname(fs_path), exist_ok=True)
+
+        with self.locked():
+            try:
+                if os.path.samefile(obj, fs_path):
+                    return digest
+            except FileNotFoundError:
+                pass
+            if not os.path.exists(obj):
+                self.store_object(obj, data)
+            self.link(obj, fs_path)
+        self.remember(os.stat(fs_path), digest)
+        return digest
+
+    def store_object(self, obj, data: bytes):
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(obj), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # Objects are shared by every name that links to them
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, obj)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def link(self, obj, fs_path):
+        """
+        Point fs_path at obj, atomically replacing whatever was there.
+        """
+        tmp = os.path.join(os.path.dirname(fs_path),
+                           f".{os.path.basename(fs_path)}.{os.getpid()}.{threading.get_ident()}{LINK_SUFFIX}")
+        os.link(obj, tmp)
+        old = self.linked_object(fs_path)
+        os.replace(tmp, fs_path)
+        self.collect(old)
+
+    def remove(self, fs_path):
+        with self.locked():
+            old = self.linked_object(fs_path)
+            os.remove(fs_path)
+            self.collect(old)
+
+    def linked_object(self, fs_path):
+        """
+        (object path, stat) of the object fs_path links to, or None if
+        fs_path does not exist or shares its inode with nothing else
+        (a file that never came through the store).
+        """
+        try:
+            st = os.stat(fs_path)
+        except FileNotFoundError:
+            return None
+        if st.st_nlink < 2:
+            return None
+        return self.object_path(self.digest(fs_path, st)), st
+
+    def collect(self, linked):
+        """
+        Drop an object once the last name linking to it is gone.
+        """
+        if linked is None:
+            return
+        obj, st = linked
+        try:
+            ost = os.stat(obj)
+        except FileNotFoundError:
+            return
+        if (ost.st_dev, ost.st_ino) == (st.st_dev, st.st_ino) and ost.st_nlink == 1:
+            os.remove(obj)
+
+    @staticmethod
+    def cache_key(st):
+        return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def remember(self, st, digest):
+        if len(self.digests) >= DIGEST_CACHE_SIZE:
+            self.digests.clear()
+        self.digests[self.cache_key(st)] = digest
+
+    def digest(self, fs_path, st):
+        """
+        sha256 of the file at fs_path, computed once per (inode, mtime,
+        size) and cached.
+        """
+        digest = self.digests.get(self.cache_key(st))
+        if digest is None:
+            h = hashlib.sha256()
+            with open(fs_path, 'rb') as f:
+                for block in iter(lambda: f.read(HASH_BLOCK), b''):
+                    h.update(block)
+            digest = h.hexdigest()
+            self.remember(st, digest)
+        return digest
+
+    def etag(self, fs_path):
+        """
+        Strong ETag: the content hash.
+        """
+        return f'"{self.digest(fs_path, os.stat(fs_path))}"'
+
+
+def open_storage(kind, basedir):
+    if kind == 'cas':
+        return ContentStore(basedir)
+    if kind == 'plain':
+        return PlainStorage(basedir)
+    raise ValueError(f"Unknown storage '{kind}', expected one of: {', '.join(STORAGE_BACKENDS)}")
@@ -0,0 +1,133 @@
+import sys
+import threading
+
+# PEP 734 interpreters: concurrent.interpreters from 3.14. 3.13 has the
+# same API only as test.support.interpreters, CPython's internal test
+# helper with no compatibility promise, so it is used only on request
+# (use_test_support()). Older versions have no per-interpreter GIL.
+try:
+    from concurrent import interpreters
+    QUEUES_MODULE = 'concurrent.interpreters'
+    create_queue = interpreters.create_queue
+except ImportError:
+    interpreters = create_queue = QUEUES_MODULE = None
+
+FREE_THREADED = 'free-threaded'
+SUBINTERPRETERS = 'subinterpreters'
+THREADS = 'threads'
+
+# Run in a worker for each request: `handle` comes from the setup code,
+# `raw` from prepare_main()
+HANDLE = "results.put_nowait(handle(raw))\ndel raw"
+
+
+def free_threaded():
+    """
+    True on a free-threaded build running with the GIL disabled.
+    """
+    return hasattr(sys, '_is_gil_enabled') and not sys._is_gil_enabled()
+
+
+def execution_model():
+    """
+    Best way to run CPU-bound handlers in parallel here: plain threads
+    when there is no GIL, else subinterpreters, else (GIL-bound) threads.
+    """
+    if free_threaded():
+        return FREE_THREADED
+    if interpreters is not None:
+        return SUBINTERPRETERS
+    return THREADS
+
+
+def use_test_support():
+    """
+    Opt in to 3.13's test.support.interpreters where concurrent.interpreters
+    is missing. Returns whether subinterpreters are available now.
+    """
+    global interpreters, create_queue, QUEUES_MODULE
+    if interpreters is None:
+        try:
+            from test.support import interpreters as module
+            from test.support.interpreters.queues import create
+        except ImportError:
+            return False
+        interpreters, create_queue = module, create
+        QUEUES_MODULE = 'test.support.interpreters.queues'
+    return True
+
+
+def new_queue():
+    try:
+        # 3.13: pass shareable objects (bytes) without pickling them
+        return create_queue(syncobj=True)
+    except TypeError:
+        return create_queue()
+
+
+class InterpreterPool:
+    """
+    Fixed set of subinterpreters, each with its own GIL, running one call
+    at a time. run() checks an idle interpreter out, binds the request
+    with prepare_main() and execs HANDLE in it from the calling thread:
+    that thread blocks while the handler runs under the worker's own GIL,
+    so up to `count` handlers run in parallel. The result is already in
+    the worker's queue when exec() returns.
+
+    `setup` runs once per interpreter with `shared` (shareable values:
+    str, bytes, int, None, memoryview) bound in its __main__ and must
+    define handle(raw) -> bytes.
+    """
+    def __init__(self, count, setup, shared):
+        self.cond = threading.Condition()
+        self.closed = False
+        self.workers = []
+        try:
+            for _ in range(count):
+                interp = interpreters.create()
+                self.workers.append((interp, None))
+                interp.exec(f"import {QUEUES_MODULE}")
+                results = new_queue()
+                interp.prepare_main(shared, results=results)
+                interp.exec(setup)
+                self.workers[-1] = (interp, results)
+        except BaseException:
+            self.destroy()
+            raise
+        self.idle = list(self.workers)
+
+    def run(self, raw):
+        """
+        Result of handle(raw) in a worker, or None once the pool is closed.
+        """
+        with self.cond:
+            while not self.idle and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                return None
+            interp, results = self.idle.pop()
+        try:
+            interp.prepare_main(raw=raw)
+            interp.exec(HANDLE)
+            return results.get_nowait()
+        finally:
+            with self.cond:
+                self.idle.append((interp, results))
+                self.cond.notify_all()
+
+    def close(self):
+        """
+        Refuse new calls, wait for running ones, then destroy the workers.
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+            self.cond.wait_for(lambda: len(self.idle) == len(self.workers))
+        self.destroy()
+
+    def destroy(self):
+        # Newest first: destroying them in creation order can crash 3.13
+        # once they have imported extension modules
+        for interp, _ in reversed(self.workers):
+            interp.close()
+        self.workers = []
@@ -0,0 +1,64 @@
+import unittest
+from sharding import HashRing, placement
+
+NODES = [f"10.0.0.{i}:8889" for i in range(1, 5)]
+KEYS = [f"/dir{i % 7}/file{i}.bin" for i in range(4000)]
+
+
+class HashRingTest(unittest.TestCase):
+    def test_owners_are_distinct(self):
+        ring = HashRing(NODES)
+        for key in KEYS[:500]:
+            owners = ring.owners(key, 3)
+            self.assertEqual(len(owners), 3)
+            self.assertEqual(len(set(owners)), 3)
+        # Never more owners than nodes
+        self.assertEqual(len(HashRing(NODES[:2]).owners('/a', 3)), 2)
+        self.assertEqual(HashRing().owners('/a', 2), [])
+
+    def test_owners_are_stable(self):
+        ring = HashRing(NODES)
+        again = HashRing(reversed(NODES))
+        for key in KEYS[:200]:
+            self.assertEqual(ring.owners(key, 2), again.owners(key, 2))
+
+    def test_share_sums_to_one(self):
+        share = HashRing(NODES).share()
+        self.assertEqual(set(share), set(NODES))
+        self.assertAlmostEqual(sum(share.values()), 1.0)
+        self.assertEqual(HashRing(NODES[:1]).share(), {NODES[0]: 1.0})
+
+    def test_adding_a_node_moves_about_one_nth(self):
+        ring = HashRing(NODES)
+        bigger = ring.with_node('10.0.0.5:8889')
+        moved = [key for key in KEYS if ring.owners(key, 1) != bigger.owners(key, 1)]
+        # Only keys taken over by the new node move, roughly 1/5 of them
+        for key in moved:
+            self.assertEqual(bigger.owners(key, 1), ['10.0.0.5:8889'])
+        self.assertAlmostEqual(len(moved) / len(KEYS), 1 / 5, delta=0.07)
+
+
+class PlacementTest(unittest.TestCase):
+    def test_settled_key_needs_nothing(self):
+        ring = HashRing(NODES)
+        owners = ring.owners('/a.txt', 2)
+        self.assertEqual(placement(ring, '/a.txt', owners, 2), (owners, [], []))
+
+    def test_copies_before_dropping(self):
+        ring = HashRing(NODES)
+        for key in KEYS[:300]:
+            owners = ring.owners(key, 2)
+            stray = next(node for node in NODES if node not in owners)
+            holders = [stray, owners[0]]
+            result_owners, copy_to, drop_from = placement(ring, key, holders, 2)
+            self.assertEqual(result_owners, owners)
+            self.assertEqual(copy_to, [owners[1]])
+            self.assertEqual(drop_from, [stray])
+            # After copying, the key is on every owner before anything goes
+            after_copy = set(holders) | set(copy_to)
+            self.assertTrue(set(owners) <= after_copy)
+            self.assertTrue(after_copy - set(drop_from) == set(owners))
+
+
+if __name__ == '__main__':
+    unittest.main()